@@ -94,7 +94,7 @@ args = dict(
 
     license='Apache License 2.0',
     
-    python_requires='>=3',
+    python_requires='>=3.5.2',
 
     packages=find_packages(exclude=("test",)),
 
@@ -114,7 +114,14 @@ args = dict(
             'sockeye-translate = sockeye.translate:main',
             'sockeye-average = sockeye.average:main',
             'sockeye-embeddings = sockeye.embeddings:main',
-            'sockeye-evaluate = sockeye.evaluate:main'
+            'sockeye-evaluate = sockeye.evaluate:main',
+            'sockeye-lexicon = sockeye.lexicon:main',
+            'sockeye-translation-memory = sockeye.translation_memory:main',
+            'sockeye-serve = sockeye.serve:main',
+            'sockeye-score = sockeye.score:main',
+            'sockeye-quantize = sockeye.quantize:main',
+            'sockeye-mmap-params = sockeye.mmap_params:main',
+            'sockeye-benchmark = sockeye.benchmark:main'
         ],
     },
 
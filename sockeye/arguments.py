@@ -114,6 +114,289 @@ def add_average_args(params):
         help="selection method. Default: %(default)s.")
 
 
+def add_quantize_args(params):
+    quantize_params = params.add_argument_group("Quantization")
+    quantize_params.add_argument(
+        "input",
+        metavar="INPUT",
+        type=str,
+        help="Parameter file or model directory (best checkpoint).")
+    quantize_params.add_argument(
+        "--output", "-o", required=True, type=str, help="File to write quantized parameters to.")
+    quantize_params.add_argument(
+        "--dtype",
+        default=C.QUANTIZE_INT8,
+        choices=C.QUANTIZE_TYPES,
+        help="Storage type of quantized matrices. int8: 8 bits per value with a scale and zero point per row. "
+             "Default: %(default)s.")
+    quantize_params.add_argument(
+        "--params",
+        nargs="+",
+        default=None,
+        help="Names of the parameters to quantize. Default: the embedding and output layer weights (%s)."
+             % ", ".join(C.QUANTIZE_DEFAULT_PARAMS))
+    quantize_params.add_argument(
+        "--min-size",
+        type=int_greater_or_equal(1),
+        default=C.QUANTIZE_MIN_SIZE,
+        help="Minimum number of elements of quantized matrices. Default: %(default)s.")
+
+
+def add_mmap_params_args(params):
+    mmap_params = params.add_argument_group("Memory-mapped parameters")
+    mmap_params.add_argument(
+        "model",
+        metavar="MODEL",
+        type=str,
+        help="Model directory.")
+    mmap_params.add_argument(
+        "--checkpoint", "-c",
+        type=int,
+        default=None,
+        help="Checkpoint to convert. Default: best checkpoint.")
+    mmap_params.add_argument(
+        "--benchmark",
+        type=int_greater_or_equal(1),
+        default=None,
+        metavar="N",
+        help="Measure cold and warm startup time of inference models with the parameter file and with the "
+             "memory-mapped parameters, over N startups each. Default: no measurement.")
+
+
+def add_benchmark_args(params):
+    benchmark_params = params.add_argument_group("Benchmark")
+    benchmark_params.add_argument(
+        "--output", "-o",
+        required=True,
+        type=str,
+        help="JSON file to write benchmark results to.")
+    benchmark_params.add_argument(
+        "--architectures",
+        nargs="+",
+        choices=["rnn", "transformer", "conv"],
+        default=["rnn", "transformer", "conv"],
+        help="Model architectures to benchmark. Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--sizes",
+        nargs="+",
+        choices=["tiny", "medium"],
+        default=["tiny"],
+        help="Model sizes to benchmark. Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--beam-sizes",
+        nargs="+",
+        type=int_greater_or_equal(1),
+        default=[1, 5],
+        help="Beam sizes. Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--input-lengths",
+        nargs="+",
+        type=int_greater_or_equal(1),
+        default=[10, 30],
+        help="Number of tokens of the synthetic inputs. Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--ensemble-sizes",
+        nargs="+",
+        type=int_greater_or_equal(1),
+        default=[1],
+        help="Number of models in the ensemble. Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--threads",
+        nargs="+",
+        type=int_greater_or_equal(1),
+        default=[1],
+        help="Number of OpenMP threads (OMP_NUM_THREADS). Each is benchmarked in its own process. "
+             "Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--topk",
+        nargs="+",
+        choices=C.TOPK_TYPES,
+        default=[C.TOPK_HOST],
+        help="Where beam search selects the k-best hypotheses (see --device-topk of sockeye.translate). "
+             "Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--batch-size",
+        type=int_greater_or_equal(1),
+        default=1,
+        help="Batch size. Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--num-sentences",
+        type=int_greater_or_equal(1),
+        default=20,
+        help="Number of sentences per input length. Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--model-dir",
+        type=str,
+        default=None,
+        help="Folder to build synthetic models in and to reuse them from. Default: temporary folder.")
+    benchmark_params.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="Results of a previous benchmark run to compare throughput against. Default: %(default)s.")
+    benchmark_params.add_argument(
+        "--seed",
+        type=int,
+        default=1,
+        help="Random seed for synthetic models and inputs. Default: %(default)s.")
+
+
+def add_lexicon_args(params):
+    lexicon_params = params.add_argument_group("Lexicon")
+    lexicon_params.add_argument(
+        "--input",
+        "-i",
+        required=True,
+        type=str,
+        help="Probabilistic lexicon (fast_align format) to use for building top-k lexicon.")
+    lexicon_params.add_argument(
+        "--model",
+        "-m",
+        required=True,
+        type=str,
+        help="Trained model directory for source and target vocab.")
+    lexicon_params.add_argument(
+        "--output",
+        "-o",
+        required=True,
+        type=str,
+        help="JSON file to write top-k lexicon to.")
+    lexicon_params.add_argument(
+        "-k",
+        type=int_greater_or_equal(1),
+        default=C.LEXICON_TOP_K_DEFAULT,
+        help="Number of target translations to keep per source word. Default: %(default)s.")
+
+
+def add_serve_args(params):
+    serve_params = params.add_argument_group("Server")
+    serve_params.add_argument('--host',
+                              type=str,
+                              default=C.SERVE_HOST,
+                              help='Host to listen on. Default: %(default)s.')
+    serve_params.add_argument('--port',
+                              type=int_greater_or_equal(0),
+                              default=C.SERVE_PORT,
+                              help='TCP port to listen on. Default: %(default)s.')
+    serve_params.add_argument('--unix-socket',
+                              type=str,
+                              default=None,
+                              help='Listen on this Unix socket instead of a TCP port. Default: %(default)s.')
+    serve_params.add_argument('--max-wait-ms',
+                              type=float,
+                              default=C.SERVE_MAX_WAIT_MS,
+                              help='Maximum time in milliseconds a request waits for other requests of similar '
+                                   'length to fill up its batch of --batch-size requests. Default: %(default)s.')
+
+
+def add_score_args(params):
+    score_params = params.add_argument_group("Scoring")
+    score_params.add_argument(
+        "--model",
+        "-m",
+        required=True,
+        type=str,
+        help="Trained model directory.")
+    score_params.add_argument(
+        "--checkpoint",
+        "-c",
+        type=int,
+        default=None,
+        help="Checkpoint to use. Default: best checkpoint.")
+    score_params.add_argument(
+        "--source",
+        "-s",
+        required=True,
+        type=str,
+        help="Source sentences.")
+    score_params.add_argument(
+        "--target",
+        "-t",
+        required=True,
+        type=str,
+        help="Target sentences to score, parallel to the source sentences.")
+    score_params.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default=None,
+        help="File to write one score per line to. Default: STDOUT.")
+    score_params.add_argument(
+        "--batch-size",
+        "-b",
+        type=int_greater_or_equal(1),
+        default=64,
+        help="Number of sentence pairs scored together. Default: %(default)s.")
+    score_params.add_argument(
+        "--max-seq-len",
+        type=multiple_values(num_values=2, greater_or_equal=1),
+        default=None,
+        help="Maximum sequence length in tokens. Longer sentence pairs are not scored. "
+             "Use \"x:x\" to specify separate values for src&tgt. Default: values from model.")
+    score_params.add_argument(
+        "--bucket-width",
+        type=int_greater_or_equal(1),
+        default=10,
+        help="Width of buckets in tokens. Default: %(default)s.")
+    score_params.add_argument(
+        "--normalize",
+        action="store_true",
+        help="Divide scores by the length penalty of the target length. Default: negative log-probabilities.")
+    score_params.add_argument(
+        "--length-penalty-alpha",
+        type=float,
+        default=1.0,
+        help="Alpha factor for the length penalty used with --normalize. Default: %(default)s.")
+    score_params.add_argument(
+        "--length-penalty-beta",
+        type=float,
+        default=0.0,
+        help="Beta factor for the length penalty used with --normalize. Default: %(default)s.")
+
+
+def add_translation_memory_args(params):
+    tm_params = params.add_argument_group("Translation memory")
+    tm_params.add_argument(
+        "--source",
+        "-s",
+        required=True,
+        type=str,
+        help="Source sentences of earlier translations.")
+    tm_params.add_argument(
+        "--target",
+        "-t",
+        required=True,
+        type=str,
+        help="Translations of the source sentences.")
+    tm_params.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default=None,
+        help="Folder to write the translation memory to.")
+    tm_params.add_argument(
+        "--ngram-order",
+        type=int_greater_or_equal(1),
+        default=C.TM_NGRAM_ORDER,
+        help="Order of the n-grams indexed to retrieve candidates. Default: %(default)s.")
+    tm_params.add_argument(
+        "--threshold",
+        type=float,
+        default=C.TM_FUZZY_MATCH_THRESHOLD,
+        help="Fuzzy-match threshold used for benchmarking. Default: %(default)s.")
+    tm_params.add_argument(
+        "--benchmark-sizes",
+        type=int_greater_or_equal(1),
+        nargs="+",
+        default=None,
+        help="Measure lookup latency of translation memories of the first N segments, for each given N.")
+    tm_params.add_argument(
+        "--benchmark-queries",
+        type=int_greater_or_equal(1),
+        default=1000,
+        help="Number of lookups per benchmarked translation memory size. Default: %(default)s.")
+
+
 def add_io_args(params):
     data_params = params.add_argument_group("Data & I/O")
 
@@ -595,11 +878,111 @@ def add_inference_args(params):
                                type=int_greater_or_equal(1),
                                default=5,
                                help='Size of the beam. Default: %(default)s.')
+    decode_params.add_argument('--batch-size',
+                               type=int_greater_or_equal(1),
+                               default=1,
+                               help='Batch size during decoding. Determines how many sentences are translated '
+                                    'simultaneously. Default: %(default)s.')
+    decode_params.add_argument('--chunk-size',
+                               type=int_greater_or_equal(1),
+                               default=None,
+                               help='Size of the chunks of input lines that are read at once, sorted by length and '
+                                    'translated in batches. Outputs are written in the original order. '
+                                    'Default: %d without batching and %d * batch size otherwise.'
+                                    % (C.CHUNK_SIZE_NO_BATCHING, C.CHUNK_SIZE_PER_BATCH_SEGMENT))
+    decode_params.add_argument('--restrict-lexicon',
+                               type=str,
+                               default=None,
+                               help="Top-k lexicon (created with sockeye.lexicon) to restrict the output vocabulary "
+                                    "to the candidate translations of the source words, the %d most frequent target "
+                                    "words, and special symbols. Default: %%(default)s."
+                                    % C.LEXICON_TOP_K_NUM_FREQUENT)
+    decode_params.add_argument('--device-topk',
+                               action='store_true',
+                               help='Select the k-best hypotheses of each beam search step with NDArray operations on '
+                                    'the decoding device and check for finished hypotheses only every %d steps, '
+                                    'instead of copying all scores to the host at each step. MXNet sorts on CPUs, '
+                                    'such that this is usually slower there. Default: on GPUs only.'
+                                    % C.BEAM_SEARCH_FINISHED_CHECK_INTERVAL)
+    decode_params.add_argument('--shrink-beam',
+                               action='store_true',
+                               help='Move finished hypotheses out of the beam and decode only the active ones. The '
+                                    'beam of a sentence shrinks by one for every finished hypothesis, such that later '
+                                    'decoder steps are cheaper. Default: %(default)s.')
+    decode_params.add_argument('--segment-long-inputs',
+                               action='store_true',
+                               help='Split inputs longer than the largest bucket (see --max-input-len) after '
+                                    'punctuation, or into windows of the maximum length if there is none, translate '
+                                    'the pieces together and join their translations. Otherwise long inputs are '
+                                    'truncated. Default: %(default)s.')
+    decode_params.add_argument('--cache',
+                               nargs='?',
+                               const='',
+                               default=None,
+                               help='Cache translations of repeated inputs. Optionally takes the path of an sqlite '
+                                    'database in which translations are persisted across runs. Default: no cache.')
+    decode_params.add_argument('--cache-size',
+                               type=int_greater_or_equal(1),
+                               default=C.TRANSLATION_CACHE_SIZE,
+                               help='Maximum number of translations kept in memory by the cache, evicting the least '
+                                    'recently used ones. Default: %(default)s.')
+    decode_params.add_argument('--translation-memory',
+                               type=str,
+                               default=None,
+                               help='Folder of a translation memory created with sockeye.translation_memory. Inputs '
+                                    'that match a stored source with at least the fuzzy-match threshold are not '
+                                    'translated, but the stored translation is returned. Default: %(default)s.')
+    decode_params.add_argument('--translation-memory-threshold',
+                               type=float,
+                               default=C.TM_FUZZY_MATCH_THRESHOLD,
+                               help='Minimum fuzzy-match score, one minus the token edit distance divided by the '
+                                    'longer length, of a translation retrieved from the translation memory. '
+                                    'Default: %(default)s.')
+    decode_params.add_argument('--max-output-length-num-stds',
+                               type=int,
+                               default=C.DEFAULT_NUM_STD_MAX_OUTPUT_LENGTH,
+                               help='Number of standard deviations of the training target/source length ratio to add '
+                                    'to its mean. The maximum output length of a sentence is its input length times '
+                                    'this value. Default: %(default)s.')
+    decode_params.add_argument('--workers',
+                               type=int_greater_or_equal(1),
+                               default=1,
+                               help='Number of worker processes translating chunks of input in parallel, each with '
+                                    'its own copy of the models. Requires --use-cpu. Default: %(default)s.')
+    decode_params.add_argument('--omp-num-threads',
+                               type=int_greater_or_equal(1),
+                               default=None,
+                               help='Number of OpenMP threads of each worker process. Default: number of CPUs '
+                                    'divided by the number of workers.')
+    decode_params.add_argument('--warm-up',
+                               type=int_greater_or_equal(1),
+                               nargs='*',
+                               default=None,
+                               metavar='LENGTH',
+                               help='Bind executors and run a dummy forward pass for the buckets of the given input '
+                                    'lengths before translating, or for all buckets if no lengths are given. '
+                                    'Default: no warm-up.')
+    decode_params.add_argument('--max-bound-buckets',
+                               type=int_greater_or_equal(1),
+                               default=None,
+                               help='Maximum number of executors kept bound for the encoder and the decoder in '
+                                    'addition to the largest bucket. The least recently used executor is released '
+                                    'when the limit is exceeded. Default: unlimited.')
+    decode_params.add_argument('--mmap-params',
+                               action='store_true',
+                               help='Memory-map parameters converted with sockeye.mmap_params instead of loading '
+                                    'the parameter files, such that processes on the same host share them in the '
+                                    'page cache. Default: %(default)s.')
     decode_params.add_argument('--ensemble-mode',
                                type=str,
                                default='linear',
                                choices=['linear', 'log_linear'],
                                help='Ensemble mode. Default: %(default)s.')
+    decode_params.add_argument('--fuse-ensemble',
+                               action='store_true',
+                               help='Combine ensemble models into one encoder and one decoder graph, such that a '
+                                    'single forward call per step serves all models and they can run in parallel. '
+                                    'Not compatible with --restrict-lexicon. Default: %(default)s.')
     decode_params.add_argument('--max-input-len', '-n',
                                type=int,
                                default=None,
@@ -15,7 +15,7 @@
 Implementations of different attention mechanisms in sequence-to-sequence models.
 """
 import logging
-from typing import Callable, NamedTuple, Optional, Tuple
+from typing import Callable, List, NamedTuple, Optional, Tuple
 
 import mxnet as mx
 
@@ -136,7 +136,8 @@ class Attention(object):
         self._input_previous_word = input_previous_word
         self.prefix = prefix
 
-    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int) -> Callable:
+    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int,
+           source_projections: Optional[List[mx.sym.Symbol]] = None) -> Callable:
         """
         Returns callable to be used for recurrent attention in a sequence decoder.
         The callable is a recurrent function of the form:
@@ -145,6 +146,7 @@ class Attention(object):
         :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
         :param source_length: Shape: (batch_size,).
         :param source_seq_len: Maximum length of source sequences.
+        :param source_projections: Optional precomputed source projections as returned by project_source().
         :return: Attention callable.
         """
 
@@ -160,6 +162,25 @@ class Attention(object):
 
         return attend
 
+    def project_source(self, source: mx.sym.Symbol, source_seq_len: int) -> List[mx.sym.Symbol]:
+        """
+        Returns projections of the source that do not depend on the decoder state.
+        During inference these are computed once per sentence and passed to on() at every decoder step.
+
+        :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
+        :param source_seq_len: Maximum length of source sequences.
+        :return: List of source projections. Shapes: (batch_size, seq_len, num_hidden).
+        """
+        return []
+
+    def source_projection_num_hidden(self) -> List[int]:
+        """
+        Returns the depths of the source projections returned by project_source().
+
+        :return: List of projection depths.
+        """
+        return []
+
     def get_initial_state(self, source_length: mx.sym.Symbol, source_seq_len: int) -> AttentionState:
         """
         Returns initial attention state. Dynamic source encoding is initialized with zeros.
@@ -210,7 +231,8 @@ class BilinearAttention(Attention):
         self.num_hidden = num_hidden
         self.s2t_weight = mx.sym.Variable("%ss2t_weight" % self.prefix)
 
-    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int) -> Callable:
+    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int,
+           source_projections: Optional[List[mx.sym.Symbol]] = None) -> Callable:
         """
         Returns callable to be used for recurrent attention in a sequence decoder.
         The callable is a recurrent function of the form:
@@ -219,17 +241,14 @@ class BilinearAttention(Attention):
         :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
         :param source_length: Shape: (batch_size,).
         :param source_seq_len: Maximum length of source sequences.
+        :param source_projections: Optional precomputed source projections as returned by project_source().
         :return: Attention callable.
         """
 
-        # (batch_size * seq_len, self.num_hidden)
-        source_hidden = mx.sym.FullyConnected(data=mx.sym.reshape(data=source, shape=(-3, -1),
-                                                                  name="%sflat_source" % self.prefix),
-                                              weight=self.s2t_weight, num_hidden=self.num_hidden,
-                                              no_bias=True, name="%ssource_hidden_fc" % self.prefix)
+        if source_projections is None:
+            source_projections = self.project_source(source, source_seq_len)
         # (batch_size, seq_len, self.num_hidden)
-        source_hidden = mx.sym.reshape(source_hidden, shape=(-1, source_seq_len, self.num_hidden),
-                                       name="%ssource_hidden" % self.prefix)
+        source_hidden, = source_projections
 
         def attend(att_input: AttentionInput, att_state: AttentionState) -> AttentionState:
             """
@@ -254,6 +273,32 @@ class BilinearAttention(Attention):
 
         return attend
 
+    def project_source(self, source: mx.sym.Symbol, source_seq_len: int) -> List[mx.sym.Symbol]:
+        """
+        Returns projections of the source that do not depend on the decoder state.
+
+        :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
+        :param source_seq_len: Maximum length of source sequences.
+        :return: List of source projections. Shapes: (batch_size, seq_len, num_hidden).
+        """
+        # (batch_size * seq_len, self.num_hidden)
+        source_hidden = mx.sym.FullyConnected(data=mx.sym.reshape(data=source, shape=(-3, -1),
+                                                                  name="%sflat_source" % self.prefix),
+                                              weight=self.s2t_weight, num_hidden=self.num_hidden,
+                                              no_bias=True, name="%ssource_hidden_fc" % self.prefix)
+        # (batch_size, seq_len, self.num_hidden)
+        source_hidden = mx.sym.reshape(source_hidden, shape=(-1, source_seq_len, self.num_hidden),
+                                       name="%ssource_hidden" % self.prefix)
+        return [source_hidden]
+
+    def source_projection_num_hidden(self) -> List[int]:
+        """
+        Returns the depths of the source projections returned by project_source().
+
+        :return: List of projection depths.
+        """
+        return [self.num_hidden]
+
 
 class DotAttention(Attention):
     """
@@ -285,7 +330,8 @@ class DotAttention(Attention):
         self.t2h_weight = mx.sym.Variable("%st2h_weight" % self.prefix) if self.project else None
         self.s2h_weight = mx.sym.Variable("%ss2h_weight" % self.prefix) if self.project else None
 
-    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int) -> Callable:
+    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int,
+           source_projections: Optional[List[mx.sym.Symbol]] = None) -> Callable:
         """
         Returns callable to be used for recurrent attention in a sequence decoder.
         The callable is a recurrent function of the form:
@@ -294,18 +340,15 @@ class DotAttention(Attention):
         :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
         :param source_length: Shape: (batch_size,).
         :param source_seq_len: Maximum length of source sequences.
+        :param source_projections: Optional precomputed source projections as returned by project_source().
         :return: Attention callable.
         """
 
+        if source_projections is None:
+            source_projections = self.project_source(source, source_seq_len)
         if self.project:
-            # (batch_size * seq_len, self.num_hidden)
-            source_hidden = mx.sym.FullyConnected(
-                data=mx.sym.reshape(data=source, shape=(-3, -1), name="%sflat_source" % self.prefix),
-                weight=self.s2h_weight, num_hidden=self.num_hidden,
-                no_bias=True, name="%ssource_hidden_fc" % self.prefix)
             # (batch_size, seq_len, self.num_hidden)
-            source_hidden = mx.sym.reshape(source_hidden, shape=(-1, source_seq_len, self.num_hidden),
-                                           name="%ssource_hidden" % self.prefix)
+            source_hidden, = source_projections
 
         def attend(att_input: AttentionInput, att_state: AttentionState) -> AttentionState:
             """
@@ -344,6 +387,35 @@ class DotAttention(Attention):
 
         return attend
 
+    def project_source(self, source: mx.sym.Symbol, source_seq_len: int) -> List[mx.sym.Symbol]:
+        """
+        Returns projections of the source that do not depend on the decoder state.
+        Without projection, the source is attended to directly and no projections are returned.
+
+        :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
+        :param source_seq_len: Maximum length of source sequences.
+        :return: List of source projections. Shapes: (batch_size, seq_len, num_hidden).
+        """
+        if not self.project:
+            return []
+        # (batch_size * seq_len, self.num_hidden)
+        source_hidden = mx.sym.FullyConnected(
+            data=mx.sym.reshape(data=source, shape=(-3, -1), name="%sflat_source" % self.prefix),
+            weight=self.s2h_weight, num_hidden=self.num_hidden,
+            no_bias=True, name="%ssource_hidden_fc" % self.prefix)
+        # (batch_size, seq_len, self.num_hidden)
+        source_hidden = mx.sym.reshape(source_hidden, shape=(-1, source_seq_len, self.num_hidden),
+                                       name="%ssource_hidden" % self.prefix)
+        return [source_hidden]
+
+    def source_projection_num_hidden(self) -> List[int]:
+        """
+        Returns the depths of the source projections returned by project_source().
+
+        :return: List of projection depths.
+        """
+        return [self.num_hidden] if self.project else []
+
 
 class MultiHeadDotAttention(Attention):
     """
@@ -372,7 +444,8 @@ class MultiHeadDotAttention(Attention):
         self.h2o_weight = mx.sym.Variable("%sh2o_weight" % self.prefix)
         self.h2o_bias = mx.sym.Variable("%sh2o_bias" % self.prefix)
 
-    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int) -> Callable:
+    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int,
+           source_projections: Optional[List[mx.sym.Symbol]] = None) -> Callable:
         """
         Returns callable to be used for recurrent attention in a sequence decoder.
         The callable is a recurrent function of the form:
@@ -381,23 +454,14 @@ class MultiHeadDotAttention(Attention):
         :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
         :param source_length: Shape: (batch_size,).
         :param source_seq_len: Maximum length of source sequences.
+        :param source_projections: Optional precomputed source projections as returned by project_source().
         :return: Attention callable.
         """
 
-        # Combine batch and time dimension
-        # (batch * length, input_depth)
-        source = mx.sym.reshape(data=source, shape=(-3, -1))
-
-        # (batch * length, num_hidden * 2)
-        source_hidden = mx.sym.FullyConnected(data=source,
-                                              weight=self.s2h_weight, bias=self.s2h_bias,
-                                              num_hidden=self.num_hidden * 2,
-                                              name="%ssource_hidden_fc" % self.prefix)
-        # (batch, length, num_hidden * 2)
-        source_hidden = mx.sym.reshape(data=source_hidden, shape=(-1, source_seq_len, self.num_hidden * 2))
-        # split keys and values
+        if source_projections is None:
+            source_projections = self.project_source(source, source_seq_len)
         # (batch, length, num_hidden)
-        keys, values = mx.sym.split(data=source_hidden, num_outputs=2, axis=2)
+        keys, values = source_projections
 
         # (batch*heads, length, num_hidden/head)
         keys = layers.split_heads(keys, source_seq_len, self.heads)
@@ -455,6 +519,38 @@ class MultiHeadDotAttention(Attention):
 
         return attend
 
+    def project_source(self, source: mx.sym.Symbol, source_seq_len: int) -> List[mx.sym.Symbol]:
+        """
+        Returns projections of the source that do not depend on the decoder state: attention keys and values.
+
+        :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
+        :param source_seq_len: Maximum length of source sequences.
+        :return: List of source projections. Shapes: (batch_size, seq_len, num_hidden).
+        """
+        # Combine batch and time dimension
+        # (batch * length, input_depth)
+        source = mx.sym.reshape(data=source, shape=(-3, -1))
+
+        # (batch * length, num_hidden * 2)
+        source_hidden = mx.sym.FullyConnected(data=source,
+                                              weight=self.s2h_weight, bias=self.s2h_bias,
+                                              num_hidden=self.num_hidden * 2,
+                                              name="%ssource_hidden_fc" % self.prefix)
+        # (batch, length, num_hidden * 2)
+        source_hidden = mx.sym.reshape(data=source_hidden, shape=(-1, source_seq_len, self.num_hidden * 2))
+        # split keys and values
+        # (batch, length, num_hidden)
+        keys, values = mx.sym.split(data=source_hidden, num_outputs=2, axis=2)
+        return [keys, values]
+
+    def source_projection_num_hidden(self) -> List[int]:
+        """
+        Returns the depths of the source projections returned by project_source().
+
+        :return: List of projection depths.
+        """
+        return [self.num_hidden, self.num_hidden]
+
 
 class EncoderLastStateAttention(Attention):
     """
@@ -462,7 +558,8 @@ class EncoderLastStateAttention(Attention):
     Equivalent to no attention.
     """
 
-    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int) -> Callable:
+    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int,
+           source_projections: Optional[List[mx.sym.Symbol]] = None) -> Callable:
         """
         Returns callable to be used for recurrent attention in a sequence decoder.
         The callable is a recurrent function of the form:
@@ -471,6 +568,7 @@ class EncoderLastStateAttention(Attention):
         :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
         :param source_length: Shape: (batch_size,).
         :param source_seq_len: Maximum length of source sequences.
+        :param source_projections: Optional precomputed source projections as returned by project_source().
         :return: Attention callable.
         """
         source = mx.sym.swapaxes(source, dim1=0, dim2=1)
@@ -506,7 +604,8 @@ class LocationAttention(Attention):
         self.location_weight = mx.sym.Variable("%sloc_weight" % self.prefix)
         self.location_bias = mx.sym.Variable("%sloc_bias" % self.prefix)
 
-    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int) -> Callable:
+    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int,
+           source_projections: Optional[List[mx.sym.Symbol]] = None) -> Callable:
         """
         Returns callable to be used for recurrent attention in a sequence decoder.
         The callable is a recurrent function of the form:
@@ -515,6 +614,7 @@ class LocationAttention(Attention):
         :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
         :param source_length: Shape: (batch_size,).
         :param source_seq_len: Maximum length of source sequences.
+        :param source_projections: Optional precomputed source projections as returned by project_source().
         :return: Attention callable.
         """
 
@@ -598,7 +698,8 @@ class MlpAttention(Attention):
         self._ln = layers.LayerNormalization(num_hidden=attention_num_hidden,
                                              prefix="%snorm" % self.prefix) if layer_normalization else None
 
-    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int) -> Callable:
+    def on(self, source: mx.sym.Symbol, source_length: mx.sym.Symbol, source_seq_len: int,
+           source_projections: Optional[List[mx.sym.Symbol]] = None) -> Callable:
         """
         Returns callable to be used for recurrent attention in a sequence decoder.
         The callable is a recurrent function of the form:
@@ -607,24 +708,16 @@ class MlpAttention(Attention):
         :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
         :param source_length: Shape: (batch_size,).
         :param source_seq_len: Maximum length of source sequences.
+        :param source_projections: Optional precomputed source projections as returned by project_source().
         :return: Attention callable.
         """
 
         coverage_func = self.coverage.on(source, source_length, source_seq_len) if self.coverage else None
 
-        # (batch_size * seq_len, attention_num_hidden)
-        source_hidden = mx.sym.FullyConnected(data=mx.sym.reshape(data=source,
-                                                                  shape=(-3, -1),
-                                                                  name="%satt_flat_source" % self.prefix),
-                                              weight=self.att_e2h_weight,
-                                              num_hidden=self.attention_num_hidden,
-                                              no_bias=True,
-                                              name="%ssource_hidden_fc" % self.prefix)
-
+        if source_projections is None:
+            source_projections = self.project_source(source, source_seq_len)
         # (batch_size, seq_len, attention_num_hidden)
-        source_hidden = mx.sym.reshape(source_hidden,
-                                       shape=(-1, source_seq_len, self.attention_num_hidden),
-                                       name="%ssource_hidden" % self.prefix)
+        source_hidden, = source_projections
 
         def attend(att_input: AttentionInput, att_state: AttentionState) -> AttentionState:
             """
@@ -711,6 +804,37 @@ class MlpAttention(Attention):
 
         return attend
 
+    def project_source(self, source: mx.sym.Symbol, source_seq_len: int) -> List[mx.sym.Symbol]:
+        """
+        Returns projections of the source that do not depend on the decoder state.
+
+        :param source: Shape: (batch_size, seq_len, encoder_num_hidden).
+        :param source_seq_len: Maximum length of source sequences.
+        :return: List of source projections. Shapes: (batch_size, seq_len, attention_num_hidden).
+        """
+        # (batch_size * seq_len, attention_num_hidden)
+        source_hidden = mx.sym.FullyConnected(data=mx.sym.reshape(data=source,
+                                                                  shape=(-3, -1),
+                                                                  name="%satt_flat_source" % self.prefix),
+                                              weight=self.att_e2h_weight,
+                                              num_hidden=self.attention_num_hidden,
+                                              no_bias=True,
+                                              name="%ssource_hidden_fc" % self.prefix)
+
+        # (batch_size, seq_len, attention_num_hidden)
+        source_hidden = mx.sym.reshape(source_hidden,
+                                       shape=(-1, source_seq_len, self.attention_num_hidden),
+                                       name="%ssource_hidden" % self.prefix)
+        return [source_hidden]
+
+    def source_projection_num_hidden(self) -> List[int]:
+        """
+        Returns the depths of the source projections returned by project_source().
+
+        :return: List of projection depths.
+        """
+        return [self.attention_num_hidden]
+
 
 def mask_attention_scores(logits: mx.sym.Symbol,
                           length: mx.sym.Symbol) -> mx.sym.Symbol:
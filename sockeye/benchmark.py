@@ -0,0 +1,312 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""
+Benchmarks of decoding speed on the CPU. Synthetic models of different architectures and sizes are trained for a
+single update, i.e. they have (near) random parameters, and translate synthetic inputs of given lengths with
+different beam sizes, ensemble sizes and thread counts. Results are written to a JSON file and can be compared
+with those of a previous run.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Any, Dict, List, Tuple
+
+import mxnet as mx
+import numpy as np
+
+from sockeye import __version__
+from sockeye.log import setup_main_logger, log_sockeye_version
+from . import arguments
+from . import constants as C
+from . import inference
+from .utils import check_condition
+
+logger = setup_main_logger(__name__, console=True, file_logging=False)
+
+MODEL_SIZES = {
+    "tiny": dict(vocab_size=1000, num_embed=32, num_hidden=32, num_layers="1:1", feed_forward=64, heads=2,
+                 conv_filters="8:8:16"),
+    "medium": dict(vocab_size=16000, num_embed=256, num_hidden=512, num_layers="2:2", feed_forward=2048, heads=8,
+                   conv_filters="64:64:128"),
+}
+
+ARCHITECTURES = {
+    "rnn": "--encoder rnn --rnn-cell-type lstm --attention-type mlp --num-layers {num_layers}"
+           " --num-embed {num_embed} --rnn-num-hidden {num_hidden} --attention-num-hidden {num_hidden}",
+    "transformer": "--encoder transformer --decoder transformer --num-layers {num_layers} --num-embed {num_hidden}"
+                   " --transformer-model-size {num_hidden} --transformer-attention-heads {heads}"
+                   " --transformer-feed-forward-num-hidden {feed_forward}",
+    "conv": "--encoder rnn-with-conv-embed --conv-embed-max-filter-width 3 --conv-embed-num-filters {conv_filters}"
+            " --conv-embed-pool-stride 2 --conv-embed-num-highway-layers 1 --rnn-cell-type lstm"
+            " --num-layers {num_layers} --num-embed {num_embed} --rnn-num-hidden {num_hidden}"
+            " --attention-num-hidden {num_hidden}",
+}
+
+BENCHMARK_MAX_SEQ_LEN = 100
+
+# fields identifying a measurement, used to match results of different runs
+RESULT_KEY = ("model", "beam_size", "input_length", "ensemble_size", "threads", "batch_size", "topk")
+
+
+def _write_synthetic_data(source_fname: str, target_fname: str, vocab_size: int, num_lines: int,
+                          max_length: int, rng: random.Random):
+    """
+    Writes parallel copy data over the words w0 ... w<vocab_size - 1>, all of which occur.
+    """
+    words = ["w%d" % i for i in range(vocab_size)]
+    lines = [words[start:start + max_length] for start in range(0, vocab_size, max_length)]
+    while len(lines) < num_lines:
+        lines.append([rng.choice(words) for _ in range(rng.randint(1, max_length))])
+    with open(source_fname, "w") as source, open(target_fname, "w") as target:
+        for line in lines:
+            source.write("%s\n" % C.TOKEN_SEPARATOR.join(line))
+            target.write("%s\n" % C.TOKEN_SEPARATOR.join(line))
+
+
+def build_model(folder: str, architecture: str, size: str, seed: int = 1) -> str:
+    """
+    Trains a synthetic model for a single update on copy data, such that its vocabulary sizes are fixed and its
+    parameters are close to their random initialization. Models that already exist in folder are reused.
+
+    :param folder: Folder holding benchmark models.
+    :param architecture: Architecture (key of ARCHITECTURES).
+    :param size: Model size (key of MODEL_SIZES).
+    :param seed: Random seed for data and parameters.
+    :return: Model folder.
+    """
+    model_folder = os.path.join(folder, "%s.%s" % (architecture, size))
+    if os.path.exists(os.path.join(model_folder, C.PARAMS_BEST_NAME)):
+        logger.info("Using existing benchmark model %s", model_folder)
+        return model_folder
+    settings = MODEL_SIZES[size]
+    with tempfile.TemporaryDirectory(prefix="sockeye.benchmark.") as data_folder:
+        rng = random.Random(seed)
+        files = [os.path.join(data_folder, name) for name in ("train.src", "train.trg", "dev.src", "dev.trg")]
+        _write_synthetic_data(files[0], files[1], settings["vocab_size"], 100, BENCHMARK_MAX_SEQ_LEN - 1, rng)
+        _write_synthetic_data(files[2], files[3], 10, 10, 10, rng)
+        command = [sys.executable, "-m", "sockeye.train", "--use-cpu",
+                   "--source", files[0], "--target", files[1],
+                   "--validation-source", files[2], "--validation-target", files[3],
+                   "--output", model_folder, "--seed", str(seed),
+                   "--max-seq-len", str(BENCHMARK_MAX_SEQ_LEN),
+                   "--num-words", "%d:%d" % (settings["vocab_size"], settings["vocab_size"]),
+                   "--word-min-count", "1:1",
+                   "--batch-size", "8", "--max-updates", "1", "--checkpoint-frequency", "1"]
+        command += ARCHITECTURES[architecture].format(**settings).split()
+        logger.info("Building benchmark model %s", model_folder)
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return model_folder
+
+
+def generate_inputs(vocab_size: int, length: int, num_sentences: int, seed: int = 1) -> List[str]:
+    """
+    Returns synthetic input sentences of the given length over the words of build_model's vocabulary.
+
+    :param vocab_size: Vocabulary size of the model.
+    :param length: Number of tokens per sentence.
+    :param num_sentences: Number of sentences.
+    :param seed: Random seed.
+    :return: Sentences.
+    """
+    rng = random.Random(seed)
+    return [C.TOKEN_SEPARATOR.join("w%d" % rng.randrange(vocab_size) for _ in range(length))
+            for _ in range(num_sentences)]
+
+
+def benchmark_input_preparation(translator: inference.Translator,
+                                trans_inputs: List[inference.TranslatorInput],
+                                repetitions: int = 10) -> float:
+    """
+    Measures the time the translator takes to convert batches of input tokens into source id arrays on its
+    context, i.e. the work done per batch before encoding.
+
+    :param translator: Translator.
+    :param trans_inputs: Inputs, prepared in batches of the translator's batch size.
+    :param repetitions: Number of times all inputs are prepared.
+    :return: Preparation time per input token in microseconds.
+    """
+    tokens_batches = [[trans_input.tokens for trans_input in trans_inputs[start:start + translator.batch_size]]
+                      for start in range(0, len(trans_inputs), translator.batch_size)]
+    num_tokens = sum(len(trans_input.tokens) for trans_input in trans_inputs) * repetitions
+    tic = time.time()
+    for _ in range(repetitions):
+        for tokens_batch in tokens_batches:
+            translator._get_inference_input(tokens_batch)
+    mx.nd.waitall()
+    microseconds = 1e6 * (time.time() - tic) / max(1, num_tokens)
+    logger.info("Input preparation: %.2f microseconds per token (%d tokens)", microseconds, num_tokens)
+    return microseconds
+
+
+def benchmark_translator(translator: inference.Translator, sentences: List[str]) -> Dict[str, float]:
+    """
+    Translates sentences in batches after warming up their bucket and measures throughput and latency.
+
+    :param translator: Translator.
+    :param sentences: Input sentences.
+    :return: Measurements: sentences, output tokens, seconds, sentences and tokens per second, latency
+             percentiles (time of the batch of a sentence) and input preparation time per token.
+    """
+    trans_inputs = [translator.make_input(i, sentence) for i, sentence in enumerate(sentences)]
+    translator.warm_up([max(len(trans_input.tokens) for trans_input in trans_inputs)])
+    latencies = []  # type: List[float]
+    num_output_tokens = 0
+    tic = time.time()
+    for start in range(0, len(trans_inputs), translator.batch_size):
+        batch_inputs = trans_inputs[start:start + translator.batch_size]
+        batch_tic = time.time()
+        trans_outputs = translator.translate_batch(batch_inputs)
+        latencies.extend([time.time() - batch_tic] * len(batch_inputs))
+        num_output_tokens += sum(len(trans_output.tokens) for trans_output in trans_outputs)
+    seconds = time.time() - tic
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return dict(sentences=len(trans_inputs), output_tokens=num_output_tokens, seconds=seconds,
+                sent_per_sec=len(trans_inputs) / seconds, tokens_per_sec=num_output_tokens / seconds,
+                latency_p50=float(p50), latency_p90=float(p90), latency_p99=float(p99),
+                prepare_us_per_token=benchmark_input_preparation(translator, trans_inputs))
+
+
+def _benchmark_worker(model_folders: Dict[str, str], settings: Dict[str, Any], threads: int,
+                      result_queue: multiprocessing.Queue):
+    """
+    Main function of a benchmark process, which MXNet runs with the given number of OpenMP threads. Puts a
+    list of result records on result_queue.
+    """
+    results = []
+    for model_name, model_folder in sorted(model_folders.items()):
+        vocab_size = MODEL_SIZES[model_name.split(".")[1]]["vocab_size"]
+        for ensemble_size, beam_size, topk in itertools.product(settings["ensemble_sizes"], settings["beam_sizes"],
+                                                                settings["topk"]):
+            models, vocab_source, vocab_target = inference.load_models(mx.cpu(),
+                                                                       max_input_len=None,
+                                                                       beam_size=beam_size,
+                                                                       model_folders=[model_folder] * ensemble_size,
+                                                                       batch_size=settings["batch_size"],
+                                                                       decoder_return_attention=False)
+            translator = inference.Translator(mx.cpu(), 'linear', inference.LengthPenalty(), models,
+                                              vocab_source, vocab_target, device_topk=topk == C.TOPK_DEVICE)
+            for input_length in settings["input_lengths"]:
+                sentences = generate_inputs(vocab_size, input_length, settings["num_sentences"], settings["seed"])
+                record = dict(model=model_name, beam_size=beam_size, input_length=input_length,
+                              ensemble_size=ensemble_size, threads=threads, batch_size=settings["batch_size"],
+                              topk=topk)
+                record.update(benchmark_translator(translator, sentences))
+                logger.info("%s", " ".join("%s=%s" % (key, record[key]) for key in RESULT_KEY) +
+                            " sent/sec=%.2f tokens/sec=%.1f latency p50=%.4f p99=%.4f" % (
+                                record["sent_per_sec"], record["tokens_per_sec"], record["latency_p50"],
+                                record["latency_p99"]))
+                results.append(record)
+    result_queue.put(results)
+
+
+def run_benchmarks(model_folders: Dict[str, str], settings: Dict[str, Any],
+                   thread_counts: List[int]) -> List[Dict[str, Any]]:
+    """
+    Runs the benchmarks of all models and settings once for each thread count, each in a process that sets
+    OMP_NUM_THREADS before MXNet is imported.
+
+    :param model_folders: Mapping from model names (<architecture>.<size>) to model folders.
+    :param settings: Benchmark settings: beam_sizes, ensemble_sizes, topk, input_lengths, num_sentences, batch_size,
+           seed.
+    :param thread_counts: Numbers of OpenMP threads.
+    :return: Result records.
+    """
+    mp_context = multiprocessing.get_context("spawn")
+    results = []  # type: List[Dict[str, Any]]
+    for threads in thread_counts:
+        result_queue = mp_context.Queue()
+        process = mp_context.Process(target=_benchmark_worker, args=(model_folders, settings, threads, result_queue))
+        omp_num_threads = os.environ.get(C.OMP_NUM_THREADS)
+        os.environ[C.OMP_NUM_THREADS] = str(threads)
+        try:
+            process.start()
+        finally:
+            if omp_num_threads is None:
+                del os.environ[C.OMP_NUM_THREADS]
+            else:
+                os.environ[C.OMP_NUM_THREADS] = omp_num_threads
+        results.extend(result_queue.get())
+        process.join()
+        check_condition(process.exitcode == 0, "Benchmark process with %d threads failed" % threads)
+    return results
+
+
+def compare(previous: List[Dict[str, Any]], current: List[Dict[str, Any]]) \
+        -> List[Tuple[Tuple, float, float, float]]:
+    """
+    Compares the throughput of measurements present in both result lists.
+
+    :param previous: Result records of a previous run.
+    :param current: Result records of the current run.
+    :return: For each common measurement: key (see RESULT_KEY), previous and current sentences per second, and
+             their ratio.
+    """
+    previous_by_key = {tuple(record[key] for key in RESULT_KEY): record for record in previous}
+    comparison = []
+    for record in current:
+        key = tuple(record[key] for key in RESULT_KEY)
+        if key not in previous_by_key:
+            continue
+        before, after = previous_by_key[key]["sent_per_sec"], record["sent_per_sec"]
+        comparison.append((key, before, after, after / before if before > 0 else float("inf")))
+        logger.info("%s sent/sec: %.2f -> %.2f (%+.1f%%)", " ".join("%s=%s" % item for item in zip(RESULT_KEY, key)),
+                    before, after, 100.0 * (comparison[-1][3] - 1.0))
+    return comparison
+
+
+def main():
+    """
+    Commandline interface to benchmark decoding speed.
+    """
+    log_sockeye_version(logger)
+    params = argparse.ArgumentParser(description="Benchmarks decoding speed of synthetic models on the CPU.")
+    arguments.add_benchmark_args(params)
+    args = params.parse_args()
+    check_condition(max(args.input_lengths) <= BENCHMARK_MAX_SEQ_LEN,
+                    "Input lengths must not exceed %d" % BENCHMARK_MAX_SEQ_LEN)
+
+    settings = dict(beam_sizes=args.beam_sizes, ensemble_sizes=args.ensemble_sizes, topk=args.topk,
+                    input_lengths=args.input_lengths, num_sentences=args.num_sentences,
+                    batch_size=args.batch_size, seed=args.seed)
+    with ExitStack() as exit_stack:
+        model_dir = args.model_dir
+        if model_dir is None:
+            model_dir = exit_stack.enter_context(tempfile.TemporaryDirectory(prefix="sockeye.benchmark."))
+        model_folders = {"%s.%s" % (architecture, size): build_model(model_dir, architecture, size, args.seed)
+                         for architecture in args.architectures for size in args.sizes}
+        results = run_benchmarks(model_folders, settings, args.threads)
+
+    with open(args.output, "w") as out:
+        json.dump({"metadata": {"sockeye_version": __version__, "mxnet_version": mx.__version__,
+                                "python_version": platform.python_version(), "cpu_count": os.cpu_count(),
+                                "settings": settings},
+                   "results": results}, out, indent=2, sort_keys=True)
+    logger.info("Benchmark results written to '%s'", args.output)
+    if args.compare is not None:
+        with open(args.compare) as inp:
+            compare(json.load(inp)["results"], results)
+
+
+if __name__ == "__main__":
+    main()
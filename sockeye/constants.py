@@ -23,6 +23,8 @@ UNK_SYMBOL = "<unk>"
 PAD_SYMBOL = "<pad>"
 PAD_ID = 0
 TOKEN_SEPARATOR = " "
+# inputs longer than the largest bucket are split after the last of these tokens that fits, if any
+SEGMENT_BOUNDARY_TOKENS = frozenset([".", "!", "?", ";", ":", ","])
 VOCAB_SYMBOLS = [PAD_SYMBOL, UNK_SYMBOL, BOS_SYMBOL, EOS_SYMBOL]
 
 
@@ -111,10 +113,18 @@ SOURCE_ENCODED_NAME = "encoded_source"
 TARGET_PREVIOUS_NAME = "prev_target_word_id"
 HIDDEN_PREVIOUS_NAME = "prev_hidden"
 SOURCE_DYNAMIC_PREVIOUS_NAME = "prev_dynamic_source"
+# cached keys and values of transformer decoder layers during inference
+SOURCE_KEYS_NAME = "source_keys"
+SOURCE_VALUES_NAME = "source_values"
+SELF_KEYS_NAME = "self_keys"
+SELF_VALUES_NAME = "self_values"
 
+LOGIT_INPUTS_NAME = "logit_inputs"
 LOGITS_NAME = "logits"
 SOFTMAX_NAME = "softmax"
 SOFTMAX_OUTPUT_NAME = SOFTMAX_NAME + "_output"
+# prefix of all node names of ensemble member i in fused ensemble graphs
+ENSEMBLE_MEMBER_PREFIX = "ensemble%d_"
 
 MEASURE_SPEED_EVERY = 50  # measure speed and metrics every X batches
 
@@ -128,6 +138,59 @@ MONITOR_STAT_FUNCS = {STAT_FUNC_DEFAULT: None,
                       STAT_FUNC_MEAN: lambda x: mx.nd.mean(x)}
 
 DEFAULT_BEAM_SIZE = 5
+# number of beam search steps between checks for termination when selecting hypotheses on the device
+BEAM_SEARCH_FINISHED_CHECK_INTERVAL = 5
+# where beam search selects the k-best hypotheses: NumPy on the host, or NDArray operations on the context
+TOPK_HOST = "host"
+TOPK_DEVICE = "device"
+TOPK_TYPES = [TOPK_HOST, TOPK_DEVICE]
+
+# multi-process translation: seconds between checks for dead workers, number of chunks per worker read ahead of the
+# output, and number of failures of a chunk after which translation is aborted
+TRANSLATE_WORKER_POLL_INTERVAL = 1.0
+TRANSLATE_BUFFERED_CHUNKS_PER_WORKER = 4
+TRANSLATE_MAX_CHUNK_FAILURES = 2
+OMP_NUM_THREADS = "OMP_NUM_THREADS"
+
+# translation server: default address, maximum time in milliseconds a request waits for its batch to fill up, and
+# number of most recent request latencies used for percentiles
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8080
+SERVE_MAX_WAIT_MS = 10
+SERVE_LATENCY_WINDOW = 10000
+
+# chunk sizes for reading translation input: without batching each line is translated as soon as it is read,
+# with batching a chunk of CHUNK_SIZE_PER_BATCH_SEGMENT * batch_size lines is read and sorted by length.
+CHUNK_SIZE_NO_BATCHING = 1
+CHUNK_SIZE_PER_BATCH_SEGMENT = 500
+
+# top-k lexicons for vocabulary restriction during decoding
+LEXICON_TOP_K_DEFAULT = 200
+# number of most frequent target words that are always part of a restricted vocabulary
+LEXICON_TOP_K_NUM_FREQUENT = 100
+
+# translation cache: maximum number of translations kept in memory
+TRANSLATION_CACHE_SIZE = 10000
+# translation cache: seconds to wait for database locks held by other processes, e.g. translation workers
+TRANSLATION_CACHE_TIMEOUT = 60.0
+
+# fuzzy-match translation memory
+TM_NGRAM_ORDER = 2
+# minimum fuzzy-match score (1 - token edit distance / length) of a translation retrieved from the translation memory
+TM_FUZZY_MATCH_THRESHOLD = 0.9
+# maximum number of stored sources whose edit distance to an input is computed
+TM_MAX_CANDIDATES = 20
+# n-grams occurring in more stored sources are not used to retrieve candidates
+TM_MAX_POSTINGS = 10000
+TM_CONFIG_NAME = "tm.json"
+TM_NGRAMS_NAME = "tm.ngrams.npy"
+TM_OFFSETS_NAME = "tm.offsets.npy"
+TM_POSTINGS_NAME = "tm.postings.npy"
+TM_LENGTHS_NAME = "tm.lengths.npy"
+TM_TEXT_NAME = "tm.text.npy"
+TM_TEXT_OFFSETS_NAME = "tm.text_offsets.npy"
+TM_SOURCE_HASHES_NAME = "tm.source_hashes.npy"
+TM_SOURCE_IDS_NAME = "tm.source_ids.npy"
 
 VERSION_NAME = "version"
 CONFIG_NAME = "config"
@@ -138,6 +201,23 @@ VOCAB_TRG_NAME = "vocab.trg"
 PARAMS_PREFIX = "params."
 PARAMS_NAME = PARAMS_PREFIX + "%04d"
 PARAMS_BEST_NAME = "params.best"
+# quantized parameter files: 8-bit values, per-row scales and zero points of arg params
+PARAMS_QUANTIZED_VALUES_PREFIX = "qarg"
+PARAMS_QUANTIZED_SCALES_PREFIX = "qscale"
+PARAMS_QUANTIZED_ZERO_POINTS_PREFIX = "qzero"
+QUANTIZE_INT8 = "int8"
+QUANTIZE_FLOAT16 = "float16"
+QUANTIZE_TYPES = [QUANTIZE_INT8, QUANTIZE_FLOAT16]
+QUANTIZE_MIN_SIZE = 100000
+# parameters quantized by default: embedding matrices and output layer weights
+QUANTIZE_DEFAULT_PARAMS = [SOURCE_EMBEDDING_PREFIX + "weight",
+                           TARGET_EMBEDDING_PREFIX + "weight",
+                           SHARED_EMBEDDING_PREFIX + "weight",
+                           DECODER_PREFIX + "cls_weight"]
+# memory-mapped parameters: raw array data next to the parameter file, plus a JSON index of names, types and offsets
+PARAMS_MMAP_SUFFIX = ".mmap"
+PARAMS_MMAP_INDEX_SUFFIX = ".json"
+PARAMS_MMAP_ALIGNMENT = 64
 DECODE_OUT_NAME = "decode.output.%04d"
 DECODE_IN_NAME = "decode.source"
 DECODE_REF_NAME = "decode.target"
@@ -187,11 +267,13 @@ LR_SCHEDULERS = [LR_SCHEDULER_FIXED_RATE_INV_SQRT_T,
 OUTPUT_HANDLER_TRANSLATION = "translation"
 OUTPUT_HANDLER_TRANSLATION_WITH_ALIGNMENTS = "translation_with_alignments"
 OUTPUT_HANDLER_BENCHMARK = "benchmark"
+OUTPUT_HANDLER_JSON = "json"
 OUTPUT_HANDLER_ALIGN_PLOT = "align_plot"
 OUTPUT_HANDLER_ALIGN_TEXT = "align_text"
 OUTPUT_HANDLERS = [OUTPUT_HANDLER_TRANSLATION,
                    OUTPUT_HANDLER_TRANSLATION_WITH_ALIGNMENTS,
                    OUTPUT_HANDLER_BENCHMARK,
+                   OUTPUT_HANDLER_JSON,
                    OUTPUT_HANDLER_ALIGN_PLOT,
                    OUTPUT_HANDLER_ALIGN_TEXT]
 
@@ -208,3 +290,5 @@ CROSS_ENTROPY = 'cross-entropy'
 SMOOTHED_CROSS_ENTROPY = 'smoothed-cross-entropy'
 
 TARGET_MAX_LENGTH_FACTOR = 2
+# maximum output length for an input of length n: ceil(n * (mean + k * std)) of the training target/source length ratio
+DEFAULT_NUM_STD_MAX_OUTPUT_LENGTH = 2
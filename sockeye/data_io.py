@@ -119,6 +119,19 @@ def read_parallel_corpus(data_source: str,
     return source_sentences, target_sentences
 
 
+def length_ratio_statistics(source_sentences: List[List[int]],
+                            target_sentences: List[List[int]]) -> Tuple[float, float]:
+    """
+    Returns mean and standard deviation of the target/source length ratios of parallel sentences.
+
+    :param source_sentences: Source sentences.
+    :param target_sentences: Target sentences.
+    :return: Mean and standard deviation of length ratios.
+    """
+    length_ratios = np.array([len(t) / float(len(s)) for t, s in zip(target_sentences, source_sentences)])
+    return float(np.mean(length_ratios)), float(np.std(length_ratios))
+
+
 def get_training_data_iters(source: str, target: str,
                             validation_source: str, validation_target: str,
                             vocab_source: Dict[str, int], vocab_target: Dict[str, int],
@@ -127,7 +140,8 @@ def get_training_data_iters(source: str, target: str,
                             max_seq_len_source: int,
                             max_seq_len_target: int,
                             bucketing: bool,
-                            bucket_width: int) -> Tuple['ParallelBucketSentenceIter', 'ParallelBucketSentenceIter']:
+                            bucket_width: int) -> Tuple['ParallelBucketSentenceIter', 'ParallelBucketSentenceIter',
+                                                        float, float]:
     """
     Returns data iterators for training and validation data.
 
@@ -143,16 +157,16 @@ def get_training_data_iters(source: str, target: str,
     :param max_seq_len_target: Maximum target sequence length.
     :param bucketing: Whether to use bucketing.
     :param bucket_width: Size of buckets.
-    :return: Tuple of (training data iterator, validation data iterator).
+    :return: Tuple of (training data iterator, validation data iterator, mean and standard deviation of training
+             target/source length ratios).
     """
     logger.info("Creating train data iterator")
     train_source_sentences, train_target_sentences = read_parallel_corpus(source,
                                                                           target,
                                                                           vocab_source,
                                                                           vocab_target)
-    length_ratio = sum(len(t) / float(len(s)) for t, s in zip(train_target_sentences, train_source_sentences)) / len(
-        train_target_sentences)
-    logger.info("Average training target/source length ratio: %.2f", length_ratio)
+    length_ratio, length_ratio_std = length_ratio_statistics(train_source_sentences, train_target_sentences)
+    logger.info("Average training target/source length ratio: %.2f (std=%.2f)", length_ratio, length_ratio_std)
 
     # define buckets
     buckets = define_parallel_buckets(max_seq_len_source,
@@ -183,12 +197,14 @@ def get_training_data_iters(source: str, target: str,
                                           C.PAD_ID,
                                           vocab_target[C.UNK_SYMBOL],
                                           fill_up=fill_up)
-    return train_iter, val_iter
+    return train_iter, val_iter, length_ratio, length_ratio_std
 
 
 class DataConfig(config.Config):
     """
-    Stores data paths from training.
+    Stores data paths and statistics from training.
+    Length ratio defaults for models trained without these statistics reproduce a fixed maximum output length of
+    C.TARGET_MAX_LENGTH_FACTOR times the input length.
     """
     def __init__(self,
                  source: str,
@@ -196,7 +212,9 @@ class DataConfig(config.Config):
                  validation_source: str,
                  validation_target: str,
                  vocab_source: str,
-                 vocab_target: str) -> None:
+                 vocab_target: str,
+                 length_ratio_mean: float = C.TARGET_MAX_LENGTH_FACTOR,
+                 length_ratio_std: float = 0.0) -> None:
         super().__init__()
         self.source = source
         self.target = target
@@ -204,6 +222,8 @@ class DataConfig(config.Config):
         self.validation_target = validation_target
         self.vocab_source = vocab_source
         self.vocab_target = vocab_target
+        self.length_ratio_mean = length_ratio_mean
+        self.length_ratio_std = length_ratio_std
 
 
 def smart_open(filename: str, mode="rt", ftype="auto", errors='replace'):
@@ -15,6 +15,7 @@
 Decoders for sequence-to-sequence models.
 """
 import logging
+import math
 from abc import ABC, abstractmethod
 from typing import Callable, List, NamedTuple, Tuple
 from typing import Optional
@@ -54,6 +55,7 @@ class Decoder(ABC):
     The latter is typically used for inference graphs in beam search.
     For the inference module to be able to keep track of decoder's states
     a decoder provides methods to return initial states (init_states), state variables and their shapes.
+    Decoders hold an output layer (output_layer) mapping decoder hidden states to logits over the target vocabulary.
     """
 
     @abstractmethod
@@ -91,13 +93,14 @@ class Decoder(ABC):
             -> Tuple[mx.sym.Symbol, mx.sym.Symbol, List[mx.sym.Symbol]]:
         """
         Decodes a single time step given the previous word id and previous decoder states.
-        Returns logits, attention probabilities, and next decoder states.
+        Returns the inputs to the output layer (decoder hidden state), attention probabilities,
+        and next decoder states. Logits are obtained by applying output_layer to the returned hidden state.
         Implementations can maintain an arbitrary number of states.
 
         :param prev_word_id: Previous word id. Shape: (batch_size,).
         :param source_encoded_max_length: Length of encoded source time dimension.
         :param states: Arbitrary list of decoder states.
-        :return: logits, attention probabilities, next decoder states.
+        :return: hidden state (logit inputs), attention probabilities, next decoder states.
         """
         pass
 
@@ -149,6 +152,16 @@ class Decoder(ABC):
         """
         return []
 
+    def static_states(self) -> List[bool]:
+        """
+        Returns for each state in state_variables() whether it is static, i.e. identical for all hypotheses
+        of a sentence and passed through decode_step unchanged. Static states need not be reordered during
+        beam search. Used for inference.
+
+        :return: List of flags, one per state.
+        """
+        return [False] * len(self.state_variables())
+
     @abstractmethod
     def get_rnn_cells(self) -> List[mx.rnn.BaseRNNCell]:
         """
@@ -164,9 +177,9 @@ class TransformerDecoder(Decoder):
     Transformer decoder as in Vaswani et al, 2017: Attention is all you need.
     In training, computation scores for each position of the known target sequence are compouted in parallel,
     yielding most of the speedup.
-    At inference time, the decoder block is evaluated again and again over a maximum length input sequence that is
-    initially filled with zeros and grows during beam search with predicted tokens. Appropriate masking at every
-    time-step ensures correct self-attention scores and is updated with every step.
+    At inference time, decoding is incremental: each step only processes the newest target position.
+    Every decoder block keeps the self-attention keys and values of previous positions in caches of maximum target
+    length that are part of the decoder states. Source-attention keys and values are computed once in init_states().
 
     :param config: Transformer configuration.
     :param embed_weight: Optionally use an existing embedding matrix instead of creating a new target embedding.
@@ -193,10 +206,11 @@ class TransformerDecoder(Decoder):
                                            add_positional_encoding=config.positional_encodings)
         if self.config.weight_tying:
             logger.info("Tying the target embeddings and prediction matrix.")
-            self.cls_w = embed_weight
+            self.output_layer = layers.OutputLayer(vocab_size=config.vocab_size,
+                                                   weight=embed_weight,
+                                                   prefix="%scls_" % prefix)
         else:
-            self.cls_w = mx.sym.Variable("%scls_weight" % prefix)
-        self.cls_b = mx.sym.Variable("%scls_bias" % prefix)
+            self.output_layer = layers.OutputLayer(vocab_size=config.vocab_size, prefix="%scls_" % prefix)
 
     def decode_sequence(self,
                         source_encoded: mx.sym.Symbol,
@@ -239,8 +253,7 @@ class TransformerDecoder(Decoder):
         target = mx.sym.reshape(data=target, shape=(-3, -1))
 
         # logits: (batch_size * target_max_length, vocab_size)
-        logits = mx.sym.FullyConnected(data=target, num_hidden=self.config.vocab_size,
-                                       weight=self.cls_w, bias=self.cls_b, name=C.LOGITS_NAME)
+        logits = self.output_layer(target)
         return logits
 
     def decode_step(self,
@@ -250,57 +263,49 @@ class TransformerDecoder(Decoder):
             -> Tuple[mx.sym.Symbol, mx.sym.Symbol, List[mx.sym.Symbol]]:
         """
         Decodes a single time step given the previous word id and previous decoder states.
-        Returns logits, attention probabilities, and next decoder states.
+        Returns the inputs to the output layer (decoder hidden state), attention probabilities,
+        and next decoder states. Logits are obtained by applying output_layer to the returned hidden state.
         Implementations can maintain an arbitrary number of states.
 
         :param prev_word_id: Previous word id. Shape: (batch_size,).
         :param source_encoded_max_length: Length of encoded source time dimension.
         :param states: Arbitrary list of decoder states.
-        :return: logits, attention probabilities, next decoder states.
+        :return: hidden state (logit inputs), attention probabilities, next decoder states.
         """
         target_max_length = self._get_target_max_length(source_encoded_max_length)
 
-        # sequences: (batch_size, target_max_length)
-        source_encoded, source_encoded_lengths, sequences, lengths = states
-
-        # (batch_size, target_max_length)
-        mask = mx.sym.one_hot(indices=lengths, depth=target_max_length, on_value=1, off_value=0)
-
-        # all zeros but length position is set to prev_word_id
-        # (batch_size, target_max_length)
-        prev_word_id = mx.sym.broadcast_mul(mx.sym.expand_dims(prev_word_id, axis=1), mask)
-
-        # append/insert prev_word_id to sequences
-        # (batch_size, target_max_length)
-        sequences = sequences + prev_word_id
-        lengths += 1
-
-        # (1, target_max_length, target_max_length)
-        target_bias = transformer.get_autoregressive_bias(target_max_length, name="%sbias" % self.prefix)
-
+        # lengths: (batch_size,), number of previous target positions, i.e. position of prev_word_id
+        source_encoded_lengths, lengths, *caches = states
+        num_layers = len(self.layers)
+        # (batch_size, source_encoded_max_length, model_size)
+        source_keys, source_values = caches[:num_layers], caches[num_layers:2 * num_layers]
         # (batch_size, target_max_length, model_size)
-        target, target_lengths, target_max_length = self.embedding.encode(sequences, lengths, target_max_length)
-
-        for layer in self.layers:
-            target = layer(target, target_lengths, target_max_length, target_bias,
-                           source_encoded, source_encoded_lengths, source_encoded_max_length)
+        self_keys, self_values = caches[2 * num_layers:3 * num_layers], caches[3 * num_layers:]
+
+        # (batch_size, 1, model_size)
+        target = self.embedding.encode_step(prev_word_id, lengths, target_max_length)
+
+        new_self_keys, new_self_values = [], []
+        for layer, layer_self_keys, layer_self_values, layer_source_keys, layer_source_values in zip(
+                self.layers, self_keys, self_values, source_keys, source_values):
+            target, layer_self_keys, layer_self_values = layer.decode_step(target, lengths, target_max_length,
+                                                                           layer_self_keys, layer_self_values,
+                                                                           layer_source_keys, layer_source_values,
+                                                                           source_encoded_lengths,
+                                                                           source_encoded_max_length)
+            new_self_keys.append(layer_self_keys)
+            new_self_values.append(layer_self_values)
 
-        # set all target positions to zero except for current time-step
-        # target: (batch_size, target_max_length, model_size)
-        target = mx.sym.broadcast_mul(target, mx.sym.expand_dims(mask, axis=2))
-        # reduce to single prediction
         # target: (batch_size, model_size)
-        target = mx.sym.sum(target, axis=1, keepdims=False)
-        # logits: (batch_size, vocab_size)
-        logits = mx.sym.FullyConnected(data=target, num_hidden=self.config.vocab_size,
-                                       weight=self.cls_w, bias=self.cls_b, name=C.LOGITS_NAME)
+        target = mx.sym.reshape(data=target, shape=(-3, -1))
 
         # TODO(fhieber): no attention probs for now
-        attention_probs = mx.sym.sum(mx.sym.zeros_like(source_encoded), axis=2, keepdims=False)
+        attention_probs = mx.sym.sum(mx.sym.zeros_like(source_keys[0]), axis=2, keepdims=False)
 
         # next states
-        new_states = [source_encoded, source_encoded_lengths, sequences, lengths]
-        return logits, attention_probs, new_states
+        new_states = [source_encoded_lengths, lengths + 1] + source_keys + source_values + \
+                     new_self_keys + new_self_values
+        return target, attention_probs, new_states
 
     def reset(self):
         pass
@@ -319,13 +324,21 @@ class TransformerDecoder(Decoder):
         :return: List of symbolic initial states.
         """
         target_max_length = self._get_target_max_length(source_encoded_max_length)
-        # 0s: (batch_size, target_max_length)
-        sequences = mx.sym.broadcast_axis(mx.sym.expand_dims(mx.sym.zeros_like(source_encoded_lengths), axis=1),
-                                          axis=1,
-                                          size=target_max_length)
-        # 0s: (batch_size, source_encoded_max_length, encoder_depth)
+        # 0s: (batch_size,)
         lengths = mx.sym.zeros_like(source_encoded_lengths)
-        return [source_encoded, source_encoded_lengths, sequences, lengths]
+
+        source_keys, source_values = [], []
+        for layer in self.layers:
+            layer_source_keys, layer_source_values = layer.project_source(source_encoded, source_encoded_max_length)
+            source_keys.append(layer_source_keys)
+            source_values.append(layer_source_values)
+
+        # 0s: (batch_size, target_max_length, model_size)
+        self_caches = [mx.sym.broadcast_axis(mx.sym.expand_dims(mx.sym.expand_dims(lengths, axis=1), axis=2),
+                                             axis=(1, 2),
+                                             size=(target_max_length, self.config.model_size))
+                       for _ in range(2 * len(self.layers))]
+        return [source_encoded_lengths, lengths] + source_keys + source_values + self_caches
 
     def state_variables(self) -> List[mx.sym.Symbol]:
         """
@@ -333,10 +346,8 @@ class TransformerDecoder(Decoder):
 
         :return: List of symbolic variables.
         """
-        return [mx.sym.Variable(C.SOURCE_ENCODED_NAME),
-                mx.sym.Variable(C.SOURCE_LENGTH_NAME),
-                mx.sym.Variable('sequences'),
-                mx.sym.Variable('lengths')]
+        return [mx.sym.Variable(C.SOURCE_LENGTH_NAME),
+                mx.sym.Variable('lengths')] + [mx.sym.Variable(name) for name in self._cache_names()]
 
     def state_shapes(self,
                      batch_size: int,
@@ -352,12 +363,34 @@ class TransformerDecoder(Decoder):
         :return: List of shape descriptions.
         """
         target_max_length = self._get_target_max_length(source_encoded_max_length)
-        return [mx.io.DataDesc(C.SOURCE_ENCODED_NAME,
-                               (batch_size, source_encoded_max_length, source_encoded_depth),
-                               layout=C.BATCH_MAJOR),
-                mx.io.DataDesc(C.SOURCE_LENGTH_NAME, (batch_size,), layout="N"),
-                mx.io.DataDesc('sequences', (batch_size, target_max_length), layout="NC"),
-                mx.io.DataDesc('lengths', (batch_size,), layout="N")]
+        num_source_caches = 2 * len(self.layers)
+        cache_names = self._cache_names()
+        return [mx.io.DataDesc(C.SOURCE_LENGTH_NAME, (batch_size,), layout="N"),
+                mx.io.DataDesc('lengths', (batch_size,), layout="N")] + \
+               [mx.io.DataDesc(name, (batch_size, source_encoded_max_length, self.config.model_size),
+                               layout=C.BATCH_MAJOR) for name in cache_names[:num_source_caches]] + \
+               [mx.io.DataDesc(name, (batch_size, target_max_length, self.config.model_size),
+                               layout=C.BATCH_MAJOR) for name in cache_names[num_source_caches:]]
+
+    def static_states(self) -> List[bool]:
+        """
+        Returns for each state in state_variables() whether it is static, i.e. identical for all hypotheses
+        of a sentence and passed through decode_step unchanged.
+        Source lengths and source-attention keys and values are static, lengths and self-attention caches are not.
+
+        :return: List of flags, one per state.
+        """
+        num_layers = len(self.layers)
+        return [True, False] + [True] * (2 * num_layers) + [False] * (2 * num_layers)
+
+    def _cache_names(self) -> List[str]:
+        """
+        Returns names of the source keys, source values, self-attention keys and self-attention values states
+        of all layers, in this order.
+        """
+        return ["%s%d_%s" % (self.prefix, i, name)
+                for name in [C.SOURCE_KEYS_NAME, C.SOURCE_VALUES_NAME, C.SELF_KEYS_NAME, C.SELF_VALUES_NAME]
+                for i in range(len(self.layers))]
 
     def get_rnn_cells(self) -> List[mx.rnn.BaseRNNCell]:
         """
@@ -365,11 +398,12 @@ class TransformerDecoder(Decoder):
         """
         return super().get_rnn_cells()
 
-    @staticmethod
-    def _get_target_max_length(source_encoded_max_length: int):
-        # TODO(fhieber): we need to hardcode this for the inference algorithm to work.
-        # This is currently in line with the beam_search algorithm but not ideal.
-        return source_encoded_max_length * C.TARGET_MAX_LENGTH_FACTOR
+    def _get_target_max_length(self, source_encoded_max_length: int) -> int:
+        """
+        Returns the maximum target length for incremental decoding, which determines the size of the self-attention
+        caches. The inference algorithm must not exceed this length.
+        """
+        return math.ceil(source_encoded_max_length * self.config.max_target_length_factor)
 
 
 RecurrentDecoderState = NamedTuple('RecurrentDecoderState', [
@@ -488,10 +522,11 @@ class RecurrentDecoder(Decoder):
             check_condition(self.num_hidden == self.config.num_embed,
                             "Weight tying requires target embedding size and rnn_num_hidden to be equal")
             logger.info("Tying the target embeddings and prediction matrix.")
-            self.cls_w = embed_weight
+            self.output_layer = layers.OutputLayer(vocab_size=self.config.vocab_size,
+                                                   weight=embed_weight,
+                                                   prefix="%scls_" % prefix)
         else:
-            self.cls_w = mx.sym.Variable("%scls_weight" % prefix)
-        self.cls_b = mx.sym.Variable("%scls_bias" % prefix)
+            self.output_layer = layers.OutputLayer(vocab_size=self.config.vocab_size, prefix="%scls_" % prefix)
 
     def _create_state_init_parameters(self):
         """
@@ -578,8 +613,7 @@ class RecurrentDecoder(Decoder):
         hidden_concat = mx.sym.reshape(data=hidden_concat, shape=(-1, self.num_hidden))
 
         # logits: (batch_size * target_seq_len, target_vocab_size)
-        logits = mx.sym.FullyConnected(data=hidden_concat, num_hidden=self.config.vocab_size,
-                                       weight=self.cls_w, bias=self.cls_b, name=C.LOGITS_NAME)
+        logits = self.output_layer(hidden_concat)
 
         if source_lexicon is not None:
             # lexical_biases_concat: (batch_size, target_seq_len, target_vocab_size)
@@ -598,19 +632,24 @@ class RecurrentDecoder(Decoder):
             -> Tuple[mx.sym.Symbol, mx.sym.Symbol, List[mx.sym.Symbol]]:
         """
         Decodes a single time step given the previous word id and previous decoder states.
-        Returns logits, attention probabilities, and next decoder states.
+        Returns the inputs to the output layer (decoder hidden state), attention probabilities,
+        and next decoder states. Logits are obtained by applying output_layer to the returned hidden state.
         Implementations can maintain an arbitrary number of states.
 
         :param prev_word_id: Previous word id. Shape: (batch_size,).
         :param source_encoded_max_length: Length of encoded source time dimension.
         :param states: Arbitrary list of decoder states.
-        :return: logits, attention probabilities, next decoder states.
+        :return: hidden state (logit inputs), attention probabilities, next decoder states.
         """
-        source_encoded, prev_dynamic_source, source_encoded_length, prev_hidden, *layer_states = states
+        source_encoded, prev_dynamic_source, source_encoded_length, prev_hidden, *other_states = states
+        num_layer_states = len(self.rnn.state_info)
+        layer_states, source_projections = other_states[:num_layer_states], other_states[num_layer_states:]
 
         word_vec_prev, _, _ = self.embedding.encode(prev_word_id, None, 1)
 
-        attention_func = self.attention.on(source_encoded, source_encoded_length, source_encoded_max_length)
+        # source projections are precomputed once per sentence in init_states()
+        attention_func = self.attention.on(source_encoded, source_encoded_length, source_encoded_max_length,
+                                           source_projections=source_projections)
 
         prev_state = RecurrentDecoderState(prev_hidden, list(layer_states))
         prev_attention_state = attentions.AttentionState(context=None, probs=None, dynamic_source=prev_dynamic_source)
@@ -623,16 +662,12 @@ class RecurrentDecoder(Decoder):
                                             attention_func,
                                             prev_attention_state)
 
-        # logits: (batch_size, target_vocab_size)
-        logits = mx.sym.FullyConnected(data=state.hidden, num_hidden=self.config.vocab_size,
-                                       weight=self.cls_w, bias=self.cls_b, name=C.LOGITS_NAME)
-
         new_states = [source_encoded,
                       attention_state.dynamic_source,
                       source_encoded_length,
-                      state.hidden] + state.layer_states
+                      state.hidden] + state.layer_states + source_projections
 
-        return logits, attention_state.probs, new_states
+        return state.hidden, attention_state.probs, new_states
 
     def reset(self):
         """
@@ -663,7 +698,8 @@ class RecurrentDecoder(Decoder):
         hidden, layer_states = self.get_initial_state(source_encoded_time_major, source_encoded_lengths)
         context, attention_probs, dynamic_source = self.attention.get_initial_state(source_encoded_lengths,
                                                                                     source_encoded_max_length)
-        states = [source_encoded, dynamic_source, source_encoded_lengths, hidden] + layer_states
+        source_projections = self.attention.project_source(source_encoded, source_encoded_max_length)
+        states = [source_encoded, dynamic_source, source_encoded_lengths, hidden] + layer_states + source_projections
         return states
 
     def state_variables(self) -> List[mx.sym.Symbol]:
@@ -677,7 +713,9 @@ class RecurrentDecoder(Decoder):
                 mx.sym.Variable(C.SOURCE_LENGTH_NAME),
                 mx.sym.Variable(C.HIDDEN_PREVIOUS_NAME)] + \
                [mx.sym.Variable("%senc2decinit_%d" % (self.prefix, i)) for i in
-                range(len(self.rnn.state_info))]
+                range(len(self.rnn.state_info))] + \
+               [mx.sym.Variable("%ssource_projection_%d" % (self.prefix, i)) for i in
+                range(len(self.attention.source_projection_num_hidden()))]
 
     def state_shapes(self,
                      batch_size: int,
@@ -706,7 +744,23 @@ class RecurrentDecoder(Decoder):
                                layout="NC")] + \
                [mx.io.DataDesc("%senc2decinit_%d" % (self.prefix, i),
                                (batch_size, num_hidden),
-                               layout=C.BATCH_MAJOR) for i, (_, num_hidden) in enumerate(self.rnn.state_shape)]
+                               layout=C.BATCH_MAJOR) for i, (_, num_hidden) in enumerate(self.rnn.state_shape)] + \
+               [mx.io.DataDesc("%ssource_projection_%d" % (self.prefix, i),
+                               (batch_size, source_encoded_max_length, num_hidden),
+                               layout=C.BATCH_MAJOR) for i, num_hidden in
+                enumerate(self.attention.source_projection_num_hidden())]
+
+    def static_states(self) -> List[bool]:
+        """
+        Returns for each state in state_variables() whether it is static, i.e. identical for all hypotheses
+        of a sentence and passed through decode_step unchanged.
+        Encoded source, source lengths and source projections are static, (coverage) dynamic source,
+        hidden and RNN layer states are not.
+
+        :return: List of flags, one per state.
+        """
+        return [True, False, True, False] + [False] * len(self.rnn.state_info) + \
+               [True] * len(self.attention.source_projection_num_hidden())
 
     def get_rnn_cells(self) -> List[mx.rnn.BaseRNNCell]:
         """
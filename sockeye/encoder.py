@@ -272,6 +272,39 @@ class Embedding(Encoder):
             embedding = mx.sym.Dropout(data=embedding, p=self.dropout, name="source_embed_dropout")
         return embedding, data_length, seq_len
 
+    def encode_step(self,
+                    data: mx.sym.Symbol,
+                    positions: mx.sym.Symbol,
+                    seq_len: int) -> mx.sym.Symbol:
+        """
+        Encodes a single time step of data. Positional encodings, if used, are those of the given positions.
+
+        :param data: Input data. Shape: (batch_size,).
+        :param positions: Position of each example in its sequence. Shape: (batch_size,).
+        :param seq_len: Maximum sequence length.
+        :return: Encoded data. Shape: (batch_size, 1, num_embed).
+        """
+        # (batch_size, 1, num_embed)
+        embedding = mx.sym.Embedding(data=mx.sym.expand_dims(data, axis=1),
+                                     input_dim=self.vocab_size,
+                                     weight=self.embed_weight,
+                                     output_dim=self.num_embed,
+                                     name=self.prefix + "embed")
+        if self.add_positional_encoding:
+            # (seq_len, num_embed)
+            positional_encodings = mx.sym.reshape(self.get_positional_encoding(length=seq_len,
+                                                                               depth=self.num_embed,
+                                                                               name="%spositional_encodings" %
+                                                                                    self.prefix),
+                                                  shape=(-3, -1))
+            # (batch_size, 1, num_embed)
+            positional_encodings = mx.sym.expand_dims(mx.sym.take(positional_encodings, positions), axis=1)
+            embedding = mx.sym.broadcast_add(embedding, positional_encodings,
+                                             name='%sadd_positional_encodings' % self.prefix)
+        if self.dropout > 0:
+            embedding = mx.sym.Dropout(data=embedding, p=self.dropout, name="source_embed_dropout")
+        return embedding
+
     @staticmethod
     def get_positional_encoding(length: int, depth: int, name: str) -> mx.sym.Symbol:
         """
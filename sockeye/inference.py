@@ -14,22 +14,167 @@
 """
 Code for inference/translation
 """
+import json
 import logging
 import os
-from typing import Dict, List, NamedTuple, Optional, Tuple, Callable
+import re
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Callable, Union
 
 import mxnet as mx
 import numpy as np
 
 from . import constants as C
 from . import data_io
+from . import lexicon
 from . import model
+from . import transformer
 from . import utils
 from . import vocab
 
 logger = logging.getLogger(__name__)
 
 
+def _get_mxnet_internal(obj, attribute_path: str):
+    """
+    Returns a private attribute of an MXNet object, or None if it does not exist. MXNet 0.10 has no public API for
+    the bound modules of a BucketingModule ('_buckets') or the executors of a Module ('_exec_group.execs'), which
+    bucket release and memory logging rely on. All access to private MXNet attributes goes through this function,
+    such that callers can handle their absence, e.g. after an MXNet upgrade.
+
+    :param obj: MXNet object.
+    :param attribute_path: Dot-separated attribute names.
+    :return: Attribute value or None.
+    """
+    for name in attribute_path.split("."):
+        obj = getattr(obj, name, None)
+        if obj is None:
+            return None
+    return obj
+
+
+class BoundedBucketingModule(mx.mod.BucketingModule):
+    """
+    BucketingModule that keeps at most max_buckets executors bound in addition to the default bucket. Buckets are
+    bound on demand and the least recently used bucket is released when the limit is exceeded. If this MXNet version
+    does not expose the bound modules, all buckets stay bound. Bind time of each newly bound bucket is logged, and
+    its executor memory with debug logging.
+
+    :param sym_gen: Symbol generator function.
+    :param default_bucket_key: Key of the default bucket, which is never released.
+    :param context: MXNet context to bind modules to.
+    :param max_buckets: Maximum number of bound non-default buckets, at least 1. None: unlimited.
+    """
+
+    def __init__(self,
+                 sym_gen: Callable,
+                 default_bucket_key,
+                 context: mx.context.Context,
+                 max_buckets: Optional[int] = None) -> None:
+        # the bucket in use must stay bound, otherwise every switch to it binds it again
+        utils.check_condition(max_buckets is None or max_buckets >= 1,
+                              "The maximum number of bound buckets must be positive")
+        super().__init__(sym_gen=sym_gen, default_bucket_key=default_bucket_key, context=context)
+        if max_buckets is not None and not isinstance(self._bound_modules(), dict):
+            logger.warning("MXNet %s does not expose the bound modules of a BucketingModule: "
+                           "all buckets stay bound", mx.__version__)
+            max_buckets = None
+        self.default_bucket_key = default_bucket_key
+        self.max_buckets = max_buckets
+        self.bucket_usage = OrderedDict()  # type: OrderedDict
+        self.num_binds = 0
+        self.num_releases = 0
+
+    def _bound_modules(self) -> Optional[Dict]:
+        """
+        Returns the mapping from bucket keys to bound modules, or None if not available.
+        """
+        return _get_mxnet_internal(self, "_buckets")
+
+    def bind(self, *args, **kwargs):
+        start = time.time()
+        super().bind(*args, **kwargs)
+        self._log_bind(self.default_bucket_key, time.time() - start)
+
+    def switch_bucket(self, bucket_key, data_shapes, label_shapes=None):
+        bound_modules = self._bound_modules()
+        if bound_modules is not None:
+            is_bound = bucket_key in bound_modules
+        else:
+            is_bound = bucket_key == self.default_bucket_key or bucket_key in self.bucket_usage
+        start = time.time()
+        super().switch_bucket(bucket_key, data_shapes, label_shapes)
+        if not is_bound:
+            self._log_bind(bucket_key, time.time() - start)
+        if bucket_key == self.default_bucket_key:
+            return
+        self.bucket_usage.pop(bucket_key, None)
+        self.bucket_usage[bucket_key] = True
+        while self.max_buckets is not None and len(self.bucket_usage) > self.max_buckets:
+            released_key, _ = self.bucket_usage.popitem(last=False)
+            del self._bound_modules()[released_key]
+            self.num_releases += 1
+            logger.debug("Released executor of bucket %s", released_key)
+
+    def _log_bind(self, bucket_key, seconds: float):
+        self.num_binds += 1
+        logger.info("Bound bucket %s in %.3fs", bucket_key, seconds)
+        # building the executor's debug string is expensive, so memory is only reported with debug logging
+        if logger.isEnabledFor(logging.DEBUG):
+            bound_modules = self._bound_modules()
+            memory = None if bound_modules is None else get_executor_memory_mb(bound_modules[bucket_key])
+            logger.debug("Executor memory of bucket %s: %s MB", bucket_key, "?" if memory is None else memory)
+
+
+def get_executor_memory_mb(module: mx.mod.Module) -> Optional[int]:
+    """
+    Returns the memory allocated by the executors of a bound module in MB, as reported by MXNet, or None if
+    not available. Parses the executors' debug strings, which is slow.
+
+    :param module: Bound module.
+    :return: Allocated memory in MB.
+    """
+    executors = _get_mxnet_internal(module, "_exec_group.execs")
+    if executors is None:
+        return None
+    total = 0
+    for executor in executors:
+        match = re.search(r"Total (\d+) MB allocated", executor.debug_str())
+        if match is None:
+            return None
+        total += int(match.group(1))
+    return total
+
+
+def get_padded_num_rows(num_rows: int, max_rows: int) -> int:
+    """
+    Returns the number of rows the decoder is run with for num_rows active rows: the next power of two, at most
+    max_rows. As the beam shrinks, decoder executors are then bound for a few row counts only.
+
+    :param num_rows: Number of active rows.
+    :param max_rows: Maximum number of rows, i.e. batch_size * beam_size.
+    :return: Padded number of rows.
+    """
+    return min(max_rows, 1 << (num_rows - 1).bit_length())
+
+
+def pad_rows(arrays: List[mx.nd.NDArray], num_rows: int) -> List[mx.nd.NDArray]:
+    """
+    Pads arrays along their first axis to num_rows rows with copies of their last row.
+
+    :param arrays: Arrays with the same number of rows.
+    :param num_rows: Number of rows after padding.
+    :return: Padded arrays.
+    """
+    num_active_rows = arrays[0].shape[0]
+    if num_active_rows == num_rows:
+        return arrays
+    indices = mx.nd.array(np.minimum(np.arange(num_rows), num_active_rows - 1), ctx=arrays[0].context)
+    return [mx.nd.take(array, indices) for array in arrays]
+
+
 class InferenceModel(model.SockeyeModel):
     """
     InferenceModel is a SockeyeModel that supports three operations used for inference/decoding:
@@ -42,8 +187,22 @@ class InferenceModel(model.SockeyeModel):
     :param fused: Whether to use FusedRNNCell (CuDNN). Only works with GPU context.
     :param max_input_len: Maximum input length.
     :param beam_size: Beam size.
+    :param batch_size: Number of sentences decoded together. Decoder modules are bound to batch_size * beam_size.
     :param checkpoint: Checkpoint to load. If None, finds best parameters in model_folder.
     :param softmax_temperature: Optional parameter to control steepness of softmax distribution.
+    :param decoder_return_logit_inputs: Decoder returns inputs to the output layer rather than a distribution over
+           the target vocabulary. The output layer is then applied outside of the decoder module, e.g. to a
+           restricted target vocabulary.
+    :param max_output_length_num_stds: Number of standard deviations of the training target/source length ratio
+           added to its mean to determine the maximum output length relative to the input length.
+    :param decoder_return_attention: Decoder returns attention scores. Otherwise, they are not copied out of the
+           decoder graph and run_decoder returns None for them.
+    :param bind: Bind encoder and decoder modules. Members of a FusedEnsembleModel only provide their graphs and
+           parameters and are not bound themselves.
+    :param max_bound_buckets: Maximum number of executors bound per module in addition to the largest bucket.
+           Least recently used buckets are released. None: unlimited.
+    :param mmap_params: Memory-map parameters from the file written by sockeye.mmap_params next to the parameter
+           file of the checkpoint, instead of loading the parameter file.
     """
 
     def __init__(self,
@@ -52,8 +211,15 @@ class InferenceModel(model.SockeyeModel):
                  fused: bool,
                  max_input_len: Optional[int],
                  beam_size: int,
+                 batch_size: int = 1,
                  checkpoint: Optional[int] = None,
-                 softmax_temperature: Optional[float] = None):
+                 softmax_temperature: Optional[float] = None,
+                 decoder_return_logit_inputs: bool = False,
+                 max_output_length_num_stds: int = C.DEFAULT_NUM_STD_MAX_OUTPUT_LENGTH,
+                 decoder_return_attention: bool = True,
+                 bind: bool = True,
+                 max_bound_buckets: Optional[int] = None,
+                 mmap_params: bool = False):
         self.model_version = utils.load_version(os.path.join(model_folder, C.VERSION_NAME))
         logger.info("Model version: %s", self.model_version)
         utils.check_version(self.model_version)
@@ -67,32 +233,113 @@ class InferenceModel(model.SockeyeModel):
                 logger.warning("Model was trained with max_seq_len_source=%d, but using max_input_len=%d.",
                                config.max_seq_len_source, max_input_len)
         config.max_seq_len_source = max_input_len
+        # maximum output length relative to the input length
+        self.max_output_length_factor = config.config_data.length_ratio_mean + \
+                                        max_output_length_num_stds * config.config_data.length_ratio_std
+        if isinstance(config.config_decoder, transformer.TransformerConfig):
+            # size self-attention caches of the step graphs to the maximum output length
+            config.config_decoder.max_target_length_factor = self.max_output_length_factor
         super().__init__(config)
 
         fname_params = os.path.join(model_folder, C.PARAMS_NAME % checkpoint if checkpoint else C.PARAMS_BEST_NAME)
 
         utils.check_condition(beam_size < self.config.vocab_target_size,
                               'The beam size must be smaller than the target vocabulary size.')
+        utils.check_condition(batch_size > 0, 'The batch size must be positive.')
 
         self.beam_size = beam_size
+        self.batch_size = batch_size
         self.softmax_temperature = softmax_temperature
-        self.encoder_batch_size = 1
+        self.decoder_return_logit_inputs = decoder_return_logit_inputs
+        self.decoder_return_attention = decoder_return_attention
+        self.max_bound_buckets = max_bound_buckets
+        self.encoder_batch_size = batch_size
         self.context = context
 
         self._build_model_components(fused)
-        self.encoder_module = self._get_encoder_module()
-        self.decoder_module = self._get_decoder_module()
-
         self.decoder_data_shapes_cache = dict()  # bucket_key -> shape cache
-        max_encoder_data_shapes = self._get_encoder_data_shapes(self.config.max_seq_len_source)
-        source_encoded_max_seq_len = self.encoder.get_encoded_seq_len(self.config.max_seq_len_source)
-        max_decoder_data_shapes = self._get_decoder_data_shapes(source_encoded_max_seq_len)
-        self.encoder_module.bind(data_shapes=max_encoder_data_shapes, for_training=False, grad_req="null")
-        self.decoder_module.bind(data_shapes=max_decoder_data_shapes, for_training=False, grad_req="null")
+        if mmap_params:
+            self.load_params_from_mmap(fname_params + C.PARAMS_MMAP_SUFFIX)
+        else:
+            self.load_params_from_file(fname_params)
+
+        if bind:
+            self.encoder_module = self._get_encoder_module()
+            self.decoder_module = self._get_decoder_module()
+            max_encoder_data_shapes = self._get_encoder_data_shapes(self.config.max_seq_len_source)
+            source_encoded_max_seq_len = self.get_encoded_seq_len(self.config.max_seq_len_source)
+            max_decoder_data_shapes = self._get_decoder_data_shapes((source_encoded_max_seq_len,
+                                                                     self.batch_size * self.beam_size))
+            self.encoder_module.bind(data_shapes=max_encoder_data_shapes, for_training=False, grad_req="null")
+            self.decoder_module.bind(data_shapes=max_decoder_data_shapes, for_training=False, grad_req="null")
+            self.encoder_module.init_params(arg_params=self.params, allow_missing=False)
+            self.decoder_module.init_params(arg_params=self.params, allow_missing=False)
+
+        if self.decoder_return_logit_inputs:
+            # output layer parameters to be sliced to restricted target vocabularies
+            self.output_layer_w = self.params[self.decoder.output_layer.w.name].as_in_context(self.context)
+            self.output_layer_b = self.params[self.decoder.output_layer.b.name].as_in_context(self.context)
+
+    def get_encoded_seq_len(self, source_seq_len: int) -> int:
+        """
+        Returns the length of the encoded source sequence, i.e. the first element of decoder bucket keys.
 
-        self.load_params_from_file(fname_params)
-        self.encoder_module.init_params(arg_params=self.params, allow_missing=False)
-        self.decoder_module.init_params(arg_params=self.params, allow_missing=False)
+        :param source_seq_len: Source sequence length (encoder bucket key).
+        :return: Encoded sequence length.
+        """
+        return self.encoder.get_encoded_seq_len(source_seq_len)
+
+    def static_states(self) -> List[bool]:
+        """
+        Returns for each decoder state whether it is static, i.e. never changed by the decoder.
+        """
+        return self.decoder.static_states()
+
+    def get_encoder_graph(self, source_seq_len: int) -> List[mx.sym.Symbol]:
+        """
+        Returns the encoder graph: the initial decoder states computed from the source sequence.
+
+        :param source_seq_len: Source sequence length (bucket key).
+        :return: List of initial decoder states.
+        """
+        source = mx.sym.Variable(C.SOURCE_NAME)
+        source_length = utils.compute_lengths(source)
+
+        (source_encoded,
+         source_encoded_length,
+         source_encoded_seq_len) = self.encoder.encode(source, source_length, source_seq_len)
+        # TODO(fhieber): Consider standardizing encoders to return batch-major data to avoid this line.
+        source_encoded = mx.sym.swapaxes(source_encoded, dim1=0, dim2=1)
+
+        # initial decoder states
+        return self.decoder.init_states(source_encoded, source_encoded_length, source_encoded_seq_len)
+
+    def get_decoder_step_graph(self, source_encoded_seq_len: int) \
+            -> Tuple[mx.sym.Symbol, mx.sym.Symbol, List[mx.sym.Symbol], List[str]]:
+        """
+        Returns the graph of a single decoder step given the previous word (C.TARGET_PREVIOUS_NAME) and the
+        previous decoder states.
+
+        :param source_encoded_seq_len: Length of the encoded source sequence.
+        :return: Distribution over the next word (or output layer inputs if decoder_return_logit_inputs),
+                 attention scores, next decoder states, names of the previous decoder state variables.
+        """
+        self.decoder.reset()
+        prev_word_id = mx.sym.Variable(C.TARGET_PREVIOUS_NAME)
+        states = self.decoder.state_variables()
+        state_names = [state.name for state in states]
+        hidden, attention_probs, states = self.decoder.decode_step(prev_word_id,
+                                                                   source_encoded_seq_len,
+                                                                   *states)
+        if self.decoder_return_logit_inputs:
+            # distinct output node as the hidden state may also be part of the decoder states
+            outputs = mx.sym.identity(hidden, name=C.LOGIT_INPUTS_NAME)
+        else:
+            logits = self.decoder.output_layer(hidden)
+            if self.softmax_temperature is not None:
+                logits /= self.softmax_temperature
+            outputs = mx.sym.softmax(data=logits, name=C.SOFTMAX_NAME)
+        return outputs, attention_probs, states, state_names
 
     def _get_encoder_module(self) -> mx.mod.BucketingModule:
         """
@@ -104,59 +351,44 @@ class InferenceModel(model.SockeyeModel):
         """
 
         def sym_gen(source_seq_len: int):
-            source = mx.sym.Variable(C.SOURCE_NAME)
-            source_length = utils.compute_lengths(source)
-
-            (source_encoded,
-             source_encoded_length,
-             source_encoded_seq_len) = self.encoder.encode(source, source_length, source_seq_len)
-            # TODO(fhieber): Consider standardizing encoders to return batch-major data to avoid this line.
-            source_encoded = mx.sym.swapaxes(source_encoded, dim1=0, dim2=1)
-
-            # initial decoder states
-            decoder_init_states = self.decoder.init_states(source_encoded,
-                                                           source_encoded_length,
-                                                           source_encoded_seq_len)
-
+            decoder_init_states = self.get_encoder_graph(source_seq_len)
             data_names = [C.SOURCE_NAME]
             label_names = []
             return mx.sym.Group(decoder_init_states), data_names, label_names
 
-        return mx.mod.BucketingModule(sym_gen=sym_gen,
+        return BoundedBucketingModule(sym_gen=sym_gen,
                                       default_bucket_key=self.config.max_seq_len_source,
-                                      context=self.context)
+                                      context=self.context,
+                                      max_buckets=self.max_bound_buckets)
 
     def _get_decoder_module(self) -> mx.mod.BucketingModule:
         """
         Returns a BucketingModule for a single decoder step.
         Given previously predicted word and previous decoder states, it returns
         a distribution over the next predicted word and the next decoder states.
-        The bucket key for this module is the length of the ENCODED source sequence.
+        If decoder_return_logit_inputs is set, the inputs to the output layer are returned instead of the distribution.
+        Attention scores are only returned if decoder_return_attention is set.
+        The bucket key for this module is the length of the ENCODED source sequence and the number of decoded rows,
+        which is batch_size * beam_size unless the beam shrinks as hypotheses finish.
 
         :return: Decoder BucketingModule.
         """
 
-        def sym_gen(source_encoded_seq_len: int):
-            self.decoder.reset()
-            prev_word_id = mx.sym.Variable(C.TARGET_PREVIOUS_NAME)
-            states = self.decoder.state_variables()
-            state_names = [state.name for state in states]
-            logits, attention_probs, states = self.decoder.decode_step(prev_word_id,
-                                                                       source_encoded_seq_len,
-                                                                       *states)
-            if self.softmax_temperature is not None:
-                logits /= self.softmax_temperature
-
-            softmax = mx.sym.softmax(data=logits, name=C.SOFTMAX_NAME)
-
+        def sym_gen(bucket_key: Tuple[int, int]):
+            source_encoded_seq_len, _ = bucket_key
+            outputs, attention_probs, states, state_names = self.get_decoder_step_graph(source_encoded_seq_len)
             data_names = [C.TARGET_PREVIOUS_NAME] + state_names
             label_names = []
-            return mx.sym.Group([softmax, attention_probs] + states), data_names, label_names
+            if self.decoder_return_attention:
+                return mx.sym.Group([outputs, attention_probs] + states), data_names, label_names
+            return mx.sym.Group([outputs] + states), data_names, label_names
 
-        source_encoded_max_seq_len = self.encoder.get_encoded_seq_len(self.config.max_seq_len_source)
-        return mx.mod.BucketingModule(sym_gen=sym_gen,
-                                      default_bucket_key=source_encoded_max_seq_len,
-                                      context=self.context)
+        source_encoded_max_seq_len = self.get_encoded_seq_len(self.config.max_seq_len_source)
+        return BoundedBucketingModule(sym_gen=sym_gen,
+                                      default_bucket_key=(source_encoded_max_seq_len,
+                                                          self.batch_size * self.beam_size),
+                                      context=self.context,
+                                      max_buckets=self.max_bound_buckets)
 
     def _get_encoder_data_shapes(self, source_max_length: int) -> List[mx.io.DataDesc]:
         """
@@ -169,18 +401,21 @@ class InferenceModel(model.SockeyeModel):
                                shape=(self.encoder_batch_size, source_max_length),
                                layout=C.BATCH_MAJOR)]
 
-    def _get_decoder_data_shapes(self, source_encoded_max_length) -> List[mx.io.DataDesc]:
+    def _get_decoder_data_shapes(self, bucket_key: Tuple[int, int]) -> List[mx.io.DataDesc]:
         """
-        Returns data shapes of the decoder module, given a bucket_key (source input length)
+        Returns data shapes of the decoder module, given a bucket_key (encoded input length, number of rows).
         Caches results for bucket_keys if called iteratively.
 
-        :param source_encoded_max_length: Input length.
+        :param bucket_key: Encoded input length and number of decoded rows.
         :return: List of data descriptions.
         """
+        source_encoded_max_length, num_rows = bucket_key
         return self.decoder_data_shapes_cache.setdefault(
-            source_encoded_max_length,
-            [mx.io.DataDesc(C.TARGET_PREVIOUS_NAME, (self.beam_size,), layout="N")] +
-            self.decoder.state_shapes(self.beam_size, source_encoded_max_length, self.encoder.get_num_hidden()))
+            bucket_key,
+            [mx.io.DataDesc(C.TARGET_PREVIOUS_NAME, (num_rows,), layout="N")] +
+            self.decoder.state_shapes(num_rows,
+                                      source_encoded_max_length,
+                                      self.encoder.get_num_hidden()))
 
     def run_encoder(self,
                     source: mx.nd.NDArray,
@@ -189,9 +424,10 @@ class InferenceModel(model.SockeyeModel):
         Runs forward pass of the encoder.
         Encodes source given source length and bucket key.
         Returns encoder representation of the source, source_length, initial hidden state of decoder RNN,
-        and initial decoder states tiled to beam size.
+        and initial decoder states tiled to beam size. Each sentence of the batch is repeated beam_size times
+        such that rows [i * beam_size, (i + 1) * beam_size) hold the states of sentence i.
 
-        :param source: Integer-coded input tokens.
+        :param source: Integer-coded input tokens. Shape: (batch_size, source_max_length).
         :param source_max_length: Bucket key.
         :return: Encoded source, source length, initial decoder hidden state, initial decoder hidden states.
         """
@@ -203,23 +439,271 @@ class InferenceModel(model.SockeyeModel):
         self.encoder_module.forward(data_batch=batch, is_train=False)
         decoder_states = self.encoder_module.get_outputs()
         # replicate encoder/init module results beam size times
-        decoder_states = [mx.nd.broadcast_axis(s, axis=0, size=self.beam_size) for s in decoder_states]
+        decoder_states = [mx.nd.repeat(s, repeats=self.beam_size, axis=0) for s in decoder_states]
         return decoder_states
 
     def run_decoder(self, model_state: 'ModelState') -> Tuple[mx.nd.NDArray, mx.nd.NDArray, 'ModelState']:
         """
         Runs forward pass of the single-step decoder.
+        The number of decoded rows is given by the model state and may be smaller than batch_size * beam_size.
+        Rows are padded to the next power of two (see get_padded_num_rows) to limit the number of bound buckets.
 
-        :return: Probability distribution over next word, attention scores, updated model state.
+        :return: Probability distribution over next word (or output layer inputs if decoder_return_logit_inputs),
+                 attention scores (None unless decoder_return_attention), updated model state.
         """
+        num_rows = model_state.prev_target_word_id.shape[0]
+        padded_num_rows = get_padded_num_rows(num_rows, self.batch_size * self.beam_size)
+        bucket_key = (model_state.bucket_key, padded_num_rows)
         batch = mx.io.DataBatch(
-            data=[model_state.prev_target_word_id.as_in_context(self.context)] + model_state.decoder_states,
+            data=pad_rows([model_state.prev_target_word_id.as_in_context(self.context)] + model_state.decoder_states,
+                          padded_num_rows),
             label=None,
-            bucket_key=model_state.bucket_key,
-            provide_data=self._get_decoder_data_shapes(model_state.bucket_key))
+            bucket_key=bucket_key,
+            provide_data=self._get_decoder_data_shapes(bucket_key))
         self.decoder_module.forward(data_batch=batch, is_train=False)
-        probs, attention_probs, *model_state.decoder_states = self.decoder_module.get_outputs()
-        return probs, attention_probs, model_state
+        module_outputs = self.decoder_module.get_outputs()
+        if padded_num_rows > num_rows:
+            module_outputs = [output[:num_rows] for output in module_outputs]
+        if self.decoder_return_attention:
+            outputs, attention_probs, *model_state.decoder_states = module_outputs
+        else:
+            attention_probs = None
+            outputs, *model_state.decoder_states = module_outputs
+        return outputs, attention_probs, model_state
+
+
+def _prefix_graph(symbol: mx.sym.Symbol, prefix: str) -> mx.sym.Symbol:
+    """
+    Returns a copy of symbol with prefix prepended to the names of all nodes, including parameter and data
+    variables, such that the graphs of several models can be combined without name clashes.
+
+    :param symbol: Symbol, possibly grouping several outputs.
+    :param prefix: Name prefix.
+    :return: Renamed symbol.
+    """
+    graph = json.loads(symbol.tojson())
+    for node in graph["nodes"]:
+        node["name"] = prefix + node["name"]
+    return mx.sym.load_json(json.dumps(graph))
+
+
+class FusedEnsembleModel:
+    """
+    FusedEnsembleModel combines the encoders and single-step decoders of several InferenceModels into one encoder
+    BucketingModule and one decoder BucketingModule. Member predictions are interpolated inside the decoder graph,
+    such that one forward call per step serves the whole ensemble and MXNet can schedule the computations of the
+    members in parallel. To the Translator, it looks like a single InferenceModel that returns the combined
+    distribution over the next word and averaged attention scores.
+    All nodes of member i are prefixed with C.ENSEMBLE_MEMBER_PREFIX % i. Its decoder states are the concatenated
+    states of the members.
+
+    :param models: Member models, loaded with bind=False.
+    :param context: MXNet context to bind modules to.
+    :param ensemble_mode: Ensemble mode: linear or log_linear combination.
+    :param max_bound_buckets: Maximum number of executors bound per module in addition to the largest bucket.
+           None: unlimited.
+    """
+
+    def __init__(self,
+                 models: List[InferenceModel],
+                 context: mx.context.Context,
+                 ensemble_mode: str,
+                 max_bound_buckets: Optional[int] = None) -> None:
+        utils.check_condition(len(models) > 1, "A fused ensemble requires at least two models")
+        utils.check_condition(ensemble_mode in ('linear', 'log_linear'), "unknown interpolation type")
+        utils.check_condition(not any(m.decoder_return_logit_inputs for m in models),
+                              "Fused ensembles do not support vocabulary restriction")
+        self.models = models
+        self.context = context
+        self.ensemble_mode = ensemble_mode
+        self.max_bound_buckets = max_bound_buckets
+        self.config = models[0].config
+        self.beam_size = models[0].beam_size
+        self.batch_size = models[0].batch_size
+        utils.check_condition(all(m.beam_size == self.beam_size and m.batch_size == self.batch_size
+                                  for m in models),
+                              "Models must agree on beam size and batch size")
+        for bucket_key in data_io.define_buckets(self.config.max_seq_len_source):
+            utils.check_condition(all(m.get_encoded_seq_len(bucket_key) == self.get_encoded_seq_len(bucket_key)
+                                      for m in models),
+                                  "Models must agree on encoded sequence length")
+        self.max_output_length_factor = min(m.max_output_length_factor for m in models)
+        self.decoder_return_logit_inputs = False
+        self.decoder_return_attention = all(m.decoder_return_attention for m in models)
+        self.softmax_temperature = None  # applied by the member graphs
+        self.prefixes = [C.ENSEMBLE_MEMBER_PREFIX % i for i in range(len(models))]
+        self.num_member_states = [len(m.static_states()) for m in models]
+        if all(isinstance(m.params, utils.MappedParams) for m in models):
+            # keep parameters in the page cache instead of creating NDArrays for all members at once
+            self.params = utils.MappedParams({prefix + name: array for prefix, m in zip(self.prefixes, models)
+                                              for name, array in m.params.arrays.items()})
+        else:
+            self.params = {prefix + name: param
+                           for prefix, m in zip(self.prefixes, models) for name, param in m.params.items()}
+
+        self.encoder_module = self._get_encoder_module()
+        self.decoder_module = self._get_decoder_module()
+        self.decoder_data_shapes_cache = dict()  # bucket_key -> shape cache
+        max_encoder_data_shapes = self._get_encoder_data_shapes(self.config.max_seq_len_source)
+        source_encoded_max_seq_len = self.get_encoded_seq_len(self.config.max_seq_len_source)
+        max_decoder_data_shapes = self._get_decoder_data_shapes((source_encoded_max_seq_len,
+                                                                 self.batch_size * self.beam_size))
+        self.encoder_module.bind(data_shapes=max_encoder_data_shapes, for_training=False, grad_req="null")
+        self.decoder_module.bind(data_shapes=max_decoder_data_shapes, for_training=False, grad_req="null")
+        self.encoder_module.init_params(arg_params=self.params, allow_missing=False)
+        self.decoder_module.init_params(arg_params=self.params, allow_missing=False)
+        logger.info("Fused ensemble of %d models (ensemble_mode=%s)", len(models), ensemble_mode)
+
+    def get_encoded_seq_len(self, source_seq_len: int) -> int:
+        """
+        Returns the length of the encoded source sequence, which all members agree on.
+
+        :param source_seq_len: Source sequence length (encoder bucket key).
+        :return: Encoded sequence length.
+        """
+        return self.models[0].get_encoded_seq_len(source_seq_len)
+
+    def static_states(self) -> List[bool]:
+        """
+        Returns for each decoder state of each member whether it is static.
+        """
+        return [is_static for m in self.models for is_static in m.static_states()]
+
+    def _get_encoder_module(self) -> mx.mod.BucketingModule:
+        """
+        Returns a BucketingModule computing the initial decoder states of all members.
+        Each member reads the source from its own data variable.
+
+        :return: Encoder BucketingModule.
+        """
+
+        def sym_gen(source_seq_len: int):
+            members = [_prefix_graph(mx.sym.Group(m.get_encoder_graph(source_seq_len)), prefix)
+                       for prefix, m in zip(self.prefixes, self.models)]
+            data_names = [prefix + C.SOURCE_NAME for prefix in self.prefixes]
+            label_names = []
+            return mx.sym.Group(members), data_names, label_names
+
+        return BoundedBucketingModule(sym_gen=sym_gen,
+                                      default_bucket_key=self.config.max_seq_len_source,
+                                      context=self.context,
+                                      max_buckets=self.max_bound_buckets)
+
+    def _get_decoder_module(self) -> mx.mod.BucketingModule:
+        """
+        Returns a BucketingModule for a single decoder step of all members. It returns the interpolated distribution
+        over the next word, averaged attention scores (if decoder_return_attention) and the next decoder states of
+        all members. Each member reads the previous word from its own data variable.
+        The bucket key for this module is the length of the ENCODED source sequence and the number of decoded rows.
+
+        :return: Decoder BucketingModule.
+        """
+
+        def sym_gen(bucket_key: Tuple[int, int]):
+            source_encoded_seq_len, _ = bucket_key
+            probs, attention_probs, states, data_names = [], [], [], []
+            for prefix, m in zip(self.prefixes, self.models):
+                outputs, attention, member_states, state_names = m.get_decoder_step_graph(source_encoded_seq_len)
+                member = _prefix_graph(mx.sym.Group([outputs, attention] + member_states), prefix)
+                probs.append(member[0])
+                attention_probs.append(member[1])
+                states.extend(member[i] for i in range(2, 2 + len(member_states)))
+                data_names.extend([prefix + C.TARGET_PREVIOUS_NAME] + [prefix + name for name in state_names])
+
+            num_models = len(self.models)
+            if self.ensemble_mode == 'linear':
+                outputs = mx.sym.add_n(*probs) / num_models
+            else:
+                # averaged and re-normalized log probabilities
+                outputs = mx.sym.softmax(mx.sym.add_n(*[mx.sym.log(p) for p in probs]) / num_models)
+            label_names = []
+            if self.decoder_return_attention:
+                attention = mx.sym.add_n(*attention_probs) / num_models
+                return mx.sym.Group([outputs, attention] + states), data_names, label_names
+            return mx.sym.Group([outputs] + states), data_names, label_names
+
+        source_encoded_max_seq_len = self.get_encoded_seq_len(self.config.max_seq_len_source)
+        return BoundedBucketingModule(sym_gen=sym_gen,
+                                      default_bucket_key=(source_encoded_max_seq_len,
+                                                          self.batch_size * self.beam_size),
+                                      context=self.context,
+                                      max_buckets=self.max_bound_buckets)
+
+    def _get_encoder_data_shapes(self, source_max_length: int) -> List[mx.io.DataDesc]:
+        """
+        Returns data shapes of the encoder module: the source input of each member.
+
+        :param source_max_length: Maximum input length.
+        :return: List of data descriptions.
+        """
+        return [mx.io.DataDesc(name=prefix + C.SOURCE_NAME,
+                               shape=(self.batch_size, source_max_length),
+                               layout=C.BATCH_MAJOR) for prefix in self.prefixes]
+
+    def _get_decoder_data_shapes(self, bucket_key: Tuple[int, int]) -> List[mx.io.DataDesc]:
+        """
+        Returns data shapes of the decoder module: previous word and decoder states of each member.
+        Caches results for bucket_keys if called iteratively.
+
+        :param bucket_key: Encoded input length and number of decoded rows.
+        :return: List of data descriptions.
+        """
+        if bucket_key not in self.decoder_data_shapes_cache:
+            self.decoder_data_shapes_cache[bucket_key] = [
+                mx.io.DataDesc(prefix + desc.name, desc.shape, dtype=desc.dtype, layout=desc.layout)
+                for prefix, m in zip(self.prefixes, self.models) for desc in m._get_decoder_data_shapes(bucket_key)]
+        return self.decoder_data_shapes_cache[bucket_key]
+
+    def run_encoder(self,
+                    source: mx.nd.NDArray,
+                    source_max_length: int) -> List[mx.nd.NDArray]:
+        """
+        Runs forward pass of the encoders of all members and returns their initial decoder states, tiled to beam size.
+
+        :param source: Integer-coded input tokens. Shape: (batch_size, source_max_length).
+        :param source_max_length: Bucket key.
+        :return: Concatenated initial decoder states of all members.
+        """
+        batch = mx.io.DataBatch(data=[source] * len(self.models),
+                                label=None,
+                                bucket_key=source_max_length,
+                                provide_data=self._get_encoder_data_shapes(source_max_length))
+        self.encoder_module.forward(data_batch=batch, is_train=False)
+        # replicate encoder/init module results beam size times
+        return [mx.nd.repeat(s, repeats=self.beam_size, axis=0) for s in self.encoder_module.get_outputs()]
+
+    def run_decoder(self, model_state: 'ModelState') -> Tuple[mx.nd.NDArray, mx.nd.NDArray, 'ModelState']:
+        """
+        Runs forward pass of the fused single-step decoder. Rows are padded like in InferenceModel.run_decoder.
+
+        :return: Interpolated probability distribution over next word, averaged attention scores (None unless
+                 decoder_return_attention), updated model state.
+        """
+        num_rows = model_state.prev_target_word_id.shape[0]
+        padded_num_rows = get_padded_num_rows(num_rows, self.batch_size * self.beam_size)
+        bucket_key = (model_state.bucket_key, padded_num_rows)
+        data_shapes = self._get_decoder_data_shapes(bucket_key)
+        prev_target_word_id, *decoder_states = pad_rows(
+            [model_state.prev_target_word_id.as_in_context(self.context)] + model_state.decoder_states,
+            padded_num_rows)
+        # each member reads the previous word followed by its decoder states
+        data = []  # type: List[mx.nd.NDArray]
+        offset = 0
+        for num_states in self.num_member_states:
+            data.append(prev_target_word_id)
+            data.extend(decoder_states[offset:offset + num_states])
+            offset += num_states
+        batch = mx.io.DataBatch(data=data, label=None, bucket_key=bucket_key, provide_data=data_shapes)
+        self.decoder_module.forward(data_batch=batch, is_train=False)
+        module_outputs = self.decoder_module.get_outputs()
+        if padded_num_rows > num_rows:
+            module_outputs = [output[:num_rows] for output in module_outputs]
+        if self.decoder_return_attention:
+            outputs, attention_probs, *model_state.decoder_states = module_outputs
+        else:
+            attention_probs = None
+            outputs, *model_state.decoder_states = module_outputs
+        return outputs, attention_probs, model_state
 
 
 def load_models(context: mx.context.Context,
@@ -227,10 +711,19 @@ def load_models(context: mx.context.Context,
                 beam_size: int,
                 model_folders: List[str],
                 checkpoints: Optional[List[int]] = None,
-                softmax_temperature: Optional[float] = None) \
-        -> Tuple[List[InferenceModel], Dict[str, int], Dict[str, int]]:
+                softmax_temperature: Optional[float] = None,
+                batch_size: int = 1,
+                decoder_return_logit_inputs: bool = False,
+                max_output_length_num_stds: int = C.DEFAULT_NUM_STD_MAX_OUTPUT_LENGTH,
+                decoder_return_attention: bool = True,
+                fuse_ensemble: bool = False,
+                ensemble_mode: str = 'linear',
+                max_bound_buckets: Optional[int] = None,
+                mmap_params: bool = False) \
+        -> Tuple[List[Union[InferenceModel, FusedEnsembleModel]], Dict[str, int], Dict[str, int]]:
     """
     Loads a list of models for inference.
+    If fuse_ensemble is set and several models are given, they are combined into a single FusedEnsembleModel.
 
     :param context: MXNet context to bind modules to.
     :param max_input_len: Maximum input length.
@@ -238,11 +731,21 @@ def load_models(context: mx.context.Context,
     :param model_folders: List of model folders to load models from.
     :param checkpoints: List of checkpoints to use for each model in model_folders. Use None to load best checkpoint.
     :param softmax_temperature: Optional parameter to control steepness of softmax distribution.
+    :param batch_size: Number of sentences translated together.
+    :param decoder_return_logit_inputs: Decoder returns inputs to the output layer, e.g. for vocabulary restriction.
+    :param max_output_length_num_stds: Number of standard deviations of the training target/source length ratio
+           added to its mean to determine the maximum output length.
+    :param decoder_return_attention: Decoder returns attention scores, e.g. for alignment output.
+    :param fuse_ensemble: Combine several models into one encoder and one decoder graph.
+    :param ensemble_mode: Ensemble mode of a fused ensemble: linear or log_linear combination.
+    :param max_bound_buckets: Maximum number of executors bound per module in addition to the largest bucket.
+    :param mmap_params: Memory-map parameters written by sockeye.mmap_params.
     :return: List of models, source vocabulary, target vocabulary.
     """
     models, source_vocabs, target_vocabs = [], [], []
     if checkpoints is None:
         checkpoints = [None] * len(model_folders)
+    fuse_ensemble = fuse_ensemble and len(model_folders) > 1
     for model_folder, checkpoint in zip(model_folders, checkpoints):
         source_vocabs.append(vocab.vocab_from_json_or_pickle(os.path.join(model_folder, C.VOCAB_SRC_NAME)))
         target_vocabs.append(vocab.vocab_from_json_or_pickle(os.path.join(model_folder, C.VOCAB_TRG_NAME)))
@@ -251,8 +754,15 @@ def load_models(context: mx.context.Context,
                                fused=False,
                                max_input_len=max_input_len,
                                beam_size=beam_size,
+                               batch_size=batch_size,
                                softmax_temperature=softmax_temperature,
-                               checkpoint=checkpoint)
+                               checkpoint=checkpoint,
+                               decoder_return_logit_inputs=decoder_return_logit_inputs,
+                               max_output_length_num_stds=max_output_length_num_stds,
+                               decoder_return_attention=decoder_return_attention,
+                               bind=not fuse_ensemble,
+                               max_bound_buckets=max_bound_buckets,
+                               mmap_params=mmap_params)
         models.append(model)
 
     utils.check_condition(all(set(vocab.items()) == set(source_vocabs[0].items()) for vocab in source_vocabs),
@@ -260,6 +770,8 @@ def load_models(context: mx.context.Context,
     utils.check_condition(all(set(vocab.items()) == set(target_vocabs[0].items()) for vocab in target_vocabs),
                           "Target vocabulary ids do not match")
 
+    if fuse_ensemble:
+        models = [FusedEnsembleModel(models, context, ensemble_mode, max_bound_buckets)]
     return models, source_vocabs[0], target_vocabs[0]
 
 
@@ -289,30 +801,91 @@ Output structure from Translator.
 :param id: Id of input sentence.
 :param translation: Translation string without sentence boundary tokens.
 :param tokens: List of translated tokens.
-:param attention_matrix: Attention matrix. Shape: (target_length, source_length).
+:param attention_matrix: Attention matrix. Shape: (target_length, source_length), or (target_length, 0) if the
+       models do not return attention scores.
 :param score: Negative log probability of generated translation.
 """
 
+TranslatorTimings = NamedTuple('TranslatorTimings', [
+    ('prepare', float),
+    ('encode', float),
+    ('decode_steps', int),
+    ('decoder_forward', float),
+    ('search', float),
+    ('result_assembly', float),
+])
+"""
+Where the translation time of a sentence went. Times are in seconds, those of a batch divided by its number of
+sentences.
+
+:param prepare: Conversion of input tokens into source ids.
+:param encode: Encoder forward passes.
+:param decode_steps: Number of decoder steps of the batch.
+:param decoder_forward: Decoder forward passes, including output layers of restricted vocabularies.
+:param search: Top-k selection, beam bookkeeping and backtracking of the best hypotheses.
+:param result_assembly: Conversion of target ids into translator outputs.
+"""
+
+
+def segment_tokens(tokens: List[str], max_length: int) -> List[List[str]]:
+    """
+    Splits a token sequence into pieces of at most max_length tokens. Each piece ends after the last segment
+    boundary token (see C.SEGMENT_BOUNDARY_TOKENS) that fits, or after max_length tokens if there is none.
+
+    :param tokens: Input tokens.
+    :param max_length: Maximum number of tokens per piece.
+    :return: Pieces, which concatenate to tokens. A sequence of at most max_length tokens is a single piece.
+    """
+    pieces = []
+    start = 0
+    while len(tokens) - start > max_length:
+        end = start + max_length
+        for i in range(end - 1, start, -1):
+            if tokens[i] in C.SEGMENT_BOUNDARY_TOKENS:
+                end = i + 1
+                break
+        pieces.append(tokens[start:end])
+        start = end
+    pieces.append(tokens[start:])
+    return pieces
+
 
 class ModelState:
     """
     A ModelState encapsulates information about the decoder state of an InferenceModel.
+
+    :param bucket_key: Bucket key of the decoder module.
+    :param prev_target_word_id: Previously predicted word ids.
+    :param decoder_states: Decoder states.
+    :param static_states: For each decoder state, whether it is static, i.e. identical for all hypotheses of a
+           sentence and never changed by the decoder. Static states are not reordered. Default: no static states.
     """
 
     def __init__(self,
                  bucket_key: int,
                  prev_target_word_id: mx.nd.NDArray,
-                 decoder_states: List[mx.nd.NDArray]):
+                 decoder_states: List[mx.nd.NDArray],
+                 static_states: Optional[List[bool]] = None):
         self.bucket_key = bucket_key
         self.prev_target_word_id = prev_target_word_id
         self.decoder_states = decoder_states
+        self.static_states = [False] * len(decoder_states) if static_states is None else static_states
 
     def sort_state(self, best_hyp_indices: mx.nd.NDArray, best_word_indices: mx.nd.NDArray):
         """
         Sorts states according to k-best order from last step in beam search.
+        Static states are left as they are.
         """
         self.prev_target_word_id = best_word_indices
-        self.decoder_states = [mx.nd.take(ds, best_hyp_indices) for ds in self.decoder_states]
+        self.decoder_states = [ds if is_static else mx.nd.take(ds, best_hyp_indices)
+                               for ds, is_static in zip(self.decoder_states, self.static_states)]
+
+    def compact_state(self, rows: mx.nd.NDArray, word_ids: mx.nd.NDArray):
+        """
+        Keeps the given rows of all states, including static states. The number of rows may change.
+        """
+        self.prev_target_word_id = word_ids
+        self.decoder_states = [mx.nd.take(ds, rows) for ds in self.decoder_states]
 
 
 class LengthPenalty:
@@ -347,6 +920,17 @@ class LengthPenalty:
             numerator = numerator**self.alpha if self.alpha != 1.0 else numerator
             return numerator / self.denominator
 
+    def get_table(self, max_length: int, ctx: mx.context.Context) -> mx.nd.NDArray:
+        """
+        Returns the length penalties of all lengths from 0 to max_length, such that the penalty for a
+        matrix of lengths can be looked up with mx.nd.take.
+
+        :param max_length: Maximum length.
+        :param ctx: Context to create the table on.
+        :return: The length penalty table (max_length + 1,).
+        """
+        return self(mx.nd.array(np.arange(max_length + 1), ctx=ctx))
+
 
 class Translator:
     """
@@ -359,6 +943,16 @@ class Translator:
     :param models: List of models.
     :param vocab_source: Source vocabulary.
     :param vocab_target: Target vocabulary.
+    :param restrict_lexicon: Top-k lexicon to use for target vocabulary restriction.
+    :param device_topk: Select the beam search hypotheses with NDArray operations on the context, synchronizing
+           with the host only every C.BEAM_SEARCH_FINISHED_CHECK_INTERVAL steps. Otherwise, scores are copied to
+           the host at every step and the k-best hypotheses are selected with NumPy. Default: True for GPU contexts.
+    :param shrink_beam: Move finished hypotheses out of the beam and decode only the remaining active ones.
+           The beam of a sentence shrinks by one for every finished hypothesis. Default: False.
+    :param segment_long_inputs: Split inputs longer than the largest bucket into pieces (see segment_tokens) that
+           are translated together and joined, instead of truncating them. Default: False.
+    :param collect_timings: Record per-phase timings of each sentence (see TranslatorTimings) in last_timings.
+           Phases are separated by waiting for all pending operations, which costs some speed. Default: False.
     """
 
     def __init__(self,
@@ -367,7 +961,12 @@ class Translator:
                  length_penalty: LengthPenalty,
                  models: List[InferenceModel],
                  vocab_source: Dict[str, int],
-                 vocab_target: Dict[str, int]):
+                 vocab_target: Dict[str, int],
+                 restrict_lexicon: Optional[lexicon.TopKLexicon] = None,
+                 device_topk: Optional[bool] = None,
+                 shrink_beam: bool = False,
+                 segment_long_inputs: bool = False,
+                 collect_timings: bool = False):
         self.context = context
         self.length_penalty = length_penalty
         self.vocab_source = vocab_source
@@ -376,12 +975,44 @@ class Translator:
         self.start_id = self.vocab_target[C.BOS_SYMBOL]
         self.stop_ids = {self.vocab_target[C.EOS_SYMBOL], C.PAD_ID}
         self.models = models
+        self.restrict_lexicon = restrict_lexicon
+        utils.check_condition(restrict_lexicon is None or all(m.decoder_return_logit_inputs for m in self.models),
+                              "Vocabulary restriction requires models loaded with decoder_return_logit_inputs")
         self.interpolation_func = self._get_interpolation_func(ensemble_mode)
+        # attention scores are only collected if all models return them
+        self.collect_attention = all(m.decoder_return_attention for m in self.models)
         self.beam_size = self.models[0].beam_size
+        self.batch_size = self.models[0].batch_size
+        utils.check_condition(all(m.batch_size == self.batch_size for m in self.models),
+                              "Models must agree on batch size")
         self.buckets = data_io.define_buckets(self.models[0].config.max_seq_len_source)
-        self.pad_dist = mx.nd.full((self.beam_size, len(self.vocab_target)), val=np.inf, ctx=self.context)
-        logger.info("Translator (%d model(s) beam_size=%d ensemble_mode=%s)",
-                    len(self.models), self.beam_size, "None" if len(self.models) == 1 else ensemble_mode)
+        # the smallest factor does not exceed the target length any of the models' decoders were bound to
+        self.max_output_length_factor = min(m.max_output_length_factor for m in self.models)
+        self.pad_dist = mx.nd.full((self.batch_size * self.beam_size, len(self.vocab_target)),
+                                   val=np.inf, ctx=self.context)
+        # max_output_length -> (length penalties, inverse length penalties of length + 1)
+        self.length_penalty_tables = dict()  # type: Dict[int, Tuple[mx.nd.NDArray, mx.nd.NDArray]]
+        # mx.nd.topk sorts on CPUs in MXNet 0.10 and is much slower than NumPy's argpartition
+        self.device_topk = context.device_type == 'gpu' if device_topk is None else device_topk
+        self.shrink_beam = shrink_beam
+        self.segment_long_inputs = segment_long_inputs
+        self.collect_timings = collect_timings
+        # timings of the outputs of the last translate_batch call, None for outputs that were not decoded
+        self.last_timings = []  # type: List[Optional[TranslatorTimings]]
+        self._phase_times = defaultdict(float)  # type: Dict[str, float]
+        self._num_decode_steps = 0
+        # offset of the first row of each sentence's beam: (batch_size * beam_size,)
+        self.beam_offsets = mx.nd.array(np.repeat(np.arange(0, self.batch_size * self.beam_size, self.beam_size),
+                                                  self.beam_size), ctx=self.context)
+        # 1 for the first row of each sentence's beam: (batch_size * beam_size,)
+        self.first_hyp_mask = mx.nd.array(np.arange(self.batch_size * self.beam_size) % self.beam_size == 0,
+                                          ctx=self.context)
+        logger.info("Translator (%d model(s) beam_size=%d batch_size=%d ensemble_mode=%s restrict_lexicon=%s "
+                    "device_topk=%s shrink_beam=%s segment_long_inputs=%s)",
+                    len(self.models), self.beam_size, self.batch_size,
+                    "None" if len(self.models) == 1 else ensemble_mode,
+                    "None" if restrict_lexicon is None else "Yes",
+                    self.device_topk, self.shrink_beam, self.segment_long_inputs)
 
     @staticmethod
     def _get_interpolation_func(ensemble_mode):
@@ -423,34 +1054,194 @@ class Translator:
         :param trans_input: TranslatorInput as returned by make_input().
         :return: translation result.
         """
-        if not trans_input.tokens:
-            return TranslatorOutput(id=trans_input.id,
-                                    translation="",
-                                    tokens=[""],
-                                    attention_matrix=np.asarray([[0]]),
-                                    score=-np.inf)
+        return self.translate_batch([trans_input])[0]
+
+    def translate_batch(self, trans_inputs: List[TranslatorInput]) -> List[TranslatorOutput]:
+        """
+        Translates a list of TranslatorInputs and returns TranslatorOutputs in the same order.
+        Non-empty inputs are encoded and decoded together in batches of at most batch_size sentences.
+        With segment_long_inputs, the pieces of inputs longer than the largest bucket are batched with the other
+        inputs and their translations are joined.
+
+        :param trans_inputs: List of TranslatorInputs as returned by make_input().
+        :return: List of translation results.
+        """
+        if not self.segment_long_inputs:
+            return self._translate_batch(trans_inputs)
+        pieces = []  # type: List[TranslatorInput]
+        num_pieces = []  # type: List[int]
+        for trans_input in trans_inputs:
+            segments = segment_tokens(trans_input.tokens, self.buckets[-1])
+            num_pieces.append(len(segments))
+            pieces.extend(TranslatorInput(id=trans_input.id, sentence=C.TOKEN_SEPARATOR.join(segment), tokens=segment)
+                          for segment in segments)
+        piece_outputs = self._translate_batch(pieces)
+        piece_timings = self.last_timings
+        trans_outputs, self.last_timings = [], []
+        start = 0
+        for trans_input, num in zip(trans_inputs, num_pieces):
+            trans_outputs.append(self._join_outputs(trans_input, piece_outputs[start:start + num]))
+            timings = [t for t in piece_timings[start:start + num] if t is not None]
+            self.last_timings.append(TranslatorTimings(*map(sum, zip(*timings))) if timings else None)
+            start += num
+        return trans_outputs
+
+    def _join_outputs(self, trans_input: TranslatorInput, piece_outputs: List[TranslatorOutput]) -> TranslatorOutput:
+        """
+        Joins the translations of the pieces of an input. Stop symbols (and their attention rows) are removed from
+        all pieces but the last. The attention matrix of each piece is shifted by the offsets of its first target and
+        source tokens. The score is the mean of the piece scores weighted by their number of kept target tokens.
+
+        :param trans_input: Input that was split into pieces.
+        :param piece_outputs: Translations of the pieces, in order.
+        :return: Translation of the input.
+        """
+        if len(piece_outputs) == 1:
+            return piece_outputs[0]
+        stop_tokens = {self.vocab_target_inv[stop_id] for stop_id in self.stop_ids}
+        # indices of the kept target tokens of each piece
+        kept = [[i for i, token in enumerate(piece_output.tokens)
+                 if piece_index == len(piece_outputs) - 1 or token not in stop_tokens]
+                for piece_index, piece_output in enumerate(piece_outputs)]
+        tokens = [piece_output.tokens[i] for piece_output, indices in zip(piece_outputs, kept) for i in indices]
+        with_attention = all(piece_output.attention_matrix.shape[1] > 0 for piece_output in piece_outputs)
+        attention_matrix = np.zeros((len(tokens), len(trans_input.tokens) if with_attention else 0))
+        target_offset, source_offset = 0, 0
+        for piece_output, indices in zip(piece_outputs, kept):
+            num_source = piece_output.attention_matrix.shape[1]
+            if with_attention:
+                attention_matrix[target_offset:target_offset + len(indices),
+                                 source_offset:source_offset + num_source] = piece_output.attention_matrix[indices]
+            target_offset += len(indices)
+            source_offset += num_source
+        score = sum(piece_output.score * len(indices) for piece_output, indices in zip(piece_outputs, kept)) / \
+            max(1, len(tokens))
+        return TranslatorOutput(id=trans_input.id,
+                                translation=C.TOKEN_SEPARATOR.join(piece_output.translation
+                                                                   for piece_output in piece_outputs
+                                                                   if piece_output.translation),
+                                tokens=tokens,
+                                attention_matrix=attention_matrix,
+                                score=score)
+
+    def _translate_batch(self, trans_inputs: List[TranslatorInput]) -> List[TranslatorOutput]:
+        """
+        Translates a list of TranslatorInputs in batches of at most batch_size sentences, truncating inputs longer
+        than the largest bucket.
 
-        return self._make_result(trans_input, *self.translate_nd(*self._get_inference_input(trans_input.tokens)))
+        :param trans_inputs: List of TranslatorInputs.
+        :return: List of translation results.
+        """
+        trans_outputs = [None] * len(trans_inputs)  # type: List[Optional[TranslatorOutput]]
+        input_indices = []  # type: List[int]
+        for i, trans_input in enumerate(trans_inputs):
+            if trans_input.tokens:
+                input_indices.append(i)
+            else:
+                trans_outputs[i] = TranslatorOutput(id=trans_input.id,
+                                                    translation="",
+                                                    tokens=[""],
+                                                    attention_matrix=np.asarray([[0]]),
+                                                    score=-np.inf)
+
+        self.last_timings = [None] * len(trans_inputs)
+        for batch_start in range(0, len(input_indices), self.batch_size):
+            batch_indices = input_indices[batch_start:batch_start + self.batch_size]
+            batch_inputs = [trans_inputs[i] for i in batch_indices]
+            self._phase_times.clear()
+            self._num_decode_steps = 0
+            with self._time_phase("prepare"):
+                source, bucket_key = self._get_inference_input([trans_input.tokens for trans_input in batch_inputs])
+            with self._time_phase("search"):
+                results = self.translate_nd(source, bucket_key)
+            with self._time_phase("result_assembly"):
+                # results for rows filling up the batch are discarded by zip()
+                for i, trans_input, result in zip(batch_indices, batch_inputs, results):
+                    trans_outputs[i] = self._make_result(trans_input, *result)
+            if self.collect_timings:
+                timings = self._get_timings(len(batch_indices))
+                for i in batch_indices:
+                    self.last_timings[i] = timings
+        return trans_outputs
+
+    @contextmanager
+    def _time_phase(self, phase: str) -> Iterator[None]:
+        """
+        Adds the time taken by the enclosed code, including its pending operations, to a phase if timings are
+        collected.
 
-    def _get_inference_input(self, tokens: List[str]) -> Tuple[mx.nd.NDArray, int]:
+        :param phase: Name of the phase, a TranslatorTimings field.
         """
-        Returns NDArray of source ids (shape=(1, bucket_key)) and corresponding bucket_key.
+        if not self.collect_timings:
+            yield
+            return
+        tic = time.time()
+        yield
+        mx.nd.waitall()
+        self._phase_times[phase] += time.time() - tic
+
+    def _get_timings(self, num_sentences: int) -> TranslatorTimings:
+        """
+        Returns the per-sentence timings of the current batch. The search phase encloses encoding and decoder
+        forward passes, whose times are subtracted from it.
 
-        :param tokens: List of input tokens.
+        :param num_sentences: Number of sentences in the batch.
+        :return: Timings.
+        """
+        phase_times = {phase: seconds / num_sentences for phase, seconds in self._phase_times.items()}
+        return TranslatorTimings(prepare=phase_times.get("prepare", 0.0),
+                                 encode=phase_times.get("encode", 0.0),
+                                 decode_steps=self._num_decode_steps,
+                                 decoder_forward=phase_times.get("decoder_forward", 0.0),
+                                 search=max(0.0, phase_times.get("search", 0.0) - phase_times.get("encode", 0.0)
+                                            - phase_times.get("decoder_forward", 0.0)),
+                                 result_assembly=phase_times.get("result_assembly", 0.0))
+
+    def warm_up(self, bucket_keys: Optional[List[int]] = None):
+        """
+        Binds the encoder and decoder executors of the given source buckets and runs a forward pass with dummy
+        input through them, such that the first translations of these buckets do not wait for binding and
+        memory allocation. Decoder executors are bound for the full beam of all sentences of a batch.
+
+        :param bucket_keys: Source lengths, mapped to their buckets. Default: all buckets.
+        """
+        if not bucket_keys:
+            bucket_keys = self.buckets
+        bucket_keys = sorted({data_io.get_bucket(min(key, self.buckets[-1]), self.buckets) for key in bucket_keys})
+        start = time.time()
+        for bucket_key in bucket_keys:
+            source = mx.nd.full((self.batch_size, bucket_key), val=self.vocab_source[C.UNK_SYMBOL])
+            model_states = self._encode(source, bucket_key)
+            self._run_decoders(model_states)
+        mx.nd.waitall()
+        logger.info("Warmed up buckets %s in %.2fs", bucket_keys, time.time() - start)
+
+    def _get_inference_input(self, tokens_batch: List[List[str]]) -> Tuple[mx.nd.NDArray, int]:
+        """
+        Returns NDArray of source ids (shape=(batch_size, bucket_key)) and corresponding bucket_key.
+        The bucket key is determined by the longest input. If fewer than batch_size inputs are given,
+        the remaining rows are filled up with copies of the last input.
+
+        :param tokens_batch: List of at most batch_size lists of input tokens.
         :return NDArray of source ids and bucket key.
         """
-        bucket_key = data_io.get_bucket(len(tokens), self.buckets)
+        utils.check_condition(0 < len(tokens_batch) <= self.batch_size,
+                              "Number of inputs must be between 1 and the batch size (%d)" % self.batch_size)
+        bucket_key = data_io.get_bucket(max(len(tokens) for tokens in tokens_batch), self.buckets)
         if bucket_key is None:
-            logger.warning("Input (%d) exceeds max bucket size (%d). Stripping", len(tokens), self.buckets[-1])
             bucket_key = self.buckets[-1]
-            tokens = tokens[:bucket_key]
+            for tokens in tokens_batch:
+                if len(tokens) > bucket_key:
+                    logger.warning("Input (%d) exceeds max bucket size (%d). Stripping", len(tokens), bucket_key)
 
         utils.check_condition(C.PAD_ID == 0, "pad id should be 0")
-        source = mx.nd.zeros((1, bucket_key))
-        ids = data_io.tokens2ids(tokens, self.vocab_source)
-        for i, wid in enumerate(ids):
-            source[0, i] = wid
-        return source, bucket_key
+        # ids are filled in on the host and copied to the context at once
+        source = np.zeros((self.batch_size, bucket_key), dtype='float32')
+        for j, tokens in enumerate(tokens_batch):
+            ids = data_io.tokens2ids(tokens[:bucket_key], self.vocab_source)
+            source[j, :len(ids)] = ids
+        source[len(tokens_batch):] = source[len(tokens_batch) - 1]
+        return mx.nd.array(source, ctx=self.context), bucket_key
 
     def _make_result(self,
                      trans_input: TranslatorInput,
@@ -480,64 +1271,110 @@ class Translator:
 
     def translate_nd(self,
                      source: mx.nd.NDArray,
-                     bucket_key: int) -> Tuple[np.ndarray, np.ndarray, float]:
+                     bucket_key: int) -> List[Tuple[List[int], np.ndarray, float]]:
         """
         Translates source of source_length, given a bucket_key.
 
-        :param source: Source ids. Shape: (1, bucket_key).
+        :param source: Source ids. Shape: (batch_size, bucket_key).
         :param bucket_key: Bucket key.
 
-        :return: Sequence of translated ids, attention matrix, length-normalized negative log probability.
+        :return: For each row of source: sequence of translated ids, attention matrix,
+                 length-normalized negative log probability.
+        """
+        max_output_lengths = self._get_max_output_lengths(source)
+        if self.beam_size == 1:
+            return self._greedy_search(source, bucket_key, max_output_lengths)
+        if self.shrink_beam:
+            return self._beam_search_shrinking(source, bucket_key, max_output_lengths)
+        return self._get_best_from_beam(*self._beam_search(source, bucket_key, max_output_lengths))
+
+    def _get_max_output_lengths(self, source: mx.nd.NDArray) -> np.ndarray:
         """
-        # allow output sentence to be at most 2 times the current bucket_key
-        # TODO: max_output_length adaptive to source_length
-        max_output_length = bucket_key * C.TARGET_MAX_LENGTH_FACTOR
+        Returns the maximum output length of each sentence, derived from its real (unpadded) length and the
+        target/source length ratio statistics of the training data.
 
-        return self._get_best_from_beam(*self._beam_search(source, bucket_key, max_output_length))
+        :param source: Source ids. Shape: (batch_size, bucket_key).
+        :return: Maximum output lengths. Shape: (batch_size,).
+        """
+        source_lengths = (source.asnumpy() != C.PAD_ID).sum(axis=1)
+        return np.maximum(1, np.ceil(source_lengths * self.max_output_length_factor)).astype('int32')
 
     def _encode(self, source: mx.nd.NDArray, bucket_key: int) -> List[ModelState]:
         """
         Returns a ModelState for each model representing the state of the model after encoding the source.
 
-        :param source: Source ids. Shape: (1, bucket_key).
+        :param source: Source ids. Shape: (batch_size, bucket_key).
         :param bucket_key: Bucket key.
         :return: List of ModelStates.
         """
-        prev_target_word_id = mx.nd.full((self.beam_size,), val=self.start_id, ctx=self.context)
-        model_states = [ModelState(bucket_key=m.encoder.get_encoded_seq_len(bucket_key),
-                                   prev_target_word_id=prev_target_word_id,
-                                   decoder_states=m.run_encoder(source, bucket_key))
-                        for m in self.models]
+        with self._time_phase("encode"):
+            prev_target_word_id = mx.nd.full((self.batch_size * self.beam_size,), val=self.start_id,
+                                             ctx=self.context)
+            model_states = [ModelState(bucket_key=m.get_encoded_seq_len(bucket_key),
+                                       prev_target_word_id=prev_target_word_id,
+                                       decoder_states=m.run_encoder(source, bucket_key),
+                                       static_states=m.static_states())
+                            for m in self.models]
         return model_states
 
-    def _decode_step(self, states: List[ModelState]) -> Tuple[mx.nd.NDArray, mx.nd.NDArray, List[ModelState]]:
+    def _decode_step(self,
+                     states: List[ModelState],
+                     models_output_layer_params: Optional[List[Tuple[mx.nd.NDArray, mx.nd.NDArray]]] = None) \
+            -> Tuple[mx.nd.NDArray, mx.nd.NDArray, List[ModelState]]:
         """
         Returns decoder predictions (combined from all models), attention scores, and updated states.
 
-        :param: List of model states.
+        :param states: List of model states.
+        :param models_output_layer_params: Optional output layer weight and bias for each model,
+               restricted to a subset of the target vocabulary.
         :return: (probs, attention scores, list of model states)
         """
-        model_probs, model_attention_probs, model_states = [], [], []
-        for model, state in zip(self.models, states):
-            probs, attention_probs, state = model.run_decoder(state)
-            model_probs.append(probs)
-            model_attention_probs.append(attention_probs)
-            model_states.append(state)
+        model_probs, model_attention_probs, model_states = self._run_decoders(states, models_output_layer_params)
         probs, attention_probs = self._combine_predictions(model_probs, model_attention_probs)
         return probs, attention_probs, model_states
 
+    def _run_decoders(self,
+                      states: List[ModelState],
+                      models_output_layer_params: Optional[List[Tuple[mx.nd.NDArray, mx.nd.NDArray]]] = None) \
+            -> Tuple[List[mx.nd.NDArray], List[Optional[mx.nd.NDArray]], List[ModelState]]:
+        """
+        Runs a decoder step of each model and returns their distributions over the next word, attention scores and
+        updated states.
+
+        :param states: List of model states.
+        :param models_output_layer_params: Optional output layer weight and bias for each model,
+               restricted to a subset of the target vocabulary.
+        :return: (probs of each model, attention scores of each model, list of model states)
+        """
+        self._num_decode_steps += 1
+        model_probs, model_attention_probs, model_states = [], [], []
+        with self._time_phase("decoder_forward"):
+            for i, (model, state) in enumerate(zip(self.models, states)):
+                probs, attention_probs, state = model.run_decoder(state)
+                if models_output_layer_params is not None:
+                    # decoder returned inputs to the output layer: compute logits for the restricted vocabulary
+                    weight, bias = models_output_layer_params[i]
+                    logits = model.decoder.output_layer(probs, weight, bias)
+                    if model.softmax_temperature is not None:
+                        logits /= model.softmax_temperature
+                    probs = mx.nd.softmax(logits)
+                model_probs.append(probs)
+                model_attention_probs.append(attention_probs)
+                model_states.append(state)
+        return model_probs, model_attention_probs, model_states
+
     def _combine_predictions(self,
                              probs: List[mx.nd.NDArray],
                              attention_probs: List[mx.nd.NDArray]) -> Tuple[mx.nd.NDArray, mx.nd.NDArray]:
         """
         Returns combined predictions of models as negative log probabilities and averaged attention prob scores.
 
-        :param probs: List of Shape(beam_size, target_vocab_size).
-        :param attention_probs: List of Shape(beam_size, bucket_key).
-        :return: Combined probabilities, averaged attention scores.
+        :param probs: List of Shape(batch_size * beam_size, target_vocab_size). The vocabulary may be restricted.
+        :param attention_probs: List of Shape(batch_size * beam_size, bucket_key).
+        :return: Combined probabilities, averaged attention scores (None unless collect_attention).
         """
         # average attention prob scores. TODO: is there a smarter way to do this?
-        attention_prob_score = utils.average_arrays(attention_probs)
+        attention_prob_score = utils.average_arrays(attention_probs) if self.collect_attention else None
 
         # combine model predictions and convert to neg log probs
         if len(self.models) == 1:
@@ -546,41 +1383,102 @@ class Translator:
             neg_logprobs = self.interpolation_func(probs)
         return neg_logprobs, attention_prob_score
 
+    def _get_length_penalty_tables(self, max_output_length: int) -> Tuple[mx.nd.NDArray, mx.nd.NDArray]:
+        """
+        Returns lookup tables of the length penalties of lengths [0, max_output_length] and of the inverse
+        length penalties of these lengths + 1. Caches results for max_output_length if called iteratively.
+
+        :param max_output_length: Maximum output length.
+        :return: Length penalties (max_output_length + 1,), inverse length penalties of length + 1
+                 (max_output_length + 1,).
+        """
+        if max_output_length not in self.length_penalty_tables:
+            table = self.length_penalty.get_table(max_output_length + 1, self.context)
+            self.length_penalty_tables[max_output_length] = (table[:max_output_length + 1],
+                                                             1.0 / table[1:max_output_length + 2])
+        return self.length_penalty_tables[max_output_length]
+
+    def _get_vocab_slice(self, source: mx.nd.NDArray) \
+            -> Tuple[Optional[np.ndarray], Optional[mx.nd.NDArray],
+                     Optional[List[Tuple[mx.nd.NDArray, mx.nd.NDArray]]]]:
+        """
+        If using a top-k lexicon, selects the subset of the target vocabulary relevant to the source batch,
+        i.e. the output layer is computed only for these target ids and chosen ids are mapped back to the full
+        vocabulary.
+
+        :param source: Source ids. Shape: (batch_size, bucket_key).
+        :return: Target ids of the restricted vocabulary (as NumPy array and NDArray) and output layer weight and
+                 bias for each model, restricted to these ids. All None without a top-k lexicon.
+        """
+        if self.restrict_lexicon is None:
+            return None, None, None
+        vocab_slice_ids = self.restrict_lexicon.get_trg_ids(source.asnumpy())
+        if len(vocab_slice_ids) <= self.beam_size:
+            # the beam size must be smaller than the vocabulary: add the next most frequent target words
+            missing_ids = np.setdiff1d(np.arange(len(self.vocab_target)), vocab_slice_ids)
+            vocab_slice_ids = np.union1d(vocab_slice_ids, missing_ids[:self.beam_size + 1 - len(vocab_slice_ids)])
+        vocab_slice_ids_nd = mx.nd.array(vocab_slice_ids, ctx=self.context)
+        models_output_layer_params = [(mx.nd.take(m.output_layer_w, vocab_slice_ids_nd),
+                                       mx.nd.take(m.output_layer_b, vocab_slice_ids_nd)) for m in self.models]
+        return vocab_slice_ids, vocab_slice_ids_nd, models_output_layer_params
+
     def _beam_search(self,
                      source: mx.nd.NDArray,
                      bucket_key: int,
-                     max_output_length: int) -> Tuple[mx.nd.NDArray, mx.nd.NDArray, mx.nd.NDArray, mx.nd.NDArray]:
+                     max_output_lengths: np.ndarray) -> Tuple[List[mx.nd.NDArray], List[mx.nd.NDArray],
+                                                      List[mx.nd.NDArray], mx.nd.NDArray, mx.nd.NDArray]:
         """
-        Translates a single sentence using beam search.
-
-        :param source: Source ids. Shape: (1, bucket_key).
+        Translates a batch of sentences using beam search.
+        Rows [i * beam_size, (i + 1) * beam_size) of the returned arrays hold the beam of sentence i,
+        sorted by ascending score.
+        Hypotheses are not reordered at every step. Instead, the winning rows of the previous step
+        (back-pointers), the chosen words, and the attention scores of each step are stored, such that
+        hypotheses can be reconstructed after search by following the back-pointers.
+
+        :param source: Source ids. Shape: (batch_size, bucket_key).
         :param bucket_key: Bucket key.
-        :param max_output_length: Cap the output at this maximum length.
-        :return List of lists of word ids, list of attentions, array of accumulated length-normalized
-                negative log-probs.
+        :param max_output_lengths: Cap the output of each sentence at this maximum length. Shape: (batch_size,).
+        :return For each step: back-pointers, word ids, attention scores (in the order of the previous step, empty
+                unless collect_attention); array of accumulated length-normalized negative log-probs, lengths of
+                hypotheses.
         """
         # Length of encoded sequence (may differ from initial input length)
-        encoded_source_length = self.models[0].encoder.get_encoded_seq_len(bucket_key)
+        encoded_source_length = self.models[0].get_encoded_seq_len(bucket_key)
         utils.check_condition(all(encoded_source_length ==
-                                  model.encoder.get_encoded_seq_len(bucket_key) for model in self.models),
+                                  model.get_encoded_seq_len(bucket_key) for model in self.models),
                               "Models must agree on encoded sequence length")
-
-        lengths = mx.nd.zeros((self.beam_size, 1), ctx=self.context)
-        finished = mx.nd.zeros((self.beam_size,), dtype='int32', ctx=self.context)
-        # sequences: (beam_size, output_length)
-        sequences = mx.nd.array(np.full((self.beam_size, max_output_length), C.PAD_ID), dtype='int32', ctx=self.context)
-        # attentions: (beam_size, output_length, encoded_source_length)
-        attentions = mx.nd.zeros((self.beam_size, max_output_length, encoded_source_length), ctx=self.context)
+        num_rows = self.batch_size * self.beam_size
+
+        lengths = mx.nd.zeros((num_rows, 1), ctx=self.context)
+        finished = mx.nd.zeros((num_rows,), dtype='int32', ctx=self.context)
+        max_output_length = int(max_output_lengths.max())
+        length_penalties, inv_next_length_penalties = self._get_length_penalty_tables(max_output_length)
+        # hypotheses of a sentence are finished once they reach its maximum output length
+        max_output_lengths_np = np.repeat(max_output_lengths, self.beam_size)
+        max_output_lengths_nd = mx.nd.array(max_output_lengths_np, ctx=self.context, dtype='int32')
+        # for each step: back-pointers (batch_size * beam_size,), word ids (batch_size * beam_size,),
+        # and attention scores (batch_size * beam_size, encoded_source_length)
+        best_hyp_indices_list = []  # type: List[mx.nd.NDArray]
+        best_word_indices_list = []  # type: List[mx.nd.NDArray]
+        attention_scores_list = []  # type: List[mx.nd.NDArray]
 
         # best_hyp_indices: row indices of smallest scores (ascending).
-        best_hyp_indices = mx.nd.zeros((self.beam_size,), ctx=self.context)
+        best_hyp_indices = mx.nd.zeros((num_rows,), ctx=self.context)
+        best_hyp_indices_np = np.zeros((num_rows,), dtype='int32')
         # best_word_indices: column indices of smallest scores (ascending).
-        best_word_indices = mx.nd.zeros((self.beam_size,), ctx=self.context, dtype='int32')
+        best_word_indices = mx.nd.zeros((num_rows,), ctx=self.context, dtype='int32')
+        best_word_indices_np = np.zeros((num_rows,), dtype='int32')
         # scores_accumulated: chosen smallest scores in scores (ascending).
-        scores_accumulated = mx.nd.zeros((self.beam_size, 1), ctx=self.context)
+        scores_accumulated = mx.nd.zeros((num_rows, 1), ctx=self.context)
+        scores_accumulated_np = np.zeros((num_rows,), dtype='float32')
 
-        # reset all padding distribution cells to np.inf
-        self.pad_dist[:] = np.inf
+        vocab_slice_ids, vocab_slice_ids_nd, models_output_layer_params = self._get_vocab_slice(source)
+        if vocab_slice_ids is not None:
+            pad_dist = mx.nd.full((num_rows, len(vocab_slice_ids)), val=np.inf, ctx=self.context)
+        else:
+            # reset all padding distribution cells to np.inf
+            pad_dist = self.pad_dist
+            pad_dist[:] = np.inf
 
         # (0) encode source sentence
         model_states = self._encode(source, bucket_key)
@@ -588,72 +1486,335 @@ class Translator:
         for t in range(0, max_output_length):
 
             # (1) obtain next predictions and advance models' state
-            # scores: (beam_size, target_vocab_size)
-            # attention_scores: (beam_size, bucket_key)
-            scores, attention_scores, model_states = self._decode_step(model_states)
+            # scores: (batch_size * beam_size, target_vocab_size)
+            # attention_scores: (batch_size * beam_size, bucket_key)
+            scores, attention_scores, model_states = self._decode_step(model_states, models_output_layer_params)
 
             # (2) compute length-normalized accumulated scores in place
-            if t == 0:  # only one hypothesis at t==0
-                scores = scores[:1] / self.length_penalty(lengths[:1] + 1)
+            # length penalties are looked up rather than computed at every step
+            if t == 0:  # only one hypothesis per sentence at t==0
+                scores = scores * mx.nd.take(inv_next_length_penalties, lengths)
             else:
                 # renormalize scores by length+1 ...
-                scores = (scores + scores_accumulated * self.length_penalty(lengths)) / self.length_penalty(lengths + 1)
+                scores = (scores + scores_accumulated * mx.nd.take(length_penalties, lengths)) * \
+                         mx.nd.take(inv_next_length_penalties, lengths)
                 # ... but not for finished hyps.
                 # their predicted distribution is set to their accumulated scores at C.PAD_ID.
-                self.pad_dist[:, C.PAD_ID] = scores_accumulated
+                pad_dist[:, C.PAD_ID] = scores_accumulated
                 # this is equivalent to doing this in numpy:
-                #   self.pad_dist[finished, :] = np.inf
-                #   self.pad_dist[finished, C.PAD_ID] = scores_accumulated[finished]
-                scores = mx.nd.where(finished, self.pad_dist, scores)
-
-            # (3) get beam_size winning hypotheses
-            # TODO(fhieber): once mx.nd.topk is sped-up no numpy conversion necessary anymore.
-            (best_hyp_indices[:], best_word_indices_np), scores_accumulated_np = utils.smallest_k(scores.asnumpy(),
-                                                                                                  self.beam_size)
-            scores_accumulated[:] = np.expand_dims(scores_accumulated_np, axis=1)
-            best_word_indices[:] = best_word_indices_np
-
-            # (4) get hypotheses and their properties for beam_size winning hypotheses (ascending)
-            sequences = mx.nd.take(sequences, best_hyp_indices)
+                #   pad_dist[finished, :] = np.inf
+                #   pad_dist[finished, C.PAD_ID] = scores_accumulated[finished]
+                scores = mx.nd.where(finished, pad_dist, scores)
+
+            # (3) get beam_size winning hypotheses for each sentence
+            if self.device_topk:
+                best_hyp_indices, best_word_indices, scores_accumulated = self._topk_device(scores, pad_dist, t)
+                if vocab_slice_ids is not None:
+                    # map word indices of the restricted vocabulary back to the full target vocabulary
+                    best_word_indices = mx.nd.take(vocab_slice_ids_nd, best_word_indices)
+                best_word_indices = mx.nd.cast(best_word_indices, dtype='int32')
+            else:
+                scores_np = scores.asnumpy()
+                for sentence in range(self.batch_size):
+                    rows = slice(sentence * self.beam_size, (sentence + 1) * self.beam_size)
+                    (best_hyp_indices_np[rows], best_word_indices_np[rows]), scores_accumulated_np[rows] = \
+                        utils.smallest_k(scores_np[rows], self.beam_size, only_first_row=t == 0)
+                    # smallest_k returns row indices relative to the sentence's beam
+                    best_hyp_indices_np[rows] += rows.start
+                if vocab_slice_ids is not None:
+                    # map word indices of the restricted vocabulary back to the full target vocabulary
+                    best_word_indices_np[:] = vocab_slice_ids[best_word_indices_np]
+                best_hyp_indices[:] = best_hyp_indices_np
+                best_word_indices[:] = best_word_indices_np
+                scores_accumulated[:] = np.expand_dims(scores_accumulated_np, axis=1)
+
+            # (4) get properties of the beam_size winning hypotheses (ascending)
             lengths = mx.nd.take(lengths, best_hyp_indices)
             finished = mx.nd.take(finished, best_hyp_indices)
-            attention_scores = mx.nd.take(attention_scores, best_hyp_indices)
-            attentions = mx.nd.take(attentions, best_hyp_indices)
 
-            # (5) update best hypotheses, their attention lists and lengths (only for non-finished hyps)
-            sequences[:, t] = mx.nd.expand_dims(best_word_indices, axis=1)
-            attentions[:, t, :] = mx.nd.expand_dims(attention_scores, axis=1)
+            # (5) store back-pointers, words, and attention scores, update lengths (only for non-finished hyps)
+            # the host path overwrites best_hyp_indices & best_word_indices in place at every step
+            best_hyp_indices_list.append(best_hyp_indices if self.device_topk else best_hyp_indices.copy())
+            best_word_indices_list.append(best_word_indices if self.device_topk else best_word_indices.copy())
+            if self.collect_attention:
+                # the attention scores of a single model are a decoder output, overwritten by the next forward pass
+                attention_scores_list.append(attention_scores.copy())
             lengths += mx.nd.cast(1 - mx.nd.expand_dims(finished, axis=1), dtype='float32')
 
             # (6) determine which hypotheses in the beam are now finished
-            finished = ((best_word_indices == C.PAD_ID) + (best_word_indices == self.vocab_target[C.EOS_SYMBOL]))
-            if mx.nd.sum(finished).asscalar() == self.beam_size:  # all finished
+            finished = ((best_word_indices == C.PAD_ID) +
+                        (best_word_indices == self.vocab_target[C.EOS_SYMBOL]) +
+                        (max_output_lengths_nd <= t + 1)) > 0
+            if self.device_topk:
+                # checking for termination blocks until all previous steps are computed, thus only check
+                # every few steps. Additional steps on finished hypotheses do not change their scores.
+                if (t + 1) % C.BEAM_SEARCH_FINISHED_CHECK_INTERVAL == 0 and \
+                        mx.nd.sum(finished).asscalar() == num_rows:  # all finished
+                    break
+            elif np.all((best_word_indices_np == C.PAD_ID) |
+                        (best_word_indices_np == self.vocab_target[C.EOS_SYMBOL]) |
+                        (max_output_lengths_np <= t + 1)):  # all finished
                 break
 
             # (7) update models' state with winning hypotheses (ascending)
             for ms in model_states:
                 ms.sort_state(best_hyp_indices, best_word_indices)
 
-        return sequences, attentions, scores_accumulated, lengths
+        return best_hyp_indices_list, best_word_indices_list, attention_scores_list, scores_accumulated, lengths
 
-    @staticmethod
-    def _get_best_from_beam(sequences: mx.nd.NDArray,
-                            attention_lists: mx.nd.NDArray,
-                            accumulated_scores: mx.nd.NDArray,
-                            lengths: mx.nd.NDArray) -> Tuple[np.ndarray, np.ndarray, float]:
+    def _greedy_search(self,
+                       source: mx.nd.NDArray,
+                       bucket_key: int,
+                       max_output_lengths: np.ndarray) -> List[Tuple[List[int], np.ndarray, float]]:
+        """
+        Translates a batch of sentences greedily, i.e. with a beam size of 1. The next word of each sentence is the
+        argmax of the predicted distribution, and only its probability is converted to a negative log probability.
+        As every sentence has a single hypothesis, decoder states are never reordered.
+
+        :param source: Source ids. Shape: (batch_size, bucket_key).
+        :param bucket_key: Bucket key.
+        :param max_output_lengths: Cap the output of each sentence at this maximum length. Shape: (batch_size,).
+        :return: For each row of source: sequence of translated ids, attention matrix,
+                 length-normalized negative log probability.
+        """
+        vocab_slice_ids, vocab_slice_ids_nd, models_output_layer_params = self._get_vocab_slice(source)
+        max_output_length = int(max_output_lengths.max())
+        length_penalties = self.length_penalty.get_table(max_output_length, mx.cpu()).asnumpy()
+        stop_ids = np.array(sorted(self.stop_ids))
+        finished = np.zeros((self.batch_size,), dtype=bool)
+        lengths = np.zeros((self.batch_size,), dtype='int32')
+        scores_accumulated = np.zeros((self.batch_size,), dtype='float32')
+        # for each step: word ids (batch_size,) and attention scores (batch_size, encoded_source_length)
+        words_list = []  # type: List[np.ndarray]
+        attentions_list = []  # type: List[mx.nd.NDArray]
+
+        model_states = self._encode(source, bucket_key)
+        for t in range(0, max_output_length):
+            model_probs, model_attention_probs, model_states = self._run_decoders(model_states,
+                                                                                  models_output_layer_params)
+            if len(self.models) == 1:
+                best_word_indices = mx.nd.argmax(model_probs[0], axis=1)
+                scores = -mx.nd.log(mx.nd.pick(model_probs[0], best_word_indices, axis=1))
+            else:
+                neg_logprobs = self.interpolation_func(model_probs)
+                best_word_indices = mx.nd.argmin(neg_logprobs, axis=1)
+                scores = mx.nd.pick(neg_logprobs, best_word_indices, axis=1)
+            if vocab_slice_ids_nd is not None:
+                # map word indices of the restricted vocabulary back to the full target vocabulary
+                best_word_indices = mx.nd.take(vocab_slice_ids_nd, best_word_indices)
+            best_word_indices = mx.nd.cast(best_word_indices, dtype='int32')
+            if self.collect_attention:
+                # copied, since the attention scores of a single model are overwritten by the next forward pass
+                attentions_list.append(utils.average_arrays(model_attention_probs).copy())
+
+            # finished sentences keep their length and score
+            words = best_word_indices.asnumpy()
+            active = np.logical_not(finished)
+            words_list.append(words)
+            lengths += active
+            scores_accumulated += active * scores.asnumpy()
+            finished |= np.in1d(words, stop_ids) | (max_output_lengths <= t + 1)
+            if finished.all():
+                break
+
+            for ms in model_states:
+                ms.prev_target_word_id = best_word_indices
+
+        words_np = np.stack(words_list)
+        attention_scores_np = np.stack([a.asnumpy() for a in attentions_list]) if self.collect_attention else None
+        results = []
+        for sentence in range(self.batch_size):
+            length = lengths[sentence]
+            sequence = words_np[:length, sentence].tolist()
+            # attention_matrix: (target_seq_len, source_seq_len)
+            attention_matrix = attention_scores_np[:length, sentence, :] if attention_scores_np is not None \
+                else np.zeros((length, 0))
+            results.append((sequence, attention_matrix, float(scores_accumulated[sentence] / length_penalties[length])))
+        return results
+
+    def _beam_search_shrinking(self,
+                               source: mx.nd.NDArray,
+                               bucket_key: int,
+                               max_output_lengths: np.ndarray) -> List[Tuple[List[int], np.ndarray, float]]:
         """
-        Return the best (aka top) entry from the n-best list.
+        Translates a batch of sentences using beam search with a shrinking beam.
+        Every finished hypothesis is moved to the host-side list of finished hypotheses of its sentence and reduces
+        the beam of that sentence by one. Decoder states are compacted to the active hypotheses, such that the
+        cost of a step is proportional to their number. Sentences whose beam is empty are retired.
+        Unlike in _beam_search, finished hypotheses do not compete with active ones for a place in the beam.
 
-        :param sequences: Array of word ids. Shape: (beam_size, bucket_key).
-        :param attention_lists: Array of attentions over source words. Shape: (length, bucket_key).
+        :param source: Source ids. Shape: (batch_size, bucket_key).
+        :param bucket_key: Bucket key.
+        :param max_output_lengths: Cap the output of each sentence at this maximum length. Shape: (batch_size,).
+        :return: For each row of source: sequence of translated ids, attention matrix,
+                 length-normalized negative log probability.
+        """
+        vocab_slice_ids, _, models_output_layer_params = self._get_vocab_slice(source)
+        max_output_length = int(max_output_lengths.max())
+        length_penalties = self.length_penalty.get_table(max_output_length, mx.cpu()).asnumpy()
+        stop_ids = np.array(sorted(self.stop_ids))
+
+        # active hypotheses: sentence, accumulated negative log-prob, and index into the previous step's history.
+        # active hypotheses of a sentence are contiguous.
+        active_sentences = np.arange(self.batch_size)
+        active_scores = np.zeros((self.batch_size,), dtype='float32')
+        active_pointers = np.full((self.batch_size,), -1, dtype='int32')
+        beam_sizes = np.full((self.batch_size,), self.beam_size, dtype='int32')
+        # history: for each step, back-pointers, word ids, and attention scores of the hypotheses selected in it
+        pointers_list = []  # type: List[np.ndarray]
+        words_list = []  # type: List[np.ndarray]
+        attentions_list = []  # type: List[np.ndarray]
+        # for each sentence: length-normalized score, step, and index into the step's history of finished hypotheses
+        finished = [[] for _ in range(self.batch_size)]  # type: List[List[Tuple[float, int, int]]]
+
+        # (0) encode source sentences and keep a single hypothesis per sentence
+        model_states = self._encode(source, bucket_key)
+        first_rows = mx.nd.array(np.arange(0, self.batch_size * self.beam_size, self.beam_size), ctx=self.context)
+        for ms in model_states:
+            ms.compact_state(first_rows, mx.nd.take(ms.prev_target_word_id, first_rows))
+
+        for t in range(0, max_output_length):
+            # (1) obtain next predictions of the active hypotheses and copy them to the host
+            scores, attention_scores, model_states = self._decode_step(model_states, models_output_layer_params)
+            scores_np = scores.asnumpy() + np.expand_dims(active_scores, axis=1)
+
+            # (2) get as many winning hypotheses for each sentence as its beam size
+            sentences, starts, counts = np.unique(active_sentences, return_index=True, return_counts=True)
+            rows, words, values, hyp_sentences = [], [], [], []
+            for sentence, start, count in zip(sentences, starts, counts):
+                (sentence_rows, sentence_words), sentence_values = utils.smallest_k(scores_np[start:start + count],
+                                                                                    beam_sizes[sentence])
+                rows.append(sentence_rows + start)
+                words.append(sentence_words)
+                values.append(sentence_values)
+                hyp_sentences.append(np.full((len(sentence_rows),), sentence))
+            rows, words, values, hyp_sentences = (np.concatenate(rows), np.concatenate(words),
+                                                  np.concatenate(values), np.concatenate(hyp_sentences))
+            if vocab_slice_ids is not None:
+                # map word indices of the restricted vocabulary back to the full target vocabulary
+                words = vocab_slice_ids[words]
+            pointers_list.append(active_pointers[rows])
+            words_list.append(words)
+            if self.collect_attention:
+                attentions_list.append(attention_scores.asnumpy()[rows])
+
+            # (3) move finished hypotheses out of the beam
+            is_finished = np.in1d(words, stop_ids) | (max_output_lengths[hyp_sentences] <= t + 1)
+            for index in np.flatnonzero(is_finished):
+                sentence = hyp_sentences[index]
+                finished[sentence].append((values[index] / length_penalties[t + 1], t, index))
+                beam_sizes[sentence] -= 1
+            active = np.logical_not(is_finished)
+            if not active.any():
+                break
+
+            # (4) update models' state with the active hypotheses
+            next_active_sentences = hyp_sentences[active]
+            best_hyp_indices = mx.nd.array(rows[active], ctx=self.context)
+            best_word_indices = mx.nd.array(words[active], ctx=self.context, dtype='int32')
+            # rows still belong to the same sentences if no hypothesis finished: static states are kept as they are
+            keep_static = np.array_equal(next_active_sentences, active_sentences)
+            for ms in model_states:
+                if keep_static:
+                    ms.sort_state(best_hyp_indices, best_word_indices)
+                else:
+                    ms.compact_state(best_hyp_indices, best_word_indices)
+            active_sentences = next_active_sentences
+            active_scores = values[active]
+            active_pointers = np.flatnonzero(active).astype('int32')
+
+        # (5) follow the back-pointers of the best finished hypothesis of each sentence
+        results = []
+        for sentence_finished in finished:
+            score, t, index = min(sentence_finished)
+            sequence, attention_rows = [], []
+            for step in range(t, -1, -1):
+                sequence.append(int(words_list[step][index]))
+                if self.collect_attention:
+                    attention_rows.append(attentions_list[step][index])
+                index = pointers_list[step][index]
+            # attention_matrix: (target_seq_len, source_seq_len)
+            attention_matrix = np.stack(attention_rows[::-1]) if self.collect_attention \
+                else np.zeros((len(sequence), 0))
+            results.append((sequence[::-1], attention_matrix, float(score)))
+        return results
+
+    def _topk_device(self,
+                     scores: mx.nd.NDArray,
+                     pad_dist: mx.nd.NDArray,
+                     t: int) -> Tuple[mx.nd.NDArray, mx.nd.NDArray, mx.nd.NDArray]:
+        """
+        Returns the beam_size hypotheses with smallest scores for each sentence using NDArray operations only,
+        such that no data is copied to the host.
+
+        :param scores: Length-normalized accumulated scores. Shape: (batch_size * beam_size, target_vocab_size).
+        :param pad_dist: Array of the shape of scores that contains np.inf except for the C.PAD_ID column
+                         from step 1 on.
+        :param t: Decoder time step.
+        :return: Row indices of the winning hypotheses (batch_size * beam_size,), their word indices
+                 (batch_size * beam_size,), and their scores (batch_size * beam_size, 1), in ascending order
+                 for each sentence.
+        """
+        vocab_size = scores.shape[1]
+        if t == 0:
+            # only one hypothesis per sentence at t==0, pad_dist does not contain any finite values yet.
+            scores = mx.nd.where(self.first_hyp_mask, scores, pad_dist)
+        # (batch_size, beam_size * target_vocab_size)
+        scores = mx.nd.reshape(scores, shape=(self.batch_size, -1))
+        values, indices = mx.nd.topk(scores, axis=1, k=self.beam_size, ret_typ='both', is_ascend=True)
+        # indices into the beam of each sentence: (batch_size * beam_size,)
+        indices = mx.nd.reshape(indices, shape=(-1,))
+        hyp_indices = mx.nd.floor(indices / vocab_size)
+        word_indices = indices - hyp_indices * vocab_size
+        return hyp_indices + self.beam_offsets, word_indices, mx.nd.reshape(values, shape=(-1, 1))
+
+    def _get_best_from_beam(self,
+                            best_hyp_indices_list: List[mx.nd.NDArray],
+                            best_word_indices_list: List[mx.nd.NDArray],
+                            attention_scores_list: List[mx.nd.NDArray],
+                            accumulated_scores: mx.nd.NDArray,
+                            lengths: mx.nd.NDArray) -> List[Tuple[List[int], np.ndarray, float]]:
+        """
+        Return the best (aka top) entry from the n-best list of each sentence.
+        The best hypotheses are reconstructed by following the back-pointers from the last step.
+
+        :param best_hyp_indices_list: For each step: rows of the previous step the hypotheses extend.
+                                      Shape: (batch_size * beam_size,).
+        :param best_word_indices_list: For each step: word ids. Shape: (batch_size * beam_size,).
+        :param attention_scores_list: For each step: attentions over source words, in the order of the previous
+                                      step. Shape: (batch_size * beam_size, encoded_source_length).
+                                      Empty unless collect_attention.
         :param accumulated_scores: Array of length-normalized negative log-probs.
-        :return: Top sequence, top attention matrix, top accumulated score (length-normalized negative log-probs).
-        """
-        # sequences & accumulated scores are in latest 'k-best order', thus 0th element is best
-        best = 0
-        length = int(lengths[best].asscalar())
-        sequence = sequences[best][:length].asnumpy().tolist()
-        # attention_matrix: (target_seq_len, source_seq_len)
-        attention_matrix = np.stack(attention_lists[best].asnumpy()[:length, :], axis=0)
-        score = accumulated_scores[best].asscalar()
-        return sequence, attention_matrix, score
+        :param lengths: Array of hypothesis lengths. Shape: (batch_size * beam_size, 1).
+        :return: For each sentence: top sequence, top attention matrix, top accumulated score
+                 (length-normalized negative log-probs).
+        """
+        # (num_steps, batch_size * beam_size)
+        best_hyp_indices_np = np.stack([b.asnumpy() for b in best_hyp_indices_list]).astype('int32')
+        best_word_indices_np = np.stack([w.asnumpy() for w in best_word_indices_list]).astype('int32')
+        # (num_steps, batch_size * beam_size, encoded_source_length)
+        attention_scores_np = np.stack([a.asnumpy() for a in attention_scores_list]) if self.collect_attention \
+            else None
+        # accumulated scores are in latest 'k-best order', thus the first element of each beam is best
+        accumulated_scores_np = accumulated_scores.asnumpy()
+        lengths_np = lengths.asnumpy().astype('int32')
+        num_steps = len(best_hyp_indices_list)
+        results = []
+        for best in range(0, self.batch_size * self.beam_size, self.beam_size):
+            # rows of the best hypothesis at each step
+            rows = np.zeros((num_steps,), dtype='int32')
+            row = best
+            for t in range(num_steps - 1, -1, -1):
+                rows[t] = row
+                row = best_hyp_indices_np[t, row]
+            length = lengths_np[best, 0]
+            steps = np.arange(length)
+            sequence = best_word_indices_np[steps, rows[:length]].tolist()
+            # attention_matrix: (target_seq_len, source_seq_len)
+            if attention_scores_np is not None:
+                attention_matrix = attention_scores_np[steps, best_hyp_indices_np[steps, rows[:length]], :]
+            else:
+                attention_matrix = np.zeros((length, 0))
+            score = accumulated_scores_np[best, 0]
+            results.append((sequence, attention_matrix, score))
+        return results
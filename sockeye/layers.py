@@ -11,11 +11,12 @@
 # express or implied. See the License for the specific language governing
 # permissions and limitations under the License.
 
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
 
 import mxnet as mx
 import numpy as np
 
+from . import constants as C
 from . import utils
 
 
@@ -79,6 +80,47 @@ class LayerNormalization:
         return inputs_norm
 
 
+class OutputLayer:
+    """
+    Defines the output layer of Sockeye decoders that maps hidden states to logits over the target vocabulary.
+    Can be applied to Symbols in the decoder graphs, or to NDArrays with a subset of the weight matrix rows,
+    e.g. to compute logits only for the target words of a restricted vocabulary during inference.
+
+    :param vocab_size: Size of the target vocabulary.
+    :param weight: Optional shared weight Symbol, e.g. the target embedding matrix in case of weight tying.
+    :param prefix: Prefix of the parameter names.
+    """
+
+    def __init__(self,
+                 vocab_size: int,
+                 weight: Optional[mx.sym.Symbol] = None,
+                 prefix: str = C.DECODER_PREFIX + "cls_") -> None:
+        self.vocab_size = vocab_size
+        self.prefix = prefix
+        self.w = weight if weight is not None else mx.sym.Variable("%sweight" % prefix)
+        self.b = mx.sym.Variable("%sbias" % prefix)
+
+    def __call__(self,
+                 hidden: Union[mx.sym.Symbol, mx.nd.NDArray],
+                 weight: Optional[mx.nd.NDArray] = None,
+                 bias: Optional[mx.nd.NDArray] = None) -> Union[mx.sym.Symbol, mx.nd.NDArray]:
+        """
+        Returns logits for the given hidden states. Symbolic inputs use the full vocabulary, NDArray inputs
+        require the (possibly sliced) weight and bias arrays.
+
+        :param hidden: Decoder hidden states. Shape: (batch_size, num_hidden).
+        :param weight: Output weight array for NDArray inputs. Shape: (vocab_size, num_hidden).
+        :param bias: Output bias array for NDArray inputs. Shape: (vocab_size,).
+        :return: Logits. Shape: (batch_size, vocab_size).
+        """
+        if isinstance(hidden, mx.sym.Symbol):
+            return mx.sym.FullyConnected(data=hidden, num_hidden=self.vocab_size,
+                                         weight=self.w, bias=self.b, name=C.LOGITS_NAME)
+        utils.check_condition(weight is not None and bias is not None,
+                              "Output layer requires weight and bias arrays for NDArray inputs")
+        return mx.nd.FullyConnected(data=hidden, num_hidden=bias.shape[0], weight=weight, bias=bias)
+
+
 def split_heads(x: mx.sym.Symbol, length: int, heads: int) -> mx.sym.Symbol:
     """
     Returns a symbol with head dimension folded into batch and depth divided by the number of heads.
@@ -295,6 +337,55 @@ class MultiHeadSelfAttention(MultiHeadAttentionBase):
                             memory_max_length=max_length,
                             bias=bias)
 
+    def step(self,
+             inputs: mx.sym.Symbol,
+             positions: mx.sym.Symbol,
+             max_length: int,
+             cached_keys: mx.sym.Symbol,
+             cached_values: mx.sym.Symbol) -> Tuple[mx.sym.Symbol, mx.sym.Symbol, mx.sym.Symbol]:
+        """
+        Computes self-attention for a single time step, attending to the keys and values of all previous
+        time steps. Keys and values of the current time step are written into the caches at the given positions,
+        which must be zero before.
+
+        :param inputs: Symbol of shape (batch, 1, input_depth).
+        :param positions: Position of the current time step for each example. Shape: (batch,).
+        :param max_length: Size of time dimension of the caches.
+        :param cached_keys: Keys of previous time steps. Shape: (batch, max_length, depth).
+        :param cached_values: Values of previous time steps. Shape: (batch, max_length, depth).
+        :return: Symbol of shape (batch, 1, output_depth), updated keys and values caches.
+        """
+        # inputs: (batch, num_hidden)
+        inputs = mx.sym.reshape(data=inputs, shape=(-3, -1))
+
+        # combined: (batch, depth * 3)
+        combined = mx.sym.FullyConnected(data=inputs,
+                                         weight=self.w_i2h,
+                                         bias=self.b_i2h,
+                                         num_hidden=self.depth * 3,
+                                         name="%sqkv_transform" % self.prefix)
+        # combined: (batch, 1, depth * 3)
+        combined = mx.sym.expand_dims(combined, axis=1)
+
+        # split into query, keys and values
+        # (batch, 1, depth)
+        queries, keys, values = mx.sym.split(data=combined, num_outputs=3, axis=2)
+
+        # (batch, max_length, 1): 1 at the current position, 0 elsewhere
+        position_mask = mx.sym.expand_dims(mx.sym.one_hot(indices=positions, depth=max_length), axis=2)
+        # (batch, max_length, depth)
+        cached_keys = cached_keys + mx.sym.broadcast_mul(position_mask, keys)
+        cached_values = cached_values + mx.sym.broadcast_mul(position_mask, values)
+
+        # positions after the current one are masked by the lengths
+        contexts = self._attend(queries,
+                                cached_keys,
+                                cached_values,
+                                positions + 1,
+                                queries_max_length=1,
+                                memory_max_length=max_length)
+        return contexts, cached_keys, cached_values
+
 
 class MultiHeadAttention(MultiHeadAttentionBase):
     """
@@ -335,6 +426,20 @@ class MultiHeadAttention(MultiHeadAttentionBase):
         :param memory_max_length: Size of memory time dimension.
         :return: Symbol of shape (batch, queries_max_length, output_depth).
         """
+        keys, values = self.project_memory(memory, memory_max_length)
+        return self.attend(queries, queries_max_length, keys, values, memory_lengths, memory_max_length)
+
+    def project_memory(self,
+                       memory: mx.sym.Symbol,
+                       memory_max_length: int) -> Tuple[mx.sym.Symbol, mx.sym.Symbol]:
+        """
+        Projects memory into keys and values. As these do not depend on the queries, they can be computed once
+        and reused for several calls to attend().
+
+        :param memory: Symbol of shape (batch, memory_max_length, input_depth).
+        :param memory_max_length: Size of memory time dimension.
+        :return: Keys and values, each of shape (batch, memory_max_length, depth).
+        """
         # Combine batch and time dimension
         # inputs: (batch * memory_max_length, num_hidden)
         memory = mx.sym.reshape(data=memory, shape=(-3, -1))
@@ -354,7 +459,27 @@ class MultiHeadAttention(MultiHeadAttentionBase):
         # (batch, memory_max_length, depth)
         # NOTE: requires depth to be equal across all 2 parts.
         keys, values = mx.sym.split(data=combined, num_outputs=2, axis=2)
+        return keys, values
+
+    def attend(self,
+               queries: mx.sym.Symbol,
+               queries_max_length: int,
+               keys: mx.sym.Symbol,
+               values: mx.sym.Symbol,
+               memory_lengths: mx.sym.Symbol,
+               memory_max_length: int) -> mx.sym.Symbol:
+        """
+        Returns a symbol of shape (batch, max_length, output_depth), given memory keys and values
+        as returned by project_memory().
 
+        :param queries: Symbol of shape (batch, queries_max_length, input_depth).
+        :param queries_max_length: Size of queries time dimension.
+        :param keys: Symbol of shape (batch, memory_max_length, depth).
+        :param values: Symbol of shape (batch, memory_max_length, depth).
+        :param memory_lengths: Symbol of shape (batch, 1).
+        :param memory_max_length: Size of memory time dimension.
+        :return: Symbol of shape (batch, queries_max_length, output_depth).
+        """
         queries = mx.sym.reshape(data=queries, shape=(-3, -1))
         # (batch * memory_max_length, depth * 2)
         queries = mx.sym.FullyConnected(data=queries,
@@ -11,15 +11,22 @@
 # express or implied. See the License for the specific language governing
 # permissions and limitations under the License.
 
+import argparse
+import heapq
+import json
 import logging
-from typing import Dict
+import os
+from typing import Dict, Generator, List, Tuple
 
 import mxnet as mx
 import numpy as np
 
 import sockeye.constants as C
+from sockeye import arguments
 from sockeye.data_io import smart_open
+from sockeye.log import setup_main_logger, log_sockeye_version
 from sockeye.utils import check_condition
+from sockeye import vocab
 
 logger = logging.getLogger(__name__)
 
@@ -119,27 +126,43 @@ def read_lexicon(path: str, vocab_source: Dict[str, int], vocab_target: Dict[str
     :param vocab_target: Target vocabulary.
     :return: Lexicon array. Shape: (vocab_source_size, vocab_target_size).
     """
+    trg_unk_id = vocab_target[C.UNK_SYMBOL]
+    lexicon = np.zeros((len(vocab_source), len(vocab_target)))
+    n = 0
+    for src_id, trg_id, prob in lexicon_iterator(path, vocab_source, vocab_target):
+        if trg_id == trg_unk_id:
+            lexicon[src_id, trg_unk_id] += prob
+        else:
+            lexicon[src_id, trg_id] = prob
+        n += 1
+    logger.info("Loaded lexicon from '%s' with %d entries", path, n)
+    return lexicon
+
+
+def lexicon_iterator(path: str,
+                     vocab_source: Dict[str, int],
+                     vocab_target: Dict[str, int]) -> Generator[Tuple[int, int, float], None, None]:
+    """
+    Yields lines from a translation table of format: src, trg, logprob.
+    Source words unknown to vocab_source are discarded, target words unknown to vocab_target are mapped to <unk>.
+
+    :param path: Path to lexicon file.
+    :param vocab_source: Source vocabulary.
+    :param vocab_target: Target vocabulary.
+    :return: Generator of (source id, target id, probability) tuples.
+    """
     assert C.UNK_SYMBOL in vocab_source
     assert C.UNK_SYMBOL in vocab_target
     src_unk_id = vocab_source[C.UNK_SYMBOL]
     trg_unk_id = vocab_target[C.UNK_SYMBOL]
-    lexicon = np.zeros((len(vocab_source), len(vocab_target)))
-    n = 0
     with smart_open(path) as fin:
         for line in fin:
             src, trg, logprob = line.rstrip('\n').split("\t")
-            prob = np.exp(float(logprob))
             src_id = vocab_source.get(src, src_unk_id)
-            trg_id = vocab_target.get(trg, trg_unk_id)
             if src_id == src_unk_id:
                 continue
-            if trg_id == trg_unk_id:
-                lexicon[src_id, trg_unk_id] += prob
-            else:
-                lexicon[src_id, trg_id] = prob
-            n += 1
-    logger.info("Loaded lexicon from '%s' with %d entries", path, n)
-    return lexicon
+            trg_id = vocab_target.get(trg, trg_unk_id)
+            yield src_id, trg_id, np.exp(float(logprob))
 
 
 class LexiconInitializer(mx.initializer.Initializer):
@@ -158,3 +181,118 @@ class LexiconInitializer(mx.initializer.Initializer):
         logger.info("Initializing '%s' with lexicon.", sym_name)
         assert len(arr.shape) == 2, "Only 2d weight matrices supported."
         self.lexicon.copyto(arr)
+
+
+class TopKLexicon:
+    """
+    Lexicon component that stores the k most likely target words for each source word.
+    Used during decoding to restrict the target vocabulary (and thus the output layer) to a shortlist of
+    candidate translations of the source words, the most frequent target words, and special symbols.
+
+    :param vocab_source: Trained model source vocabulary.
+    :param vocab_target: Trained model target vocabulary.
+    :param num_frequent: Number of most frequent target words that are always part of the shortlist.
+    """
+
+    def __init__(self,
+                 vocab_source: Dict[str, int],
+                 vocab_target: Dict[str, int],
+                 num_frequent: int = C.LEXICON_TOP_K_NUM_FREQUENT) -> None:
+        self.vocab_source = vocab_source
+        self.vocab_target = vocab_target
+        self.vocab_source_inv = vocab.reverse_vocab(vocab_source)
+        self.vocab_target_inv = vocab.reverse_vocab(vocab_target)
+        # target ids are assigned by decreasing word frequency after the special symbols
+        num_always_allowed = min(len(C.VOCAB_SYMBOLS) + num_frequent, len(vocab_target))
+        self.always_allow = np.arange(num_always_allowed, dtype='int32')
+        check_condition(all(self.vocab_target[symbol] < num_always_allowed for symbol in C.VOCAB_SYMBOLS),
+                        "Special symbols must have the lowest target vocabulary ids")
+        # Shape: (vocab_source_size, k), k determined by create() or load()
+        self.lex = None  # type: np.ndarray
+
+    def create(self, path: str, k: int = C.LEXICON_TOP_K_DEFAULT):
+        """
+        Creates the top-k lexicon from a translation table of format: src, trg, logprob.
+
+        :param path: Path to lexicon file.
+        :param k: Number of target entries per source word to keep.
+        """
+        self.lex = np.zeros((len(self.vocab_source), k), dtype='int32')
+        trg_unk_id = self.vocab_target[C.UNK_SYMBOL]
+        # min-heap of the k most probable (prob, trg_id) pairs for each source word
+        top_k = {}  # type: Dict[int, List[Tuple[float, int]]]
+        for src_id, trg_id, prob in lexicon_iterator(path, self.vocab_source, self.vocab_target):
+            if trg_id == trg_unk_id:
+                continue
+            heap = top_k.setdefault(src_id, [])
+            if len(heap) < k:
+                heapq.heappush(heap, (prob, trg_id))
+            else:
+                heapq.heappushpop(heap, (prob, trg_id))
+        for src_id, heap in top_k.items():
+            # entries sorted by decreasing probability, remaining columns are C.PAD_ID
+            trg_ids = [trg_id for _, trg_id in sorted(heap, reverse=True)]
+            self.lex[src_id, :len(trg_ids)] = trg_ids
+        logger.info("Created top-k lexicon from \"%s\" with %d source words and k=%d.", path, len(top_k), k)
+
+    def save(self, path: str):
+        """
+        Saves the lexicon in JSON format, mapping source words to lists of target words.
+
+        :param path: Output path.
+        """
+        with smart_open(path, mode="wt") as out:
+            lex = {self.vocab_source_inv[src_id]: [self.vocab_target_inv[trg_id]
+                                                   for trg_id in row if trg_id != C.PAD_ID]
+                   for src_id, row in enumerate(self.lex) if row[0] != C.PAD_ID}
+            json.dump(lex, out, indent=4, ensure_ascii=False)
+        logger.info("Saved top-k lexicon to \"%s\"", path)
+
+    def load(self, path: str):
+        """
+        Loads a lexicon saved by save(). Words unknown to the model vocabularies are skipped.
+
+        :param path: Path to lexicon in JSON format.
+        """
+        with smart_open(path) as inp:
+            lex = json.load(inp)
+        k = max((len(trg_words) for trg_words in lex.values()), default=1)
+        self.lex = np.zeros((len(self.vocab_source), k), dtype='int32')
+        for src_word, trg_words in lex.items():
+            if src_word not in self.vocab_source:
+                continue
+            trg_ids = [self.vocab_target[trg_word] for trg_word in trg_words if trg_word in self.vocab_target]
+            self.lex[self.vocab_source[src_word], :len(trg_ids)] = trg_ids
+        logger.info("Loaded top-k lexicon from \"%s\" with %d source words and k=%d.", path, len(lex), k)
+
+    def get_trg_ids(self, src_ids: np.ndarray) -> np.ndarray:
+        """
+        Lookup possible target ids for input sequence(s) of source ids.
+
+        :param src_ids: Sequence(s) of source ids (any shape).
+        :return: Sorted array of possible target ids. Always contains the special symbols and frequent target words.
+        """
+        unique_src_ids = np.unique(src_ids.astype('int32'))
+        return np.union1d(self.always_allow, self.lex[unique_src_ids, :].reshape(-1))
+
+
+def main():
+    """
+    Commandline interface for creating top-k lexicons to restrict the target vocabulary during decoding.
+    """
+    setup_main_logger(__name__, console=True, file_logging=False)
+    log_sockeye_version(logger)
+    params = argparse.ArgumentParser(description="Create a top-k lexicon for vocabulary restriction during decoding.")
+    arguments.add_lexicon_args(params)
+    args = params.parse_args()
+
+    vocab_source = vocab.vocab_from_json_or_pickle(os.path.join(args.model, C.VOCAB_SRC_NAME))
+    vocab_target = vocab.vocab_from_json_or_pickle(os.path.join(args.model, C.VOCAB_TRG_NAME))
+
+    lexicon = TopKLexicon(vocab_source, vocab_target)
+    lexicon.create(args.input, args.k)
+    lexicon.save(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""
+Converts the parameter file of a model checkpoint to the memory-mapped format of utils.save_params_mmap, with RNN
+cell weights already packed for inference, and measures the startup time of inference models loading either format.
+"""
+
+import argparse
+import gc
+import os
+import time
+from typing import List, Optional, Tuple
+
+import mxnet as mx
+import numpy as np
+
+from sockeye.log import setup_main_logger, log_sockeye_version
+from . import arguments
+from . import constants as C
+from . import inference
+from . import utils
+
+logger = setup_main_logger(__name__, console=True, file_logging=False)
+
+
+def get_params_path(model_folder: str, checkpoint: Optional[int] = None) -> str:
+    """
+    Returns the parameter file of a checkpoint, or of the best checkpoint.
+
+    :param model_folder: Model folder.
+    :param checkpoint: Checkpoint number. None: best checkpoint.
+    :return: Path of the parameter file.
+    """
+    return os.path.join(model_folder, C.PARAMS_NAME % checkpoint if checkpoint else C.PARAMS_BEST_NAME)
+
+
+def convert(model_folder: str, checkpoint: Optional[int] = None) -> str:
+    """
+    Writes the parameters of a checkpoint as a memory-mapped parameter file next to its parameter file.
+
+    :param model_folder: Model folder.
+    :param checkpoint: Checkpoint number. None: best checkpoint.
+    :return: Path of the memory-mapped parameter file.
+    """
+    model = inference.InferenceModel(model_folder=model_folder,
+                                     context=mx.cpu(),
+                                     fused=False,
+                                     max_input_len=None,
+                                     beam_size=1,
+                                     checkpoint=checkpoint,
+                                     bind=False)
+    fname = get_params_path(model_folder, checkpoint) + C.PARAMS_MMAP_SUFFIX
+    utils.save_params_mmap(model.params, fname)
+    return fname
+
+
+def drop_from_page_cache(fname: str):
+    """
+    Asks the kernel to evict a file from the page cache. Pages still mapped by a process are kept.
+
+    :param fname: File name.
+    """
+    fd = os.open(fname, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def benchmark_startup(model_folder: str, checkpoint: Optional[int], repetitions: int,
+                      beam_size: int = 5, batch_size: int = 1) -> List[Tuple[str, str, float, float]]:
+    """
+    Measures the time to create a bound inference model from the parameter file and from the memory-mapped
+    parameter file of a checkpoint. Cold startups evict both files from the page cache first, warm startups
+    follow a previous startup.
+
+    :param model_folder: Model folder with a memory-mapped parameter file (see convert).
+    :param checkpoint: Checkpoint number. None: best checkpoint.
+    :param repetitions: Number of startups per loader and page cache state.
+    :param beam_size: Beam size of the inference model.
+    :param batch_size: Batch size of the inference model.
+    :return: Loader, page cache state, mean and median startup time in seconds.
+    """
+    fname = get_params_path(model_folder, checkpoint)
+    results = []
+    for mmap_params in (False, True):
+        loader = "mmap" if mmap_params else "file"
+        for state in ("cold", "warm"):
+            times = []
+            for _ in range(repetitions):
+                if state == "cold":
+                    drop_from_page_cache(fname)
+                    drop_from_page_cache(fname + C.PARAMS_MMAP_SUFFIX)
+                tic = time.time()
+                model = inference.InferenceModel(model_folder=model_folder,
+                                                 context=mx.cpu(),
+                                                 fused=False,
+                                                 max_input_len=None,
+                                                 beam_size=beam_size,
+                                                 batch_size=batch_size,
+                                                 checkpoint=checkpoint,
+                                                 mmap_params=mmap_params)
+                mx.nd.waitall()
+                times.append(time.time() - tic)
+                # release the mapping, such that the next cold startup can evict the file
+                del model
+                gc.collect()
+            results.append((loader, state, float(np.mean(times)), float(np.median(times))))
+            logger.info("Startup with %s parameters (%s page cache): mean %.3fs median %.3fs", *results[-1])
+    return results
+
+
+def main():
+    """
+    Commandline interface to write memory-mapped parameter files and to measure startup time.
+    """
+    log_sockeye_version(logger)
+    params = argparse.ArgumentParser(description="Writes memory-mapped parameter files for inference.")
+    arguments.add_mmap_params_args(params)
+    args = params.parse_args()
+
+    fname = convert(args.model, args.checkpoint)
+    logger.info("Memory-mapped parameters written to '%s' (%.1f MB)", fname, os.path.getsize(fname) / 2 ** 20)
+    if args.benchmark is not None:
+        benchmark_startup(args.model, args.checkpoint, args.benchmark)
+
+
+if __name__ == "__main__":
+    main()
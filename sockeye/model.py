@@ -148,6 +148,17 @@ class SockeyeModel:
             self.params = cell.pack_weights(self.params)
         logger.info('Loaded params from "%s"', fname)
 
+    def load_params_from_mmap(self, fname: str):
+        """
+        Memory-maps model parameters written by sockeye.mmap_params. RNN cell weights are stored packed and are not
+        copied on loading.
+
+        :param fname: Path of the memory-mapped parameter file.
+        """
+        assert self.built
+        self.params = utils.MappedParams(utils.load_params_mmap(fname))
+        logger.info('Memory-mapped params from "%s"', fname)
+
     @staticmethod
     def save_version(folder: str):
         """
@@ -12,6 +12,8 @@
 # permissions and limitations under the License.
 
 from abc import ABC, abstractmethod
+import json
+import math
 import sys
 from typing import Optional
 
@@ -39,6 +41,8 @@ def get_output_handler(output_type: str,
         return StringWithAlignmentsOutputHandler(output_stream, sure_align_threshold)
     elif output_type == C.OUTPUT_HANDLER_BENCHMARK:
         return BenchmarkOutputHandler(output_stream)
+    elif output_type == C.OUTPUT_HANDLER_JSON:
+        return JSONOutputHandler(output_stream)
     elif output_type == C.OUTPUT_HANDLER_ALIGN_PLOT:
         return AlignPlotHandler(plot_prefix="align" if output_fname is None else output_fname)
     elif output_type == C.OUTPUT_HANDLER_ALIGN_TEXT:
@@ -56,14 +60,29 @@ class OutputHandler(ABC):
     def handle(self,
                t_input: sockeye.inference.TranslatorInput,
                t_output: sockeye.inference.TranslatorOutput,
-               t_walltime: float = 0.):
+               t_walltime: float = 0.,
+               t_timings: Optional[sockeye.inference.TranslatorTimings] = None):
         """
         :param t_input: Translator input.
         :param t_output: Translator output.
         :param t_walltime: Total wall-clock time for translation.
+        :param t_timings: Per-phase timings of the translation, if collected.
         """
         pass
 
+    def reports_attention(self) -> bool:
+        """
+        Whether the handler uses the attention matrix of translator outputs. If not, attention scores are not
+        collected during decoding.
+        """
+        return False
+
+    def reports_timings(self) -> bool:
+        """
+        Whether the handler reports per-phase timings. If not, they are not collected during decoding.
+        """
+        return False
+
 
 class StringOutputHandler(OutputHandler):
     """
@@ -78,11 +97,13 @@ class StringOutputHandler(OutputHandler):
     def handle(self,
                t_input: sockeye.inference.TranslatorInput,
                t_output: sockeye.inference.TranslatorOutput,
-               t_walltime: float = 0.):
+               t_walltime: float = 0.,
+               t_timings: Optional[sockeye.inference.TranslatorTimings] = None):
         """
         :param t_input: Translator input.
         :param t_output: Translator output.
         :param t_walltime: Total walltime for translation.
+        :param t_timings: Per-phase timings of the translation, if collected.
         """
         self.stream.write("%s\n" % t_output.translation)
         self.stream.flush()
@@ -107,17 +128,22 @@ class StringWithAlignmentsOutputHandler(StringOutputHandler):
     def handle(self,
                t_input: sockeye.inference.TranslatorInput,
                t_output: sockeye.inference.TranslatorOutput,
-               t_walltime: float = 0.):
+               t_walltime: float = 0.,
+               t_timings: Optional[sockeye.inference.TranslatorTimings] = None):
         """
         :param t_input: Translator input.
         :param t_output: Translator output.
         :param t_walltime: Total wall-clock time for translation.
+        :param t_timings: Per-phase timings of the translation, if collected.
         """
         alignments = " ".join(
             ["%d-%d" % (s, t) for s, t in get_alignments(t_output.attention_matrix, threshold=self.threshold)])
         self.stream.write("%s\t%s\n" % (t_output.translation, alignments))
         self.stream.flush()
 
+    def reports_attention(self) -> bool:
+        return True
+
 
 class BenchmarkOutputHandler(StringOutputHandler):
     """
@@ -129,20 +155,64 @@ class BenchmarkOutputHandler(StringOutputHandler):
     def handle(self,
                t_input: sockeye.inference.TranslatorInput,
                t_output: sockeye.inference.TranslatorOutput,
-               t_walltime: float = 0.):
+               t_walltime: float = 0.,
+               t_timings: Optional[sockeye.inference.TranslatorTimings] = None):
         """
         :param t_input: Translator input.
         :param t_output: Translator output.
         :param t_walltime: Total walltime for translation.
+        :param t_timings: Per-phase timings of the translation, if collected.
         """
-        self.stream.write("input=%s\toutput=%s\tinput_tokens=%d\toutput_tokens=%d\ttranslation_time=%0.4f\n" %
+        self.stream.write("input=%s\toutput=%s\tinput_tokens=%d\toutput_tokens=%d\ttranslation_time=%0.4f" %
                           (t_input.sentence,
                            t_output.translation,
                            len(t_input.tokens),
                            len(t_output.tokens),
                            t_walltime))
+        if t_timings is not None:
+            self.stream.write("\tprepare_time=%0.6f\tencode_time=%0.6f\tdecode_steps=%d\tdecoder_forward_time=%0.6f"
+                              "\tsearch_time=%0.6f\tresult_assembly_time=%0.6f" % t_timings)
+        self.stream.write("\n")
         self.stream.flush()
 
+    def reports_timings(self) -> bool:
+        return True
+
+
+class JSONOutputHandler(StringOutputHandler):
+    """
+    Output handler to write one JSON object per translation to a stream, with input and output token counts,
+    translation time, score, and per-phase timings (see sockeye.inference.TranslatorTimings) if collected.
+
+    :param stream: Stream to write translations to (e.g. sys.stdout).
+    """
+
+    def handle(self,
+               t_input: sockeye.inference.TranslatorInput,
+               t_output: sockeye.inference.TranslatorOutput,
+               t_walltime: float = 0.,
+               t_timings: Optional[sockeye.inference.TranslatorTimings] = None):
+        """
+        :param t_input: Translator input.
+        :param t_output: Translator output.
+        :param t_walltime: Total walltime for translation.
+        :param t_timings: Per-phase timings of the translation, if collected.
+        """
+        result = {"id": t_input.id,
+                  "input": t_input.sentence,
+                  "translation": t_output.translation,
+                  "input_tokens": len(t_input.tokens),
+                  "output_tokens": len(t_output.tokens),
+                  "translation_time": t_walltime,
+                  "score": float(t_output.score) if math.isfinite(t_output.score) else None}
+        if t_timings is not None:
+            result["timings"] = t_timings._asdict()
+        self.stream.write("%s\n" % json.dumps(result, ensure_ascii=False))
+        self.stream.flush()
+
+    def reports_timings(self) -> bool:
+        return True
+
 
 class AlignPlotHandler(OutputHandler):
     """
@@ -157,17 +227,22 @@ class AlignPlotHandler(OutputHandler):
     def handle(self,
                t_input: sockeye.inference.TranslatorInput,
                t_output: sockeye.inference.TranslatorOutput,
-               t_walltime: float = 0.):
+               t_walltime: float = 0.,
+               t_timings: Optional[sockeye.inference.TranslatorTimings] = None):
         """
         :param t_input: Translator input.
         :param t_output: Translator output.
         :param t_walltime: Total wall-clock time for translation.
+        :param t_timings: Per-phase timings of the translation, if collected.
         """
         plot_attention(t_output.attention_matrix,
                        t_input.tokens,
                        t_output.tokens,
                        "%s_%d.png" % (self.plot_prefix, t_input.id))
 
+    def reports_attention(self) -> bool:
+        return True
+
 
 class AlignTextHandler(OutputHandler):
     """
@@ -182,13 +257,18 @@ class AlignTextHandler(OutputHandler):
     def handle(self,
                t_input: sockeye.inference.TranslatorInput,
                t_output: sockeye.inference.TranslatorOutput,
-               t_walltime: float = 0.):
+               t_walltime: float = 0.,
+               t_timings: Optional[sockeye.inference.TranslatorTimings] = None):
         """
         :param t_input: Translator input.
         :param t_output: Translator output.
         :param t_walltime: Total wall-clock time for translation.
+        :param t_timings: Per-phase timings of the translation, if collected.
         """
         print_attention_text(t_output.attention_matrix,
                              t_input.tokens,
                              t_output.tokens,
                              self.threshold)
+
+    def reports_attention(self) -> bool:
+        return True
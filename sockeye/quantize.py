@@ -0,0 +1,99 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""
+Writes parameter files with the large matrices of a model (embeddings, output layer weights) stored in low precision:
+8-bit values with a scale and zero point per row, or float16. utils.load_params converts them back to float32,
+such that quantized parameter files are smaller and faster to load, but decode like the original ones up to
+quantization error.
+"""
+
+import argparse
+import os
+from typing import Dict, List, Optional
+
+import mxnet as mx
+import numpy as np
+
+from sockeye.log import setup_main_logger, log_sockeye_version
+from . import arguments
+from . import constants as C
+from . import utils
+
+logger = setup_main_logger(__name__, console=True, file_logging=False)
+
+
+def quantize(arg_params: Dict[str, mx.nd.NDArray],
+             aux_params: Dict[str, mx.nd.NDArray],
+             dtype: str = C.QUANTIZE_INT8,
+             names: Optional[List[str]] = None,
+             min_size: int = C.QUANTIZE_MIN_SIZE) -> Dict[str, mx.nd.NDArray]:
+    """
+    Returns the save dictionary of a parameter file in which the selected matrices with at least min_size elements
+    are stored in low precision. Other parameters are kept as they are.
+
+    :param arg_params: Arg parameters.
+    :param aux_params: Aux parameters.
+    :param dtype: Storage type of selected matrices: C.QUANTIZE_INT8 (8 bits per value with per-row scale and zero
+           point) or C.QUANTIZE_FLOAT16.
+    :param names: Names of the arg parameters to quantize. Default: the embedding and output layer weights of the
+           model (C.QUANTIZE_DEFAULT_PARAMS).
+    :param min_size: Minimum number of elements of quantized matrices.
+    :return: Mapping from prefixed names to arrays, to be saved with mx.nd.save.
+    """
+    utils.check_condition(dtype in C.QUANTIZE_TYPES, "Unknown quantization type: %s" % dtype)
+    if names is None:
+        names = [name for name in C.QUANTIZE_DEFAULT_PARAMS if name in arg_params]
+    for name in names:
+        utils.check_condition(name in arg_params, "Unknown parameter: %s" % name)
+        utils.check_condition(len(arg_params[name].shape) == 2,
+                              "Only matrices can be quantized: %s %s" % (name, arg_params[name].shape))
+    save_dict = {"aux:%s" % name: param for name, param in aux_params.items()}
+    for name, param in sorted(arg_params.items()):
+        if name not in names or param.size < min_size:
+            save_dict["arg:%s" % name] = param
+            continue
+        array = param.asnumpy()
+        if dtype == C.QUANTIZE_FLOAT16:
+            save_dict["arg:%s" % name] = mx.nd.array(array, dtype='float16')
+            error = np.abs(array.astype('float16').astype('float32') - array).max()
+        else:
+            quantized, scales, zero_points = utils.quantize_rows(array)
+            save_dict["%s:%s" % (C.PARAMS_QUANTIZED_VALUES_PREFIX, name)] = mx.nd.array(quantized, dtype='uint8')
+            save_dict["%s:%s" % (C.PARAMS_QUANTIZED_SCALES_PREFIX, name)] = mx.nd.array(scales)
+            save_dict["%s:%s" % (C.PARAMS_QUANTIZED_ZERO_POINTS_PREFIX, name)] = mx.nd.array(zero_points)
+            error = np.abs((quantized - zero_points[:, None]) * scales[:, None] - array).max()
+        logger.info("Stored '%s' %s as %s (max. absolute error: %.6f)", name, param.shape, dtype, error)
+    return save_dict
+
+
+def main():
+    """
+    Commandline interface to quantize parameters.
+    """
+    log_sockeye_version(logger)
+    params = argparse.ArgumentParser(description="Stores the embedding and output layer matrices of a parameter file in low precision.")
+    arguments.add_quantize_args(params)
+    args = params.parse_args()
+
+    input_path = args.input
+    if os.path.isdir(input_path):
+        input_path = os.path.join(input_path, C.PARAMS_BEST_NAME)
+    arg_params, aux_params = utils.load_params(input_path)
+    mx.nd.save(args.output, quantize(arg_params, aux_params, args.dtype, args.params, args.min_size))
+    logger.info("Quantized parameters written to '%s' (%.1f MB, original: %.1f MB)", args.output,
+                os.path.getsize(args.output) / 2 ** 20, os.path.getsize(input_path) / 2 ** 20)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""
+Scoring CLI: computes the negative log-probabilities of given translations under a model (forced decoding),
+e.g. to rescore n-best lists or to filter parallel corpora.
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from contextlib import ExitStack
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import mxnet as mx
+import numpy as np
+
+import sockeye.arguments as arguments
+import sockeye.constants as C
+import sockeye.data_io
+import sockeye.inference
+import sockeye.model
+import sockeye.translate
+import sockeye.utils
+import sockeye.vocab
+from sockeye.log import setup_main_logger, log_sockeye_version
+from sockeye.utils import check_condition
+
+logger = setup_main_logger(__name__, file_logging=False)
+
+
+class ScoringModel(sockeye.model.SockeyeModel):
+    """
+    ScoringModel computes the negative log-probability of known target sequences given source sequences.
+    It runs the training graph (Decoder.decode_sequence) in inference mode, such that all target positions of a
+    batch of sentence pairs are scored in one forward pass. Sentence pairs are bucketed by source and target length
+    like training data.
+
+    :param model_folder: Folder to load model from.
+    :param context: MXNet context to bind the module to.
+    :param batch_size: Number of sentence pairs scored together.
+    :param checkpoint: Checkpoint to load. If None, finds best parameters in model_folder.
+    :param max_seq_len_source: Maximum source length. Default: value from model.
+    :param max_seq_len_target: Maximum target length as in training, i.e. including the BOS symbol.
+           Default: value from model.
+    :param bucket_width: Width of buckets on the longer side.
+    """
+
+    def __init__(self,
+                 model_folder: str,
+                 context: mx.context.Context,
+                 batch_size: int,
+                 checkpoint: Optional[int] = None,
+                 max_seq_len_source: Optional[int] = None,
+                 max_seq_len_target: Optional[int] = None,
+                 bucket_width: int = 10) -> None:
+        model_version = sockeye.utils.load_version(os.path.join(model_folder, C.VERSION_NAME))
+        sockeye.utils.check_version(model_version)
+        config = sockeye.model.SockeyeModel.load_config(os.path.join(model_folder, C.CONFIG_NAME))
+        if max_seq_len_source is not None:
+            config.max_seq_len_source = max_seq_len_source
+        if max_seq_len_target is not None:
+            config.max_seq_len_target = max_seq_len_target
+        super().__init__(config)
+        check_condition(batch_size > 0, 'The batch size must be positive.')
+        self.context = context
+        self.batch_size = batch_size
+        self.buckets = sockeye.data_io.define_parallel_buckets(self.config.max_seq_len_source,
+                                                               self.config.max_seq_len_target,
+                                                               bucket_width,
+                                                               self.config.config_data.length_ratio_mean)
+
+        self._build_model_components(fused_encoder=False)
+        fname_params = os.path.join(model_folder, C.PARAMS_NAME % checkpoint if checkpoint else C.PARAMS_BEST_NAME)
+        self.load_params_from_file(fname_params)
+
+        self.module = self._get_module()
+        default_bucket_key = sockeye.data_io.get_default_bucket_key(self.buckets)
+        self.module.bind(data_shapes=self._get_data_shapes(default_bucket_key), for_training=False, grad_req="null")
+        self.module.init_params(arg_params=self.params, allow_missing=False)
+
+    def _get_module(self) -> mx.mod.BucketingModule:
+        """
+        Returns a BucketingModule that computes the summed negative log-probabilities of the labels of each sentence
+        pair. The bucket key is the source and target length.
+
+        :return: Scoring BucketingModule.
+        """
+
+        def sym_gen(seq_lens: Tuple[int, int]):
+            source_seq_len, target_seq_len = seq_lens
+            source = mx.sym.Variable(C.SOURCE_NAME)
+            source_length = sockeye.utils.compute_lengths(source)
+            target = mx.sym.Variable(C.TARGET_NAME)
+            target_length = sockeye.utils.compute_lengths(target)
+            labels = mx.sym.reshape(data=mx.sym.Variable(C.TARGET_LABEL_NAME), shape=(-1,))
+
+            (source_encoded,
+             source_encoded_length,
+             source_encoded_seq_len) = self.encoder.encode(source, source_length, seq_len=source_seq_len)
+            source_lexicon = self.lexicon.lookup(source) if self.lexicon else None
+            # (batch_size * target_seq_len, target_vocab_size)
+            logits = self.decoder.decode_sequence(source_encoded, source_encoded_length, source_encoded_seq_len,
+                                                  target, target_length, target_seq_len, source_lexicon)
+
+            # numerically stable log-softmax of the labels: logit - max - log(sum(exp(logits - max)))
+            logits = mx.sym.broadcast_sub(logits, mx.sym.max(logits, axis=1, keepdims=True))
+            log_normalizer = mx.sym.log(mx.sym.sum(mx.sym.exp(logits), axis=1))
+            neg_logprobs = log_normalizer - mx.sym.pick(logits, labels, axis=1)
+            # padded label positions (PAD_ID == 0) do not count
+            neg_logprobs = neg_logprobs * mx.sym.clip(labels, 0, 1)
+            scores = mx.sym.sum(mx.sym.reshape(neg_logprobs, shape=(-1, target_seq_len)), axis=1)
+            return scores, [C.SOURCE_NAME, C.TARGET_NAME, C.TARGET_LABEL_NAME], []
+
+        return mx.mod.BucketingModule(sym_gen=sym_gen,
+                                      default_bucket_key=sockeye.data_io.get_default_bucket_key(self.buckets),
+                                      context=self.context)
+
+    def _get_data_shapes(self, bucket_key: Tuple[int, int]) -> List[mx.io.DataDesc]:
+        """
+        Returns data shapes of source, target and labels for a bucket key.
+
+        :param bucket_key: Source and target length.
+        :return: List of data descriptions.
+        """
+        source_seq_len, target_seq_len = bucket_key
+        return [mx.io.DataDesc(C.SOURCE_NAME, (self.batch_size, source_seq_len), layout=C.BATCH_MAJOR),
+                mx.io.DataDesc(C.TARGET_NAME, (self.batch_size, target_seq_len), layout=C.BATCH_MAJOR),
+                mx.io.DataDesc(C.TARGET_LABEL_NAME, (self.batch_size, target_seq_len), layout=C.BATCH_MAJOR)]
+
+    def run(self, source: np.ndarray, target: np.ndarray, label: np.ndarray) -> np.ndarray:
+        """
+        Returns the summed negative log-probabilities of the labels of each row.
+
+        :param source: Source ids. Shape: (batch_size, source_seq_len).
+        :param target: Target ids, starting with BOS. Shape: (batch_size, target_seq_len).
+        :param label: Target ids shifted by one, ending with EOS. Shape: (batch_size, target_seq_len).
+        :return: Negative log-probabilities. Shape: (batch_size,).
+        """
+        bucket_key = (source.shape[1], target.shape[1])
+        batch = mx.io.DataBatch(data=[mx.nd.array(source), mx.nd.array(target), mx.nd.array(label)],
+                                label=None,
+                                bucket_key=bucket_key,
+                                provide_data=self._get_data_shapes(bucket_key))
+        self.module.forward(batch, is_train=False)
+        return self.module.get_outputs()[0].asnumpy()
+
+
+class Scorer:
+    """
+    Scorer computes the negative log-probabilities of translations given their source sentences.
+    Sentence pairs are sorted into length buckets and scored in batches, and scores are returned in input order.
+
+    :param model: Scoring model.
+    :param vocab_source: Source vocabulary.
+    :param vocab_target: Target vocabulary.
+    :param length_penalty: Optional length penalty that scores are divided by. The length of a translation
+           includes the end-of-sentence symbol.
+    """
+
+    def __init__(self,
+                 model: ScoringModel,
+                 vocab_source: Dict[str, int],
+                 vocab_target: Dict[str, int],
+                 length_penalty: Optional[sockeye.inference.LengthPenalty] = None) -> None:
+        self.model = model
+        self.vocab_source = vocab_source
+        self.vocab_target = vocab_target
+        self.length_penalty = length_penalty
+        self.bos_id = self.vocab_target[C.BOS_SYMBOL]
+        self.eos_id = self.vocab_target[C.EOS_SYMBOL]
+        self.num_skipped = 0
+
+    def score(self, sources: Iterable[str], targets: Iterable[str]) -> np.ndarray:
+        """
+        Returns the negative log-probability of each target sentence given its source sentence.
+        Pairs with an empty source or that do not fit into any bucket are not scored and get a score of NaN.
+
+        :param sources: Source sentences.
+        :param targets: Target sentences, parallel to sources.
+        :return: Scores. Shape: (number of sentence pairs,).
+        """
+        buckets = self.model.buckets
+        bucket_pairs = [[] for _ in buckets]  # type: List[List[Tuple[int, List[int], List[int]]]]
+        num_pairs = 0
+        for i, (source, target) in enumerate(itertools.zip_longest(sources, targets)):
+            check_condition(source is not None and target is not None,
+                            "Number of source sentences does not match number of target sentences")
+            num_pairs += 1
+            source_ids = sockeye.data_io.tokens2ids(sockeye.data_io.get_tokens(source), self.vocab_source)
+            target_ids = [self.bos_id] + sockeye.data_io.tokens2ids(sockeye.data_io.get_tokens(target),
+                                                                   self.vocab_target)
+            bucket_index, _ = sockeye.data_io.get_parallel_bucket(buckets, len(source_ids), len(target_ids))
+            if not source_ids or bucket_index is None:
+                self.num_skipped += 1
+                continue
+            bucket_pairs[bucket_index].append((i, source_ids, target_ids))
+
+        scores = np.full((num_pairs,), np.nan, dtype='float32')
+        for (source_seq_len, target_seq_len), pairs in zip(buckets, bucket_pairs):
+            for batch_start in range(0, len(pairs), self.model.batch_size):
+                batch_pairs = pairs[batch_start:batch_start + self.model.batch_size]
+                source = np.full((self.model.batch_size, source_seq_len), C.PAD_ID, dtype='float32')
+                target = np.full((self.model.batch_size, target_seq_len), C.PAD_ID, dtype='float32')
+                label = np.full((self.model.batch_size, target_seq_len), C.PAD_ID, dtype='float32')
+                lengths = np.zeros((len(batch_pairs),), dtype='float32')
+                for j in range(self.model.batch_size):
+                    # rows filling up the batch repeat the last pair and are discarded
+                    _, source_ids, target_ids = batch_pairs[min(j, len(batch_pairs) - 1)]
+                    source[j, :len(source_ids)] = source_ids
+                    target[j, :len(target_ids)] = target_ids
+                    label[j, :len(target_ids)] = target_ids[1:] + [self.eos_id]
+                    if j < len(batch_pairs):
+                        lengths[j] = len(target_ids)
+                batch_scores = self.model.run(source, target, label)[:len(batch_pairs)]
+                if self.length_penalty is not None:
+                    batch_scores = batch_scores / self.length_penalty(mx.nd.array(lengths)).asnumpy()
+                scores[[index for index, _, _ in batch_pairs]] = batch_scores
+        return scores
+
+
+def main():
+    params = argparse.ArgumentParser(description='Score sentence pairs with a trained model (forced decoding).')
+    arguments.add_score_args(params)
+    arguments.add_device_args(params)
+    args = params.parse_args()
+
+    log_sockeye_version(logger)
+    logger.info("Command: %s", " ".join(sys.argv))
+    logger.info("Arguments: %s", args)
+
+    max_seq_len_source, max_seq_len_target = args.max_seq_len if args.max_seq_len is not None else (None, None)
+    with ExitStack() as exit_stack:
+        context = sockeye.translate.setup_context(args, exit_stack)
+        model = ScoringModel(args.model, context, args.batch_size, args.checkpoint,
+                             max_seq_len_source, max_seq_len_target, args.bucket_width)
+        vocab_source = sockeye.vocab.vocab_from_json_or_pickle(os.path.join(args.model, C.VOCAB_SRC_NAME))
+        vocab_target = sockeye.vocab.vocab_from_json_or_pickle(os.path.join(args.model, C.VOCAB_TRG_NAME))
+        length_penalty = sockeye.inference.LengthPenalty(args.length_penalty_alpha, args.length_penalty_beta) \
+            if args.normalize else None
+        scorer = Scorer(model, vocab_source, vocab_target, length_penalty)
+
+        tic = time.time()
+        with sockeye.data_io.smart_open(args.source) as sources, sockeye.data_io.smart_open(args.target) as targets:
+            scores = scorer.score(sources, targets)
+        total_time = time.time() - tic
+        output = exit_stack.enter_context(sockeye.data_io.smart_open(args.output, 'w')) \
+            if args.output is not None else sys.stdout
+        for score in scores:
+            print("%.6f" % score, file=output)
+
+    if scorer.num_skipped:
+        logger.warning("%d sentence pairs with an empty source or exceeding the maximum lengths were not scored",
+                       scorer.num_skipped)
+    logger.info("Scored %d sentence pairs in %.4fs (%.2f sent/sec)", len(scores), total_time,
+                len(scores) / total_time if total_time > 0 else 0.0)
+
+
+if __name__ == '__main__':
+    main()
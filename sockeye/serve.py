@@ -0,0 +1,368 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""
+Translation server: keeps models loaded and translates requests received over HTTP in micro-batches.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import sockeye.arguments as arguments
+import sockeye.data_io
+import sockeye.inference
+import sockeye.translate
+import sockeye.translation_cache
+import sockeye.translation_memory
+import sockeye.constants as C
+from sockeye.log import setup_main_logger, log_sockeye_version
+from sockeye.utils import check_condition
+
+logger = setup_main_logger(__name__, file_logging=False)
+
+# pending request: translator input, future of its output and arrival time
+Request = Tuple[sockeye.inference.TranslatorInput, asyncio.Future, float]
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+
+def output_to_json(trans_output: sockeye.inference.TranslatorOutput) -> Dict[str, Any]:
+    """
+    Returns a JSON serializable dictionary of a translator output.
+
+    :param trans_output: Translator output.
+    :return: Dictionary with the fields of the output. The attention matrix is a list of rows.
+    """
+    return dict(id=trans_output.id,
+                translation=trans_output.translation,
+                tokens=trans_output.tokens,
+                attention_matrix=np.asarray(trans_output.attention_matrix).tolist(),
+                score=float(trans_output.score))
+
+
+class ServerStatistics:
+    """
+    Collects number of requests, a histogram of batch sizes and the latencies of the most recent requests.
+
+    :param window: Number of most recent request latencies kept for percentiles.
+    """
+
+    def __init__(self, window: int = C.SERVE_LATENCY_WINDOW) -> None:
+        self.num_requests = 0
+        self.batch_sizes = Counter()  # type: Counter
+        self.latencies = deque(maxlen=window)  # type: deque
+
+    def add_batch(self, batch_size: int):
+        self.batch_sizes[batch_size] += 1
+
+    def add_request(self, latency: float):
+        self.num_requests += 1
+        self.latencies.append(latency)
+
+    def get_latency_percentiles(self) -> Dict[str, float]:
+        """
+        Returns the 50th, 90th and 99th percentile of recent request latencies in milliseconds.
+        """
+        if not self.latencies:
+            return {}
+        latencies = 1000.0 * np.array(self.latencies)
+        return {"p%d" % p: float(np.percentile(latencies, p)) for p in (50, 90, 99)}
+
+
+class MicroBatcher:
+    """
+    Queues translation requests per bucket of their input length and translates them in batches. A batch is
+    translated as soon as a bucket holds max_batch_size requests, or when the oldest request of a bucket has
+    waited max_wait seconds. Translation runs in a separate thread, such that requests keep being queued.
+
+    :param translator: Translator.
+    :param max_batch_size: Maximum number of requests translated at once.
+    :param max_wait: Maximum time in seconds a request waits for others to fill up its batch.
+    :param statistics: Statistics to update.
+    :param cache: Optional cache to store translation results in. Results of a batch are committed together.
+    """
+
+    def __init__(self, translator: sockeye.inference.Translator, max_batch_size: int, max_wait: float,
+                 statistics: Optional[ServerStatistics] = None,
+                 cache: Optional[sockeye.translation_cache.TranslationCache] = None) -> None:
+        check_condition(max_batch_size >= 1, "The maximum batch size must be positive.")
+        self.translator = translator
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.statistics = statistics if statistics is not None else ServerStatistics()
+        self.cache = cache
+        self.queues = {}  # type: Dict[int, List[Request]]
+        self.new_request = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(requests) for requests in self.queues.values())
+
+    def _get_bucket(self, trans_input: sockeye.inference.TranslatorInput) -> int:
+        return sockeye.data_io.get_bucket(len(trans_input.tokens), self.translator.buckets) \
+               or self.translator.buckets[-1]
+
+    def translate(self, trans_input: sockeye.inference.TranslatorInput) -> asyncio.Future:
+        """
+        Queues a translation request.
+
+        :param trans_input: Translator input.
+        :return: Future of the translator output.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.queues.setdefault(self._get_bucket(trans_input), []).append((trans_input, future, time.time()))
+        self.new_request.set()
+        return future
+
+    def _next_bucket(self) -> Tuple[int, float]:
+        """
+        Returns the bucket to translate next and how long to wait before translating it: a full bucket right away,
+        otherwise the bucket with the oldest request when it reaches the maximum wait time.
+        """
+        for bucket, requests in self.queues.items():
+            if len(requests) >= self.max_batch_size:
+                return bucket, 0.0
+        bucket = min(self.queues, key=lambda bucket: self.queues[bucket][0][2])
+        return bucket, self.queues[bucket][0][2] + self.max_wait - time.time()
+
+    async def run(self):
+        """
+        Translates queued requests in batches until cancelled.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            if not self.queues:
+                await self.new_request.wait()
+                self.new_request.clear()
+                continue
+            bucket, wait = self._next_bucket()
+            if wait > 0:
+                try:
+                    await asyncio.wait_for(self.new_request.wait(), wait)
+                    self.new_request.clear()
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            requests = self.queues[bucket]
+            batch, self.queues[bucket] = requests[:self.max_batch_size], requests[self.max_batch_size:]
+            if not self.queues[bucket]:
+                del self.queues[bucket]
+            # requests of disconnected clients are not translated
+            batch = [request for request in batch if not request[1].done()]
+            if not batch:
+                continue
+            self.statistics.add_batch(len(batch))
+            try:
+                trans_outputs = await loop.run_in_executor(self.executor, self.translator.translate_batch,
+                                                           [trans_input for trans_input, _, _ in batch])
+            except Exception as e:
+                logger.exception("Translation of a batch of %d requests failed", len(batch))
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            if self.cache is not None:
+                for (trans_input, _, _), trans_output in zip(batch, trans_outputs):
+                    self.cache.put(trans_input, trans_output)
+                self.cache.flush()
+            for (_, future, _), trans_output in zip(batch, trans_outputs):
+                if not future.done():
+                    future.set_result(trans_output)
+
+
+class TranslationServer:
+    """
+    HTTP server translating requests with a micro-batcher. Endpoints:
+
+    * POST /translate with a JSON body {"text": <sentence>} returns the translator output as JSON.
+    * GET /stats returns queue depth, batch size histogram, number of requests and latency percentiles.
+
+    :param batcher: Micro-batcher translating requests. Its cache, if any, is consulted before queueing a request.
+    :param translation_memory: Optional translation memory, consulted before queueing a request.
+    """
+
+    def __init__(self, batcher: MicroBatcher,
+                 translation_memory: Optional[sockeye.translation_memory.TranslationMemory] = None) -> None:
+        self.batcher = batcher
+        self.cache = batcher.cache
+        self.translation_memory = translation_memory
+        self.statistics = batcher.statistics
+        self.num_received = 0
+        self.batcher_task = None  # type: Optional[asyncio.Future]
+
+    async def translate(self, sentence: str) -> sockeye.inference.TranslatorOutput:
+        """
+        Translates a sentence, from the cache or translation memory if possible.
+
+        :param sentence: Input sentence.
+        :return: Translator output.
+        """
+        tic = time.time()
+        self.num_received += 1
+        trans_input = sockeye.inference.Translator.make_input(self.num_received, sentence)
+        trans_output = None  # type: Optional[sockeye.inference.TranslatorOutput]
+        if self.cache is not None:
+            trans_output = self.cache.get(trans_input)
+        if trans_output is None and self.translation_memory is not None:
+            trans_output = self.translation_memory.get(trans_input)
+        if trans_output is None:
+            trans_output = await self.batcher.translate(trans_input)
+        self.statistics.add_request(time.time() - tic)
+        return trans_output
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns server statistics as a JSON serializable dictionary.
+        """
+        stats = dict(queue_depth=self.batcher.queue_depth,
+                     requests=self.statistics.num_requests,
+                     batch_sizes={str(size): count for size, count in sorted(self.statistics.batch_sizes.items())},
+                     latency_ms=self.statistics.get_latency_percentiles())
+        if self.cache is not None:
+            stats["cache"] = dict(hits=self.cache.hits, misses=self.cache.misses)
+        if self.translation_memory is not None:
+            stats["translation_memory"] = dict(hits=self.translation_memory.hits,
+                                               misses=self.translation_memory.misses)
+        return stats
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        if path == "/stats":
+            if method != "GET":
+                return 405, {"error": "Use GET for %s" % path}
+            return 200, self.get_stats()
+        if path == "/translate":
+            if method != "POST":
+                return 405, {"error": "Use POST for %s" % path}
+            try:
+                request = json.loads(body.decode("utf-8"))
+                sentence = request["text"]
+                check_condition(isinstance(sentence, str), "text must be a string")
+            except Exception as e:
+                return 400, {"error": "Expected a JSON object with a text field: %s" % e}
+            try:
+                trans_output = await self.translate(sentence)
+            except Exception as e:
+                return 500, {"error": str(e)}
+            return 200, output_to_json(trans_output)
+        return 404, {"error": "Unknown path %s" % path}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves HTTP/1.1 requests of a connection until the client closes it.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}  # type: Dict[str, str]
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, response = await self._dispatch(method, path.split("?", 1)[0], body)
+                payload = json.dumps(response).encode("utf-8")
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" %
+                              (status, HTTP_REASONS[status], len(payload))).encode("latin-1") + payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = C.SERVE_HOST, port: int = C.SERVE_PORT,
+                    unix_socket: Optional[str] = None) -> asyncio.AbstractServer:
+        """
+        Starts serving on a TCP port or, if given, a Unix socket, and starts the micro-batcher.
+
+        :param host: Host to listen on.
+        :param port: TCP port to listen on. 0 picks a free port.
+        :param unix_socket: Optional path of a Unix socket to listen on instead.
+        :return: The asyncio server.
+        """
+        self.batcher_task = asyncio.ensure_future(self.batcher.run())
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            logger.info("Serving on %s", unix_socket)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            logger.info("Serving on %s:%d", host, server.sockets[0].getsockname()[1])
+        return server
+
+    async def stop(self, server: Optional[asyncio.AbstractServer] = None):
+        """
+        Stops serving and stops the micro-batcher. Can also be called if the server was not started.
+
+        :param server: Server returned by start(), if any.
+        """
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+        if self.batcher_task is not None:
+            self.batcher_task.cancel()
+            try:
+                await self.batcher_task
+            except asyncio.CancelledError:
+                pass
+            self.batcher_task = None
+        self.batcher.executor.shutdown()
+
+
+def main():
+    params = argparse.ArgumentParser(description='Translation server')
+    arguments.add_inference_args(params)
+    arguments.add_device_args(params)
+    arguments.add_serve_args(params)
+    args = params.parse_args()
+
+    if args.checkpoints is not None:
+        check_condition(len(args.checkpoints) == len(args.models), "must provide checkpoints for each model")
+
+    log_sockeye_version(logger)
+    logger.info("Command: %s", " ".join(sys.argv))
+    logger.info("Arguments: %s", args)
+
+    with ExitStack() as exit_stack:
+        context = sockeye.translate.setup_context(args, exit_stack)
+        translator, cache, translation_memory = sockeye.translate.load_translator(args, context, exit_stack)
+        batcher = MicroBatcher(translator, translator.batch_size, args.max_wait_ms / 1000.0, cache=cache)
+        server = TranslationServer(batcher, translation_memory)
+
+        loop = asyncio.get_event_loop()
+        http_server = loop.run_until_complete(server.start(args.host, args.port, args.unix_socket))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(server.stop(http_server))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,12 +11,13 @@
 # express or implied. See the License for the specific language governing
 # permissions and limitations under the License.
 
-from typing import Optional
+from typing import Optional, Tuple
 
 import mxnet as mx
 import numpy as np
 
 from . import config
+from . import constants as C
 from . import layers
 
 
@@ -34,7 +35,8 @@ class TransformerConfig(config.Config):
                  layer_normalization: bool,
                  weight_tying: bool,
                  positional_encodings: bool,
-                 conv_config: Optional['ConvolutionalEmbeddingConfig'] = None) -> None:  # type: ignore
+                 conv_config: Optional['ConvolutionalEmbeddingConfig'] = None,  # type: ignore
+                 max_target_length_factor: float = C.TARGET_MAX_LENGTH_FACTOR) -> None:
         super().__init__()
         self.model_size = model_size
         self.attention_heads = attention_heads
@@ -48,6 +50,8 @@ class TransformerConfig(config.Config):
         self.weight_tying = weight_tying
         self.positional_encodings = positional_encodings
         self.conv_config = conv_config
+        # maximum target length relative to the source length in incremental decoding, sizes self-attention caches
+        self.max_target_length_factor = max_target_length_factor
 
 
 class TransformerEncoderBlock:
@@ -152,6 +156,55 @@ class TransformerDecoderBlock:
                                   target_max_length)
         return target
 
+    def project_source(self,
+                       source: mx.sym.Symbol,
+                       source_max_length: int) -> Tuple[mx.sym.Symbol, mx.sym.Symbol]:
+        """
+        Returns keys and values of the source-attention. Used to compute them once per source sentence for
+        incremental decoding.
+
+        :param source: Encoded source. Shape: (batch, source_max_length, source_depth).
+        :param source_max_length: Size of source time dimension.
+        :return: Source keys and values, each of shape (batch, source_max_length, model_size).
+        """
+        return self.enc_attention.project_memory(source, source_max_length)
+
+    def decode_step(self,
+                    target: mx.sym.Symbol,
+                    positions: mx.sym.Symbol,
+                    target_max_length: int,
+                    self_keys: mx.sym.Symbol,
+                    self_values: mx.sym.Symbol,
+                    source_keys: mx.sym.Symbol,
+                    source_values: mx.sym.Symbol,
+                    source_lengths: mx.sym.Symbol,
+                    source_max_length: int) -> Tuple[mx.sym.Symbol, mx.sym.Symbol, mx.sym.Symbol]:
+        """
+        Processes a single target position, given cached self-attention keys and values of previous positions
+        and the projected source.
+
+        :param target: Input for the current position. Shape: (batch, 1, model_size).
+        :param positions: Current position for each example. Shape: (batch,).
+        :param target_max_length: Size of time dimension of the self-attention caches.
+        :param self_keys: Self-attention keys of previous positions. Shape: (batch, target_max_length, model_size).
+        :param self_values: Self-attention values of previous positions.
+                            Shape: (batch, target_max_length, model_size).
+        :param source_keys: Source-attention keys. Shape: (batch, source_max_length, model_size).
+        :param source_values: Source-attention values. Shape: (batch, source_max_length, model_size).
+        :param source_lengths: Source lengths. Shape: (batch,).
+        :param source_max_length: Size of source time dimension.
+        :return: Output for the current position (batch, 1, model_size), updated self-attention keys and values.
+        """
+        self_attention, self_keys, self_values = self.self_attention.step(target, positions, target_max_length,
+                                                                          self_keys, self_values)
+        target = self.residual_self(target, self_attention, 1)
+        target = self.residual_enc(target,
+                                   self.enc_attention.attend(target, 1, source_keys, source_values,
+                                                             source_lengths, source_max_length),
+                                   1)
+        target = self.residual_ff(target, self.feed_forward(target, 1), 1)
+        return target, self_keys, self_values
+
 
 class TransformerResidual:
     """
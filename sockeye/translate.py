@@ -15,19 +15,28 @@
 Translation CLI.
 """
 import argparse
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
 import sys
 import time
+from collections import Counter, defaultdict
 from contextlib import ExitStack
-from typing import Optional, Iterable, Tuple
+from typing import Callable, Dict, Optional, Iterable, List, Tuple
 
 import mxnet as mx
+import numpy as np
 
 import sockeye
 import sockeye.arguments as arguments
 import sockeye.constants as C
 import sockeye.data_io
 import sockeye.inference
+import sockeye.lexicon
 import sockeye.output_handler
+import sockeye.translation_cache
+import sockeye.translation_memory
 from sockeye.log import setup_main_logger, log_sockeye_version
 from sockeye.utils import acquire_gpus, get_num_gpus
 from sockeye.utils import check_condition
@@ -55,73 +64,593 @@ def main():
     output_handler = sockeye.output_handler.get_output_handler(args.output_type,
                                                                args.output,
                                                                args.sure_align_threshold)
+    if args.translation_memory is not None and output_handler.reports_attention():
+        logger.warning("Translations from the translation memory have no alignment: their attention matrices are "
+                       "all zeros.")
+
+    if args.chunk_size is None:
+        chunk_size = C.CHUNK_SIZE_NO_BATCHING if args.batch_size == 1 \
+            else C.CHUNK_SIZE_PER_BATCH_SEGMENT * args.batch_size
+    else:
+        chunk_size = args.chunk_size
+        if chunk_size < args.batch_size:
+            logger.warning("Chunk size (%d) is smaller than batch size (%d): batches will not be filled.",
+                           chunk_size, args.batch_size)
 
     with ExitStack() as exit_stack:
-        context = _setup_context(args, exit_stack)
+        if args.workers > 1:
+            check_condition(args.use_cpu, "Multiple translation workers are only supported on the CPU (--use-cpu).")
+            num_threads = args.omp_num_threads or max(1, (os.cpu_count() or 1) // args.workers)
+            worker_pool = WorkerPool(args, args.workers, num_threads, output_handler.reports_attention(),
+                                     output_handler.reports_timings())
+            exit_stack.callback(worker_pool.close)
+            read_and_translate_parallel(worker_pool, output_handler, args.input, chunk_size)
+        else:
+            context = setup_context(args, exit_stack)
+            translator, cache, translation_memory = load_translator(args, context, exit_stack,
+                                                                    output_handler.reports_attention(),
+                                                                    output_handler.reports_timings())
+            read_and_translate(translator, output_handler, args.input, chunk_size, cache, translation_memory)
+
+
+def load_translator(args: argparse.Namespace, context: mx.context.Context, exit_stack: ExitStack,
+                    return_attention: bool = True, collect_timings: bool = False) \
+        -> Tuple[sockeye.inference.Translator,
+                 Optional[sockeye.translation_cache.TranslationCache],
+                 Optional[sockeye.translation_memory.TranslationMemory]]:
+    """
+    Loads models and returns a translator, with the translation cache and translation memory given by the arguments.
+
+    :param args: Translate CLI arguments.
+    :param context: Context to load models on.
+    :param exit_stack: Exit stack closing the cache.
+    :param return_attention: Whether translator outputs include attention matrices, e.g. for alignment output.
+    :param collect_timings: Whether the translator records per-phase timings.
+    :return: Translator, optional cache and optional translation memory.
+    """
+    models, vocab_source, vocab_target = sockeye.inference.load_models(
+        context,
+        args.max_input_len,
+        args.beam_size,
+        args.models,
+        args.checkpoints,
+        args.softmax_temperature,
+        args.batch_size,
+        decoder_return_logit_inputs=args.restrict_lexicon is not None,
+        max_output_length_num_stds=args.max_output_length_num_stds,
+        decoder_return_attention=return_attention,
+        fuse_ensemble=args.fuse_ensemble,
+        ensemble_mode=args.ensemble_mode,
+        max_bound_buckets=args.max_bound_buckets,
+        mmap_params=args.mmap_params)
+    restrict_lexicon = None  # type: Optional[sockeye.lexicon.TopKLexicon]
+    if args.restrict_lexicon:
+        restrict_lexicon = sockeye.lexicon.TopKLexicon(vocab_source, vocab_target)
+        restrict_lexicon.load(args.restrict_lexicon)
+    translator = sockeye.inference.Translator(context,
+                                              args.ensemble_mode,
+                                              sockeye.inference.LengthPenalty(args.length_penalty_alpha,
+                                                                              args.length_penalty_beta),
+                                              models,
+                                              vocab_source,
+                                              vocab_target,
+                                              restrict_lexicon=restrict_lexicon,
+                                              device_topk=True if args.device_topk else None,
+                                              shrink_beam=args.shrink_beam,
+                                              segment_long_inputs=args.segment_long_inputs,
+                                              collect_timings=collect_timings)
+    if args.warm_up is not None:
+        translator.warm_up(args.warm_up)
+    cache = None  # type: Optional[sockeye.translation_cache.TranslationCache]
+    if args.cache is not None:
+        fingerprint = sockeye.translation_cache.get_fingerprint(
+            args.models, args.checkpoints,
+            dict(beam_size=args.beam_size, length_penalty_alpha=args.length_penalty_alpha,
+                 length_penalty_beta=args.length_penalty_beta, ensemble_mode=args.ensemble_mode,
+                 softmax_temperature=args.softmax_temperature, max_input_len=args.max_input_len,
+                 max_output_length_num_stds=args.max_output_length_num_stds,
+                 restrict_lexicon=args.restrict_lexicon, shrink_beam=args.shrink_beam,
+                 segment_long_inputs=args.segment_long_inputs, return_attention=return_attention))
+        cache = sockeye.translation_cache.TranslationCache(fingerprint, args.cache_size, path=args.cache or None)
+        exit_stack.callback(cache.close)
+    translation_memory = None  # type: Optional[sockeye.translation_memory.TranslationMemory]
+    if args.translation_memory is not None:
+        translation_memory = sockeye.translation_memory.TranslationMemory(args.translation_memory,
+                                                                          args.translation_memory_threshold)
+    return translator, cache, translation_memory
+
+
+class BucketStatistics:
+    """
+    Collects per-bucket statistics of batched translation: number of sentences and batches, the fraction of
+    source positions filled with actual tokens (padding efficiency), translation time, sentence latencies (the
+    time of the batch of a sentence) and output tokens.
+    """
+
+    def __init__(self) -> None:
+        self.num_sentences = defaultdict(int)  # type: Dict[int, int]
+        self.num_batches = defaultdict(int)  # type: Dict[int, int]
+        self.num_tokens = defaultdict(int)  # type: Dict[int, int]
+        self.num_positions = defaultdict(int)  # type: Dict[int, int]
+        self.num_output_tokens = defaultdict(int)  # type: Dict[int, int]
+        self.time = defaultdict(float)  # type: Dict[int, float]
+        self.latencies = defaultdict(list)  # type: Dict[int, List[float]]
+
+    def add_batch(self, bucket_key: int, num_sentences: int, num_tokens: int, num_positions: int,
+                  batch_time: float, num_output_tokens: int = 0) -> None:
+        """
+        Records a translated batch.
+
+        :param bucket_key: Bucket of the batch.
+        :param num_sentences: Number of sentences in the batch.
+        :param num_tokens: Number of source tokens in the batch.
+        :param num_positions: Number of source positions in the batch, including padding.
+        :param batch_time: Wall time taken to translate the batch.
+        :param num_output_tokens: Number of output tokens of the batch.
+        """
+        self.num_sentences[bucket_key] += num_sentences
+        self.num_batches[bucket_key] += 1
+        self.num_tokens[bucket_key] += num_tokens
+        self.num_positions[bucket_key] += num_positions
+        self.num_output_tokens[bucket_key] += num_output_tokens
+        self.time[bucket_key] += batch_time
+        self.latencies[bucket_key].extend([batch_time] * num_sentences)
 
-        translator = sockeye.inference.Translator(context,
-                                                  args.ensemble_mode,
-                                                  sockeye.inference.LengthPenalty(args.length_penalty_alpha,
-                                                                                  args.length_penalty_beta),
-                                                  *sockeye.inference.load_models(context,
-                                                                                 args.max_input_len,
-                                                                                 args.beam_size,
-                                                                                 args.models,
-                                                                                 args.checkpoints,
-                                                                                 args.softmax_temperature))
-        read_and_translate(translator, output_handler, args.input)
+    def merge(self, other: 'BucketStatistics') -> None:
+        """
+        Adds the statistics of other, e.g. those collected by a translation worker.
+
+        :param other: Statistics to add.
+        """
+        for bucket_key in other.num_sentences:
+            self.num_sentences[bucket_key] += other.num_sentences[bucket_key]
+            self.num_batches[bucket_key] += other.num_batches[bucket_key]
+            self.num_tokens[bucket_key] += other.num_tokens[bucket_key]
+            self.num_positions[bucket_key] += other.num_positions[bucket_key]
+            self.num_output_tokens[bucket_key] += other.num_output_tokens[bucket_key]
+            self.time[bucket_key] += other.time[bucket_key]
+            self.latencies[bucket_key].extend(other.latencies[bucket_key])
+
+    def log(self) -> None:
+        """
+        Logs statistics for each bucket.
+        """
+        for bucket_key in sorted(self.num_sentences):
+            p50, p90, p99 = np.percentile(self.latencies[bucket_key], [50, 90, 99])
+            bucket_time = self.time[bucket_key]
+            logger.info("Bucket %d: sentences: %d batches: %d padding efficiency: %.2f%% sent/sec: %.4f "
+                        "tokens/sec: %.1f latency p50: %.4f p90: %.4f p99: %.4f",
+                        bucket_key, self.num_sentences[bucket_key], self.num_batches[bucket_key],
+                        100.0 * self.num_tokens[bucket_key] / self.num_positions[bucket_key],
+                        self.num_sentences[bucket_key] / bucket_time if bucket_time > 0 else 0.0,
+                        self.num_output_tokens[bucket_key] / bucket_time if bucket_time > 0 else 0.0,
+                        p50, p90, p99)
 
 
 def read_and_translate(translator: sockeye.inference.Translator, output_handler: sockeye.output_handler.OutputHandler,
-                       source: Optional[str] = None) -> None:
+                       source: Optional[str] = None, chunk_size: int = C.CHUNK_SIZE_NO_BATCHING,
+                       cache: Optional[sockeye.translation_cache.TranslationCache] = None,
+                       translation_memory: Optional[sockeye.translation_memory.TranslationMemory] = None) -> None:
     """
     Reads from either a file or stdin and translates each line, calling the output_handler with the result.
 
     :param output_handler: Handler that will write output to a stream.
     :param translator: Translator that will translate each line of input.
     :param source: Path to file which will be translated line-by-line if included, if none use stdin.
+    :param chunk_size: Number of lines to read, sort by length and translate at once.
+    :param cache: Optional cache of translation results.
+    :param translation_memory: Optional translation memory to retrieve translations of near-duplicate inputs from.
     """
 
     source_data = sys.stdin if source is None else sockeye.data_io.smart_open(source)
 
     logger.info("Translating...")
 
-    i, total_time = translate_lines(output_handler, source_data, translator)
+    bucket_statistics = BucketStatistics()
+    i, total_time = translate_lines(output_handler, source_data, translator, chunk_size, bucket_statistics, cache,
+                                    translation_memory)
 
     if i != 0:
-        logger.info("Processed %d lines. Total time: %.4f sec/sent: %.4f sent/sec: %.4f", i, total_time,
-                    total_time / i, i / total_time)
+        bucket_statistics.log()
+        logger.info("Processed %d lines. Total time: %.4f sec/sent: %.4f sent/sec: %.4f%s%s", i, total_time,
+                    total_time / i, i / total_time,
+                    "" if cache is None else " cache hits: %d misses: %d" % (cache.hits, cache.misses),
+                    "" if translation_memory is None else " translation memory hits: %d misses: %d" % (
+                        translation_memory.hits, translation_memory.misses))
     else:
         logger.info("Processed 0 lines.")
 
 
 def translate_lines(output_handler: sockeye.output_handler.OutputHandler, source_data: Iterable[str],
-                    translator: sockeye.inference.Translator) -> Tuple[int, float]:
+                    translator: sockeye.inference.Translator, chunk_size: int = C.CHUNK_SIZE_NO_BATCHING,
+                    bucket_statistics: Optional[BucketStatistics] = None,
+                    cache: Optional[sockeye.translation_cache.TranslationCache] = None,
+                    translation_memory: Optional[sockeye.translation_memory.TranslationMemory] = None
+                    ) -> Tuple[int, float]:
     """
-    Translates each line from source_data, calling output handler for each result.
+    Translates each line from source_data in chunks of chunk_size lines, calling output handler for each result
+    in the original order.
 
     :param output_handler: A handler that will be called once with the output of each translation.
     :param source_data: A enumerable list of source sentences that will be translated.
     :param translator: The translator that will be used for each line of input.
+    :param chunk_size: Number of lines to read, sort by length and translate at once.
+    :param bucket_statistics: Optional per-bucket statistics to update.
+    :param cache: Optional cache of translation results.
+    :param translation_memory: Optional translation memory to retrieve translations of near-duplicate inputs from.
     :return: The number of lines translated, and the total time taken.
     """
 
     i = 0
     total_time = 0.0
-    for i, line in enumerate(source_data, 1):
+    source_data = iter(source_data)
+    while True:
+        chunk = list(itertools.islice(source_data, chunk_size))
+        if not chunk:
+            break
+        trans_inputs = [translator.make_input(sentence_id, line) for sentence_id, line in enumerate(chunk, i + 1)]
+        i += len(chunk)
+        total_time += translate_chunk(output_handler, trans_inputs, translator, bucket_statistics, cache,
+                                      translation_memory)
+    return i, total_time
+
+
+def translate_chunk(output_handler: sockeye.output_handler.OutputHandler,
+                    trans_inputs: List[sockeye.inference.TranslatorInput],
+                    translator: sockeye.inference.Translator,
+                    bucket_statistics: Optional[BucketStatistics] = None,
+                    cache: Optional[sockeye.translation_cache.TranslationCache] = None,
+                    translation_memory: Optional[sockeye.translation_memory.TranslationMemory] = None) -> float:
+    """
+    Sorts a chunk of inputs by length, translates them in batches of translator.batch_size and calls the
+    output handler for each result in the original order. Each sentence is reported with the wall time
+    of its batch divided by the batch size.
+    With a cache, cached inputs are not translated again and inputs repeated within the chunk are translated once.
+    With a translation memory, inputs matching a stored source are not translated but take the stored translation.
+
+    :param output_handler: A handler that will be called once with the output of each translation.
+    :param trans_inputs: Inputs to translate.
+    :param translator: The translator that will be used for each input.
+    :param bucket_statistics: Optional per-bucket statistics to update.
+    :param cache: Optional cache of translation results.
+    :param translation_memory: Optional translation memory to retrieve translations of near-duplicate inputs from.
+    :return: Total time taken.
+    """
+    trans_outputs = [None] * len(trans_inputs)  # type: List[Optional[sockeye.inference.TranslatorOutput]]
+    wall_times = [0.0] * len(trans_inputs)
+    timings = [None] * len(trans_inputs)  # type: List[Optional[sockeye.inference.TranslatorTimings]]
+    total_time = 0.0
+    # indices of inputs to translate and, for repeated inputs, of their first occurrence in the chunk
+    translate_indices = list(range(len(trans_inputs)))
+    repeat_indices = {}  # type: Dict[int, int]
+    if cache is not None or translation_memory is not None:
         tic = time.time()
-        trans_input = translator.make_input(i, line)
-        logger.debug(" IN: %s", trans_input)
-        trans_output = translator.translate(trans_input)
-        trans_wall_time = time.time() - tic
-        total_time += trans_wall_time
+        translate_indices = []
+        first_indices = {}  # type: Dict[Tuple[str, ...], int]
+        for idx, trans_input in enumerate(trans_inputs):
+            tokens = tuple(trans_input.tokens)
+            if tokens in first_indices:
+                repeat_indices[idx] = first_indices[tokens]
+                continue
+            if cache is not None:
+                trans_outputs[idx] = cache.get(trans_input)
+            if trans_outputs[idx] is None and translation_memory is not None:
+                trans_outputs[idx] = translation_memory.get(trans_input)
+            if trans_outputs[idx] is None:
+                first_indices[tokens] = idx
+                translate_indices.append(idx)
+        total_time += time.time() - tic
+
+    # sort by length such that each batch falls into a single bucket with little padding
+    order = sorted(translate_indices, key=lambda idx: len(trans_inputs[idx].tokens))
+    for batch_start in range(0, len(order), translator.batch_size):
+        batch_indices = order[batch_start:batch_start + translator.batch_size]
+        batch_inputs = [trans_inputs[idx] for idx in batch_indices]
+        for trans_input in batch_inputs:
+            logger.debug(" IN: %s", trans_input)
+        tic = time.time()
+        batch_outputs = translator.translate_batch(batch_inputs)
+        batch_time = time.time() - tic
+        total_time += batch_time
+        batch_timings = translator.last_timings if translator.collect_timings else [None] * len(batch_indices)
+        for idx, trans_output, trans_timings in zip(batch_indices, batch_outputs, batch_timings):
+            trans_outputs[idx] = trans_output
+            wall_times[idx] = batch_time / len(batch_indices)
+            timings[idx] = trans_timings
+
+        if bucket_statistics is not None:
+            max_length = max(len(trans_input.tokens) for trans_input in batch_inputs)
+            if max_length > 0:
+                bucket_key = sockeye.data_io.get_bucket(max_length, translator.buckets) or translator.buckets[-1]
+                bucket_statistics.add_batch(bucket_key,
+                                            num_sentences=len(batch_inputs),
+                                            num_tokens=sum(min(len(trans_input.tokens), bucket_key)
+                                                           for trans_input in batch_inputs),
+                                            num_positions=translator.batch_size * bucket_key,
+                                            batch_time=batch_time,
+                                            num_output_tokens=sum(len(trans_output.tokens)
+                                                                  for trans_output in batch_outputs))
+
+    if cache is not None:
+        for idx in translate_indices:
+            cache.put(trans_inputs[idx], trans_outputs[idx])
+        cache.flush()
+    for idx, first_idx in repeat_indices.items():
+        trans_outputs[idx] = trans_outputs[first_idx]._replace(id=trans_inputs[idx].id)
+
+    for trans_input, trans_output, trans_wall_time, trans_timings in zip(trans_inputs, trans_outputs, wall_times,
+                                                                          timings):
         logger.debug("OUT: %s", trans_output)
         logger.debug("OUT: time=%.2f", trans_wall_time)
-        output_handler.handle(trans_input, trans_output, trans_wall_time)
-    return i, total_time
+        output_handler.handle(trans_input, trans_output, trans_wall_time, trans_timings)
+    return total_time
+
+
+# outputs, wall times and per-phase timings of the inputs of a chunk
+_ChunkResults = List[Tuple[sockeye.inference.TranslatorOutput, float, Optional[sockeye.inference.TranslatorTimings]]]
+
+
+class _CollectingOutputHandler(sockeye.output_handler.OutputHandler):
+    """
+    Output handler that keeps translator outputs, wall times and timings in memory.
+    """
+
+    def __init__(self) -> None:
+        self.results = []  # type: _ChunkResults
+
+    def handle(self,
+               t_input: sockeye.inference.TranslatorInput,
+               t_output: sockeye.inference.TranslatorOutput,
+               t_walltime: float = 0.,
+               t_timings: Optional[sockeye.inference.TranslatorTimings] = None):
+        self.results.append((t_output, t_walltime, t_timings))
+
+
+def _get_lookup_counts(cache: Optional[sockeye.translation_cache.TranslationCache],
+                       translation_memory: Optional[sockeye.translation_memory.TranslationMemory]) -> Counter:
+    """
+    Returns the numbers of hits and misses of a cache and a translation memory.
+    """
+    counts = Counter()  # type: Counter
+    if cache is not None:
+        counts.update(cache_hits=cache.hits, cache_misses=cache.misses)
+    if translation_memory is not None:
+        counts.update(tm_hits=translation_memory.hits, tm_misses=translation_memory.misses)
+    return counts
+
+
+def _translate_worker(args: argparse.Namespace, worker_id: int, input_queue: multiprocessing.Queue,
+                      result_conn: multiprocessing.connection.Connection, return_attention: bool,
+                      collect_timings: bool):
+    """
+    Main function of a worker process: loads models on the CPU and translates chunks of inputs from input_queue until
+    it receives None. Sends a (worker_id, None, None, 0.0, None, None, None) message over result_conn once models are
+    loaded and a (worker_id, chunk_id, results, translation time, error, lookup counts, bucket statistics) message for
+    each chunk, where results is a list of outputs, wall times and timings (None unless collect_timings), error is
+    None on success, or a description of the exception, lookup counts are the cache and translation memory hits and
+    misses of the chunk (see _get_lookup_counts) and bucket statistics are the BucketStatistics of the chunk.
+    """
+    with ExitStack() as exit_stack:
+        translator, cache, translation_memory = load_translator(args, mx.cpu(), exit_stack, return_attention,
+                                                                collect_timings)
+        result_conn.send((worker_id, None, None, 0.0, None, None, None))
+        while True:
+            item = input_queue.get()
+            if item is None:
+                break
+            chunk_id, trans_inputs = item
+            output_handler = _CollectingOutputHandler()
+            bucket_statistics = BucketStatistics()
+            lookup_counts = _get_lookup_counts(cache, translation_memory)
+            try:
+                chunk_time = translate_chunk(output_handler, trans_inputs, translator, bucket_statistics, cache,
+                                             translation_memory)
+            except Exception as e:
+                logger.exception("Worker %d failed to translate chunk %d", worker_id, chunk_id)
+                result_conn.send((worker_id, chunk_id, None, 0.0, repr(e), None, None))
+                continue
+            lookup_counts = _get_lookup_counts(cache, translation_memory) - lookup_counts
+            result_conn.send((worker_id, chunk_id, output_handler.results, chunk_time, None, lookup_counts,
+                              bucket_statistics))
+
+
+class WorkerPool:
+    """
+    Pool of worker processes that translate chunks of input on the CPU, each with its own models and num_threads
+    OpenMP threads. Chunks are sent to idle workers and results are written in input order. The chunk of a worker
+    that dies or fails is sent to another worker. When the oldest unwritten chunk holds up output, idle workers
+    translate it as well and the first result is used, such that a slow worker does not stall the others.
+    Cache and translation memory hits and misses of the used results are summed up in lookup_counts, and their
+    per-bucket statistics in bucket_statistics.
+    Each worker sends its results over its own pipe, such that a worker that dies while sending cannot block the
+    others.
+
+    :param args: Translate CLI arguments.
+    :param num_workers: Number of worker processes.
+    :param num_threads: Number of OpenMP threads of each worker process.
+    :param return_attention: Whether translator outputs include attention matrices.
+    :param collect_timings: Whether workers record per-phase timings, which are passed to the output handler.
+    :param worker_main: Main function of worker processes, with the signature and protocol of _translate_worker.
+    """
+
+    def __init__(self, args: argparse.Namespace, num_workers: int, num_threads: int, return_attention: bool = True,
+                 collect_timings: bool = False, worker_main: Callable = _translate_worker) -> None:
+        # forking a process that has initialized the MXNet engine is unsafe
+        mp_context = multiprocessing.get_context("spawn")
+        self.input_queues = [mp_context.Queue() for _ in range(num_workers)]
+        pipes = [mp_context.Pipe(duplex=False) for _ in range(num_workers)]
+        self.result_conns = [receive_conn for receive_conn, _ in pipes]
+        self.processes = [mp_context.Process(target=worker_main,
+                                             args=(args, worker_id, input_queue, send_conn, return_attention,
+                                                   collect_timings),
+                                             daemon=True)
+                          for worker_id, (input_queue, (_, send_conn)) in enumerate(zip(self.input_queues, pipes))]
+        self.max_buffered_chunks = C.TRANSLATE_BUFFERED_CHUNKS_PER_WORKER * num_workers
+        self.lookup_counts = Counter()  # type: Counter
+        self.bucket_statistics = BucketStatistics()
+        # spawned processes read the thread count from their environment when importing MXNet
+        omp_num_threads = os.environ.get(C.OMP_NUM_THREADS)
+        os.environ[C.OMP_NUM_THREADS] = str(num_threads)
+        try:
+            for process in self.processes:
+                process.start()
+        finally:
+            if omp_num_threads is None:
+                del os.environ[C.OMP_NUM_THREADS]
+            else:
+                os.environ[C.OMP_NUM_THREADS] = omp_num_threads
+        # the send ends now belong to the workers; the receive end of a dead worker's pipe reaches end of file
+        for _, send_conn in pipes:
+            send_conn.close()
+        logger.info("Started %d translation workers with %d threads each", num_workers, num_threads)
+
+        num_ready = 0
+        while num_ready < len(self._alive_workers()):
+            num_ready += len(self._receive(timeout=C.TRANSLATE_WORKER_POLL_INTERVAL))
+        check_condition(num_ready > 0, "No translation worker could load the models.")
+        if num_ready < num_workers:
+            logger.error("%d of %d translation workers failed to load the models", num_workers - num_ready,
+                         num_workers)
+
+    def _alive_workers(self) -> List[int]:
+        return [worker_id for worker_id, process in enumerate(self.processes) if process.is_alive()]
+
+    def _receive(self, timeout: float) -> List[Tuple]:
+        """
+        Waits up to timeout seconds for messages from the workers and returns all complete ones. Pipes of workers
+        that exited are closed and no longer waited on.
+        """
+        messages = []
+        for conn in multiprocessing.connection.wait(self.result_conns, timeout=timeout):
+            try:
+                messages.append(conn.recv())
+            except (EOFError, OSError):
+                conn.close()
+                self.result_conns.remove(conn)
+        return messages
+
+    def translate_lines(self, output_handler: sockeye.output_handler.OutputHandler,
+                        source_data: Iterable[str], chunk_size: int) -> Tuple[int, float]:
+        """
+        Translates each line from source_data in chunks of chunk_size lines, calling the output handler for each
+        result in the original order.
+
+        :param output_handler: A handler that will be called once with the output of each translation.
+        :param source_data: Source sentences.
+        :param chunk_size: Number of lines sent to a worker at once.
+        :return: The number of lines translated, and the wall time taken.
+        """
+        tic = time.time()
+        source_data = iter(source_data)
+        chunks = {}  # type: Dict[int, List[sockeye.inference.TranslatorInput]]  # chunks not yet written
+        results = {}  # type: Dict[int, _ChunkResults]
+        assigned = {}  # type: Dict[int, int]  # worker id -> chunk id
+        failures = defaultdict(int)  # type: Dict[int, int]
+        num_chunks, num_written, num_lines = 0, 0, 0
+        exhausted = False
+        while not exhausted or num_written < num_chunks:
+            for worker_id in self._alive_workers():
+                if worker_id in assigned:
+                    continue
+                unfinished = [chunk_id for chunk_id in sorted(chunks) if chunk_id not in results]
+                orphaned = [chunk_id for chunk_id in unfinished if chunk_id not in assigned.values()]
+                if orphaned:
+                    chunk_id = orphaned[0]
+                elif not exhausted and num_chunks - num_written < self.max_buffered_chunks:
+                    lines = list(itertools.islice(source_data, chunk_size))
+                    if not lines:
+                        exhausted = True
+                        continue
+                    chunk_id = num_chunks
+                    chunks[chunk_id] = [sockeye.inference.Translator.make_input(sentence_id, line)
+                                        for sentence_id, line in enumerate(lines, num_lines + 1)]
+                    num_chunks += 1
+                    num_lines += len(lines)
+                elif unfinished:
+                    chunk_id = unfinished[0]
+                else:
+                    continue
+                assigned[worker_id] = chunk_id
+                self.input_queues[worker_id].put((chunk_id, chunks[chunk_id]))
+            if exhausted and num_written == num_chunks:
+                break
+
+            messages = self._receive(timeout=C.TRANSLATE_WORKER_POLL_INTERVAL)
+            alive_workers = self._alive_workers()
+            check_condition(len(alive_workers) > 0, "All translation workers died.")
+            for worker_id in [worker_id for worker_id in assigned if worker_id not in alive_workers]:
+                logger.error("Translation worker %d died while translating chunk %d", worker_id,
+                             assigned.pop(worker_id))
+            for worker_id, chunk_id, chunk_results, _, error, lookup_counts, bucket_statistics in messages:
+                if assigned.get(worker_id) == chunk_id:
+                    del assigned[worker_id]
+                if chunk_id not in chunks or chunk_id in results:
+                    # a copy of a chunk that was already translated by another worker
+                    if error is not None:
+                        logger.warning("Ignoring failure of worker %d on already translated chunk %d: %s",
+                                       worker_id, chunk_id, error)
+                    continue
+                if error is not None:
+                    failures[chunk_id] += 1
+                    check_condition(failures[chunk_id] < C.TRANSLATE_MAX_CHUNK_FAILURES,
+                                    "Translation of chunk %d failed: %s" % (chunk_id, error))
+                else:
+                    results[chunk_id] = chunk_results
+                    self.lookup_counts.update(lookup_counts)
+                    self.bucket_statistics.merge(bucket_statistics)
+
+            while num_written in results:
+                for trans_input, (trans_output, wall_time, timings) in zip(chunks.pop(num_written),
+                                                                           results.pop(num_written)):
+                    output_handler.handle(trans_input, trans_output, wall_time, timings)
+                num_written += 1
+        return num_lines, time.time() - tic
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        for input_queue in self.input_queues:
+            input_queue.put(None)
+        for process in self.processes:
+            process.join(timeout=C.TRANSLATE_WORKER_POLL_INTERVAL)
+            if process.is_alive():
+                process.terminate()
+        for conn in self.result_conns:
+            conn.close()
+
+
+def read_and_translate_parallel(worker_pool: WorkerPool, output_handler: sockeye.output_handler.OutputHandler,
+                                source: Optional[str] = None, chunk_size: int = C.CHUNK_SIZE_NO_BATCHING) -> None:
+    """
+    Reads from either a file or stdin and translates each line with a pool of worker processes, calling the
+    output_handler with the results in input order.
+
+    :param worker_pool: Pool of translation worker processes.
+    :param output_handler: Handler that will write output to a stream.
+    :param source: Path to file which will be translated line-by-line if included, if none use stdin.
+    :param chunk_size: Number of lines sent to a worker at once.
+    """
+    source_data = sys.stdin if source is None else sockeye.data_io.smart_open(source)
+
+    logger.info("Translating with %d workers...", len(worker_pool.processes))
+
+    i, total_time = worker_pool.translate_lines(output_handler, source_data, chunk_size)
+
+    if i != 0:
+        worker_pool.bucket_statistics.log()
+        counts = worker_pool.lookup_counts
+        logger.info("Processed %d lines. Total time: %.4f sec/sent: %.4f sent/sec: %.4f%s%s", i, total_time,
+                    total_time / i, i / total_time,
+                    "" if "cache_hits" not in counts and "cache_misses" not in counts else
+                    " cache hits: %d misses: %d" % (counts["cache_hits"], counts["cache_misses"]),
+                    "" if "tm_hits" not in counts and "tm_misses" not in counts else
+                    " translation memory hits: %d misses: %d" % (counts["tm_hits"], counts["tm_misses"]))
+    else:
+        logger.info("Processed 0 lines.")
 
 
-def _setup_context(args, exit_stack):
+def setup_context(args, exit_stack):
     if args.use_cpu:
         context = mx.cpu()
     else:
@@ -0,0 +1,151 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""
+Cache of translation results for repeated inputs.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import sockeye.constants as C
+import sockeye.inference
+from sockeye.utils import check_condition
+
+logger = logging.getLogger(__name__)
+
+
+def get_fingerprint(model_folders: List[str],
+                    checkpoints: Optional[List[Optional[int]]],
+                    settings: Dict[str, object]) -> str:
+    """
+    Returns a fingerprint of the models and decoding settings that determine translation results.
+    Models are identified by their folder and the size and modification time of the used parameter file,
+    such that re-trained models do not share cache entries.
+
+    :param model_folders: Model folders.
+    :param checkpoints: Checkpoint of each model. None for the best checkpoint.
+    :param settings: Decoding settings, e.g. beam size, length penalty and ensemble mode.
+    :return: Hexadecimal fingerprint.
+    """
+    if checkpoints is None:
+        checkpoints = [None] * len(model_folders)
+    fingerprint = hashlib.sha1()
+    for model_folder, checkpoint in zip(model_folders, checkpoints):
+        fname_params = os.path.join(model_folder, C.PARAMS_NAME % checkpoint if checkpoint else C.PARAMS_BEST_NAME)
+        stat = os.stat(fname_params)
+        fingerprint.update(("%s:%s:%d:%d;" % (os.path.abspath(model_folder), checkpoint, stat.st_size,
+                                              stat.st_mtime_ns)).encode("utf-8"))
+    for name, value in sorted(settings.items()):
+        fingerprint.update(("%s=%r;" % (name, value)).encode("utf-8"))
+    return fingerprint.hexdigest()
+
+
+class TranslationCache:
+    """
+    Caches translation results keyed by the source tokens of an input and a fingerprint of the models and decoding
+    settings (see get_fingerprint). At most max_size results are kept in memory, evicting the least recently used
+    one. If a path is given, results are also stored in an sqlite database that persists across runs. The database
+    can be shared by several processes, e.g. translation workers: it uses write-ahead logging, such that readers do
+    not block the writer, and waits up to C.TRANSLATION_CACHE_TIMEOUT seconds for locks held by other processes.
+
+    :param fingerprint: Fingerprint of models and decoding settings.
+    :param max_size: Maximum number of results kept in memory.
+    :param path: Optional path of an sqlite database to persist results in.
+    """
+
+    def __init__(self, fingerprint: str, max_size: int = C.TRANSLATION_CACHE_SIZE, path: Optional[str] = None) -> None:
+        check_condition(max_size > 0, "The translation cache size must be positive.")
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()  # cache key -> pickled output, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.db = None  # type: Optional[sqlite3.Connection]
+        if path is not None:
+            self.db = sqlite3.connect(path, timeout=C.TRANSLATION_CACHE_TIMEOUT)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, output BLOB)")
+            logger.info("Translation cache: %s", path)
+
+    def _get_key(self, trans_input: sockeye.inference.TranslatorInput) -> str:
+        """
+        Returns the cache key of an input: the fingerprint and the input's tokens separated by single spaces.
+        """
+        return "%s %s" % (self.fingerprint, C.TOKEN_SEPARATOR.join(trans_input.tokens))
+
+    def get(self, trans_input: sockeye.inference.TranslatorInput) -> Optional[sockeye.inference.TranslatorOutput]:
+        """
+        Returns the cached translation result of an input, with the input's id, or None if it is not cached.
+
+        :param trans_input: Translator input.
+        :return: Cached translator output or None.
+        """
+        key = self._get_key(trans_input)
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        elif self.db is not None:
+            row = self.db.execute("SELECT output FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = row[0]
+                self._add(key, value)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return sockeye.inference.TranslatorOutput(trans_input.id, *pickle.loads(value))
+
+    def put(self, trans_input: sockeye.inference.TranslatorInput, trans_output: sockeye.inference.TranslatorOutput):
+        """
+        Caches the translation result of an input.
+
+        :param trans_input: Translator input.
+        :param trans_output: Translator output.
+        """
+        key = self._get_key(trans_input)
+        # the output id is the id of the input it is retrieved for
+        value = pickle.dumps(tuple(trans_output[1:]), protocol=pickle.HIGHEST_PROTOCOL)
+        self._add(key, value)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO translations VALUES (?, ?)", (key, value))
+
+    def _add(self, key: str, value: bytes):
+        """
+        Adds an entry to the in-memory cache, evicting the least recently used entry if the cache is full.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def flush(self):
+        """
+        Commits results to the persistent database, if any.
+        """
+        if self.db is not None:
+            self.db.commit()
+
+    def close(self):
+        """
+        Commits results and closes the persistent database, if any.
+        """
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
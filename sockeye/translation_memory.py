@@ -0,0 +1,361 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""
+Fuzzy-match translation memory: retrieves stored translations of inputs that are equal or nearly equal to
+previously translated sources.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import zlib
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+import sockeye.constants as C
+import sockeye.inference
+from sockeye import arguments
+from sockeye import data_io
+from sockeye.log import setup_main_logger, log_sockeye_version
+from sockeye.utils import check_condition
+
+logger = logging.getLogger(__name__)
+
+
+def get_ngram_hashes(tokens: Sequence[str], ngram_order: int) -> np.ndarray:
+    """
+    Returns the sorted unique hashes of the n-grams of a token sequence padded with sentence boundary symbols,
+    such that sequences shorter than the n-gram order also have n-grams.
+
+    :param tokens: Token sequence.
+    :param ngram_order: N-gram order.
+    :return: Unique n-gram hashes. Shape: (num_ngrams,).
+    """
+    padded = [C.BOS_SYMBOL] + list(tokens) + [C.EOS_SYMBOL]
+    ngrams = {C.TOKEN_SEPARATOR.join(padded[i:i + ngram_order])
+              for i in range(max(1, len(padded) - ngram_order + 1))}
+    return np.unique(np.array([zlib.crc32(ngram.encode("utf-8")) for ngram in ngrams], dtype=np.uint32))
+
+
+def get_source_hash(source: str) -> int:
+    """
+    Returns the hash of a source sentence for exact-match lookup.
+
+    :param source: Source tokens separated by single spaces.
+    :return: Hash.
+    """
+    return zlib.crc32(source.encode("utf-8"))
+
+
+def edit_distance(a: Sequence[str], b: Sequence[str]) -> int:
+    """
+    Returns the token-level Levenshtein distance between two sequences.
+
+    :param a: First token sequence.
+    :param b: Second token sequence.
+    :return: Minimum number of token insertions, deletions and substitutions transforming a into b.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, token_a in enumerate(a, 1):
+        current = [i]
+        for j, token_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (token_a != token_b)))
+        previous = current
+    return previous[-1]
+
+
+def fuzzy_match_score(a: Sequence[str], b: Sequence[str]) -> float:
+    """
+    Returns the fuzzy-match score of two token sequences: one minus their edit distance normalized by the
+    length of the longer sequence. Equal sequences score 1.0.
+
+    :param a: First token sequence.
+    :param b: Second token sequence.
+    :return: Fuzzy-match score in [0, 1].
+    """
+    max_len = max(len(a), len(b))
+    if max_len == 0:
+        return 1.0
+    return 1.0 - edit_distance(a, b) / max_len
+
+
+def build(source_lines: Iterable[str], target_lines: Iterable[str], output_folder: str,
+          ngram_order: int = C.TM_NGRAM_ORDER):
+    """
+    Builds a translation memory from parallel source and translation lines and saves it to output_folder.
+    Of several lines with the same source tokens, only the first is stored.
+    The index consists of numpy arrays that are memory-mapped when loading, such that processes using the same
+    translation memory share its pages:
+    the sorted unique n-gram hashes, offsets into the postings of each n-gram, the postings (ids of the segments
+    containing the n-gram), the sorted hashes of all sources with their segment ids for exact matches, the number of
+    source tokens of each segment, and the utf-8 encoded source and target text of all segments with their offsets.
+
+    :param source_lines: Source sentences.
+    :param target_lines: Translations of the source sentences.
+    :param output_folder: Folder to write the translation memory to.
+    :param ngram_order: N-gram order of the index.
+    """
+    check_condition(ngram_order >= 1, "The n-gram order must be positive.")
+    hashes = []  # type: List[np.ndarray]
+    lengths = []  # type: List[int]
+    text = []  # type: List[bytes]
+    text_offsets = [0]
+    sources = set()  # type: Set[str]
+    source_hashes = []  # type: List[int]
+    num_segments = 0
+    num_duplicates = 0
+    for source, target in itertools.zip_longest(source_lines, target_lines):
+        check_condition(source is not None and target is not None,
+                        "Source and target of the translation memory differ in number of lines.")
+        source_tokens = list(data_io.get_tokens(source))
+        target_tokens = list(data_io.get_tokens(target))
+        source = C.TOKEN_SEPARATOR.join(source_tokens)
+        if source in sources:
+            num_duplicates += 1
+            continue
+        sources.add(source)
+        source_hashes.append(get_source_hash(source))
+        for tokens in (source_tokens, target_tokens):
+            text.append(C.TOKEN_SEPARATOR.join(tokens).encode("utf-8"))
+            text_offsets.append(text_offsets[-1] + len(text[-1]))
+        hashes.append(get_ngram_hashes(source_tokens, ngram_order))
+        lengths.append(len(source_tokens))
+        num_segments += 1
+    check_condition(num_segments > 0, "The translation memory is empty.")
+
+    segment_ids = np.repeat(np.arange(num_segments, dtype=np.int32), [len(h) for h in hashes])
+    hashes = np.concatenate(hashes)
+    order = np.lexsort((segment_ids, hashes))
+    hashes, postings = hashes[order], segment_ids[order]
+    ngrams, starts = np.unique(hashes, return_index=True)
+    offsets = np.append(starts, len(postings)).astype(np.int64)
+    source_hashes = np.array(source_hashes, dtype=np.uint32)
+    source_ids = np.argsort(source_hashes, kind='mergesort').astype(np.int32)
+
+    os.makedirs(output_folder, exist_ok=True)
+    arrays = {C.TM_NGRAMS_NAME: ngrams,
+              C.TM_OFFSETS_NAME: offsets,
+              C.TM_POSTINGS_NAME: postings,
+              C.TM_SOURCE_HASHES_NAME: source_hashes[source_ids],
+              C.TM_SOURCE_IDS_NAME: source_ids,
+              C.TM_LENGTHS_NAME: np.array(lengths, dtype=np.int32),
+              C.TM_TEXT_NAME: np.frombuffer(b"".join(text), dtype=np.uint8),
+              C.TM_TEXT_OFFSETS_NAME: np.array(text_offsets, dtype=np.int64)}
+    for name, array in arrays.items():
+        np.save(os.path.join(output_folder, name), array)
+    with open(os.path.join(output_folder, C.TM_CONFIG_NAME), "w") as out:
+        json.dump({"ngram_order": ngram_order, "num_segments": num_segments}, out)
+    logger.info("Created translation memory with %d segments (%d duplicate sources skipped) and %d distinct %d-grams "
+                "in %s", num_segments, num_duplicates, len(ngrams), ngram_order, output_folder)
+
+
+class TranslationMemory:
+    """
+    Memory-mapped translation memory created by build(). Retrieves the stored translation of the most similar
+    stored source whose fuzzy-match score (see fuzzy_match_score) with an input is at least threshold.
+    An equal stored source is found by its hash. Otherwise, candidates are the max_candidates stored sources
+    sharing most n-grams with the input. N-grams contained in more than max_postings stored sources are ignored for
+    candidate retrieval, bounding lookup time as the translation memory grows.
+
+    :param folder: Folder of the translation memory.
+    :param threshold: Minimum fuzzy-match score of a retrieved translation.
+    :param max_candidates: Maximum number of candidates whose edit distance to the input is computed.
+    :param max_postings: Maximum number of postings of an n-gram used for candidate retrieval.
+    """
+
+    def __init__(self, folder: str, threshold: float = C.TM_FUZZY_MATCH_THRESHOLD,
+                 max_candidates: int = C.TM_MAX_CANDIDATES, max_postings: int = C.TM_MAX_POSTINGS) -> None:
+        check_condition(0.0 < threshold <= 1.0, "The fuzzy-match threshold must be in (0, 1].")
+        with open(os.path.join(folder, C.TM_CONFIG_NAME)) as inp:
+            config = json.load(inp)
+        self.ngram_order = config["ngram_order"]
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.max_postings = max_postings
+        self.ngrams = self._load(folder, C.TM_NGRAMS_NAME)
+        self.offsets = self._load(folder, C.TM_OFFSETS_NAME)
+        self.postings = self._load(folder, C.TM_POSTINGS_NAME)
+        self.source_hashes = self._load(folder, C.TM_SOURCE_HASHES_NAME)
+        self.source_ids = self._load(folder, C.TM_SOURCE_IDS_NAME)
+        self.lengths = self._load(folder, C.TM_LENGTHS_NAME)
+        self.text = self._load(folder, C.TM_TEXT_NAME)
+        self.text_offsets = self._load(folder, C.TM_TEXT_OFFSETS_NAME)
+        self.hits = 0
+        self.misses = 0
+        logger.info("Translation memory: %s (%d segments, fuzzy-match threshold: %.2f)",
+                    folder, len(self.lengths), threshold)
+
+    @staticmethod
+    def _load(folder: str, name: str) -> np.ndarray:
+        return np.load(os.path.join(folder, name), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def _get_text(self, index: int) -> str:
+        return bytes(self.text[self.text_offsets[index]:self.text_offsets[index + 1]]).decode("utf-8")
+
+    def get_segment(self, segment_id: int) -> Tuple[str, str]:
+        """
+        Returns source and translation of a stored segment.
+
+        :param segment_id: Segment id.
+        :return: Source and translation, tokens separated by single spaces.
+        """
+        return self._get_text(2 * segment_id), self._get_text(2 * segment_id + 1)
+
+    def lookup(self, tokens: Sequence[str]) -> Optional[Tuple[float, str, str]]:
+        """
+        Returns the best match of a token sequence with a fuzzy-match score of at least threshold, if any.
+
+        :param tokens: Input tokens.
+        :return: Fuzzy-match score, stored source and stored translation of the best match, or None.
+        """
+        exact_match = self._lookup_exact(C.TOKEN_SEPARATOR.join(tokens))
+        if exact_match is not None:
+            return exact_match
+        hashes = get_ngram_hashes(tokens, self.ngram_order)
+        positions = np.searchsorted(self.ngrams, hashes)
+        valid = positions < len(self.ngrams)
+        positions, hashes = positions[valid], hashes[valid]
+        positions = positions[self.ngrams[positions] == hashes]
+        starts, ends = self.offsets[positions], self.offsets[positions + 1]
+        postings = [self.postings[start:end] for start, end in zip(starts, ends) if end - start <= self.max_postings]
+        if not postings:
+            return None
+        segment_ids, counts = np.unique(np.concatenate(postings), return_counts=True)
+        # sources whose length differs by more than the allowed number of edits cannot reach the threshold
+        max_edits = (1.0 - self.threshold) * np.maximum(self.lengths[segment_ids], len(tokens))
+        feasible = np.abs(self.lengths[segment_ids] - len(tokens)) <= max_edits
+        segment_ids, counts = segment_ids[feasible], counts[feasible]
+        candidates = segment_ids[np.argsort(-counts, kind='mergesort')[:self.max_candidates]]
+
+        best = None  # type: Optional[Tuple[float, str, str]]
+        for segment_id in candidates:
+            source, target = self.get_segment(int(segment_id))
+            score = fuzzy_match_score(tokens, source.split(C.TOKEN_SEPARATOR) if source else [])
+            if score >= self.threshold and (best is None or score > best[0]):
+                best = (score, source, target)
+                if score == 1.0:
+                    break
+        return best
+
+    def _lookup_exact(self, source: str) -> Optional[Tuple[float, str, str]]:
+        """
+        Returns the stored segment with the given source, if any, with a fuzzy-match score of 1.
+        """
+        source_hash = get_source_hash(source)
+        start = np.searchsorted(self.source_hashes, source_hash, side='left')
+        end = np.searchsorted(self.source_hashes, source_hash, side='right')
+        for segment_id in self.source_ids[start:end]:
+            stored_source, target = self.get_segment(int(segment_id))
+            if stored_source == source:
+                return 1.0, stored_source, target
+        return None
+
+    def get(self, trans_input: sockeye.inference.TranslatorInput) -> Optional[sockeye.inference.TranslatorOutput]:
+        """
+        Returns the stored translation of the best match of an input as translator output, or None if no stored
+        source reaches the fuzzy-match threshold. The score of the output is the fuzzy-match score, not a model
+        score. Stored translations have no alignment: the attention matrix is all zeros.
+
+        :param trans_input: Translator input.
+        :return: Translator output or None.
+        """
+        match = self.lookup(trans_input.tokens) if trans_input.tokens else None
+        if match is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        score, _, translation = match
+        target_tokens = translation.split(C.TOKEN_SEPARATOR) if translation else []
+        return sockeye.inference.TranslatorOutput(id=trans_input.id,
+                                                  translation=translation,
+                                                  tokens=target_tokens,
+                                                  attention_matrix=np.zeros((len(target_tokens),
+                                                                             len(trans_input.tokens))),
+                                                  score=score)
+
+
+def benchmark(source_lines: List[str], target_lines: List[str], sizes: List[int], num_queries: int,
+              threshold: float = C.TM_FUZZY_MATCH_THRESHOLD, ngram_order: int = C.TM_NGRAM_ORDER,
+              seed: int = 1) -> List[Tuple[int, float, float, float]]:
+    """
+    Measures lookup latency against translation memory size. For each size, a translation memory of the first
+    size segments is built and queried with sources sampled from it, each with one token replaced, such that
+    lookups exercise fuzzy matching.
+
+    :param source_lines: Source sentences.
+    :param target_lines: Translations of the source sentences.
+    :param sizes: Translation memory sizes to measure.
+    :param num_queries: Number of queries per size.
+    :param threshold: Fuzzy-match threshold.
+    :param ngram_order: N-gram order of the index.
+    :param seed: Random seed for sampling queries.
+    :return: Size, mean, median and 99th percentile of the lookup latency in milliseconds for each size.
+    """
+    rng = random.Random(seed)
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="sockeye.tm.") as folder:
+            build(source_lines[:size], target_lines[:size], folder, ngram_order)
+            tm = TranslationMemory(folder, threshold)
+            queries = []
+            for _ in range(num_queries):
+                tokens = list(data_io.get_tokens(rng.choice(source_lines[:size])))
+                if tokens:
+                    tokens[rng.randrange(len(tokens))] = C.UNK_SYMBOL
+                queries.append(tokens)
+            latencies = []
+            for tokens in queries:
+                tic = time.time()
+                tm.lookup(tokens)
+                latencies.append(1000.0 * (time.time() - tic))
+            results.append((len(tm), float(np.mean(latencies)), float(np.percentile(latencies, 50)),
+                            float(np.percentile(latencies, 99))))
+            del tm
+        logger.info("Translation memory size: %d lookup latency (ms) mean: %.3f p50: %.3f p99: %.3f", *results[-1])
+    return results
+
+
+def main():
+    """
+    Commandline interface for creating translation memories and benchmarking their lookup latency.
+    """
+    setup_main_logger(__name__, console=True, file_logging=False)
+    log_sockeye_version(logger)
+    params = argparse.ArgumentParser(description="Create a fuzzy-match translation memory from earlier translations.")
+    arguments.add_translation_memory_args(params)
+    args = params.parse_args()
+    check_condition(args.output is not None or args.benchmark_sizes is not None,
+                    "Specify an output folder, benchmark sizes, or both.")
+
+    with data_io.smart_open(args.source) as source, data_io.smart_open(args.target) as target:
+        source_lines, target_lines = list(source), list(target)
+    if args.benchmark_sizes:
+        benchmark(source_lines, target_lines, args.benchmark_sizes, args.benchmark_queries,
+                  args.threshold, args.ngram_order)
+    if args.output is not None:
+        build(source_lines, target_lines, args.output, args.ngram_order)
+
+
+if __name__ == "__main__":
+    main()
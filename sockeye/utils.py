@@ -17,7 +17,9 @@ A set of utility methods.
 import collections
 import errno
 import fcntl
+import json
 import logging
+import mmap
 import os
 import shutil
 import subprocess
@@ -131,7 +133,8 @@ def save_params(arg_params: Mapping[str, mx.nd.NDArray], fname: str,
 
 def load_params(fname: str) -> Tuple[Dict[str, mx.nd.NDArray], Dict[str, mx.nd.NDArray]]:
     """
-    Loads parameters from a file.
+    Loads parameters from a file. Quantized (see quantize_rows) and float16 arg parameters are converted back to
+    float32.
 
     :param fname: The file containing the parameters.
     :return: Mapping from parameter names to the actual parameters for both the arg parameters and the aux parameters.
@@ -139,15 +142,130 @@ def load_params(fname: str) -> Tuple[Dict[str, mx.nd.NDArray], Dict[str, mx.nd.N
     save_dict = mx.nd.load(fname)
     arg_params = {}
     aux_params = {}
+    quantized = collections.defaultdict(dict)  # type: Dict[str, Dict[str, mx.nd.NDArray]]
     for k, v in save_dict.items():
         tp, name = k.split(':', 1)
         if tp == 'arg':
-            arg_params[name] = v
+            arg_params[name] = v if v.dtype == np.float32 else v.astype('float32')
         if tp == 'aux':
             aux_params[name] = v
+        if tp in (C.PARAMS_QUANTIZED_VALUES_PREFIX,
+                  C.PARAMS_QUANTIZED_SCALES_PREFIX,
+                  C.PARAMS_QUANTIZED_ZERO_POINTS_PREFIX):
+            quantized[name][tp] = v
+    for name, arrays in quantized.items():
+        check_condition(len(arrays) == 3, "Incomplete quantized parameter '%s' in %s" % (name, fname))
+        arg_params[name] = dequantize_rows(arrays[C.PARAMS_QUANTIZED_VALUES_PREFIX],
+                                           arrays[C.PARAMS_QUANTIZED_SCALES_PREFIX],
+                                           arrays[C.PARAMS_QUANTIZED_ZERO_POINTS_PREFIX])
     return arg_params, aux_params
 
 
+def quantize_rows(array: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Quantizes each row of a matrix to 8 bits with its own scale and zero point, such that
+    array ~= (quantized - zero_point) * scale. The range of each row includes 0, which is represented exactly.
+
+    :param array: Matrix. Shape: (rows, columns).
+    :return: Quantized values (uint8, same shape), scales (float32, (rows,)), zero points (float32, (rows,)).
+    """
+    row_min = np.minimum(array.min(axis=1), 0.0)
+    row_max = np.maximum(array.max(axis=1), 0.0)
+    scales = (row_max - row_min) / 255.0
+    scales[scales == 0.0] = 1.0
+    zero_points = np.round(-row_min / scales)
+    quantized = np.clip(np.round(array / scales[:, None]) + zero_points[:, None], 0, 255).astype('uint8')
+    return quantized, scales.astype('float32'), zero_points.astype('float32')
+
+
+def dequantize_rows(quantized: mx.nd.NDArray, scales: mx.nd.NDArray, zero_points: mx.nd.NDArray) -> mx.nd.NDArray:
+    """
+    Returns the float32 matrix of row-wise quantized values.
+
+    :param quantized: Quantized values. Shape: (rows, columns).
+    :param scales: Scale of each row. Shape: (rows,).
+    :param zero_points: Zero point of each row. Shape: (rows,).
+    :return: Dequantized matrix. Shape: (rows, columns).
+    """
+    return mx.nd.broadcast_mul(mx.nd.broadcast_sub(quantized.astype('float32'), zero_points.reshape((-1, 1))),
+                               scales.reshape((-1, 1)))
+
+
+def save_params_mmap(arg_params: Mapping[str, np.ndarray], fname: str):
+    """
+    Saves arg parameters as a flat binary file of raw arrays, each starting at an offset aligned to
+    C.PARAMS_MMAP_ALIGNMENT bytes, and a JSON index of names, types, shapes and offsets in
+    fname + C.PARAMS_MMAP_INDEX_SUFFIX. See load_params_mmap.
+
+    :param arg_params: Mapping from parameter names to arrays.
+    :param fname: Path of the binary file.
+    """
+    index = {}
+    offset = 0
+    with open(fname, "wb") as out:
+        for name, param in sorted(arg_params.items()):
+            array = np.ascontiguousarray(param.asnumpy() if isinstance(param, mx.nd.NDArray) else param)
+            padding = -offset % C.PARAMS_MMAP_ALIGNMENT
+            out.write(b"\0" * padding)
+            offset += padding
+            index[name] = {"dtype": array.dtype.name, "shape": list(array.shape), "offset": offset}
+            out.write(array.tobytes())
+            offset += array.nbytes
+    with open(fname + C.PARAMS_MMAP_INDEX_SUFFIX, "w") as out:
+        json.dump(index, out, indent=2, sort_keys=True)
+
+
+def load_params_mmap(fname: str) -> Dict[str, np.ndarray]:
+    """
+    Memory-maps parameters written by save_params_mmap read-only. The returned arrays are views of the file: pages
+    are read on first access and live in the page cache, shared by all processes mapping the same file.
+
+    :param fname: Path of the binary file.
+    :return: Mapping from parameter names to read-only arrays.
+    """
+    with open(fname + C.PARAMS_MMAP_INDEX_SUFFIX) as inp:
+        index = json.load(inp)
+    with open(fname, "rb") as inp:
+        # pre-fault the mapping in one call (where supported) rather than page by page while copying parameters
+        data = np.frombuffer(mmap.mmap(inp.fileno(), 0, flags=mmap.MAP_SHARED | getattr(mmap, "MAP_POPULATE", 0),
+                                       prot=mmap.PROT_READ), dtype='uint8')
+    arg_params = {}
+    for name, entry in index.items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        nbytes = int(np.prod(shape, dtype='int64')) * dtype.itemsize
+        check_condition(entry["offset"] + nbytes <= data.size, "Parameter '%s' exceeds %s" % (name, fname))
+        arg_params[name] = data[entry["offset"]:entry["offset"] + nbytes].view(dtype).reshape(shape)
+    return arg_params
+
+
+class MappedParams(Mapping):
+    """
+    Read-only mapping from parameter names to NDArrays backed by memory-mapped arrays (see load_params_mmap).
+    An NDArray is created on each access, such that a private copy of a parameter only exists while it is copied
+    into a module, e.g. by Module.init_params.
+
+    :param arrays: Mapping from parameter names to (memory-mapped) arrays.
+    """
+
+    def __init__(self, arrays: Mapping[str, np.ndarray]) -> None:
+        self.arrays = arrays
+
+    def __getitem__(self, name: str) -> mx.nd.NDArray:
+        array = self.arrays[name]
+        return mx.nd.array(array, dtype=array.dtype)
+
+    def __contains__(self, name) -> bool:
+        # Mapping.__contains__ would create an NDArray
+        return name in self.arrays
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.arrays)
+
+    def __len__(self) -> int:
+        return len(self.arrays)
+
+
 class Accuracy(mx.metric.EvalMetric):
     """
     Calculates accuracy. Taken from MXNet and adapted to work with batch-major labels
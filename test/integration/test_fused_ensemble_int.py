@@ -0,0 +1,90 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import os
+import sys
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import mxnet as mx
+import numpy as np
+import pytest
+
+import sockeye.inference
+import sockeye.train
+from test.common import generate_digits_file
+
+_TRAIN_LINE_COUNT = 100
+_DEV_LINE_COUNT = 10
+_LINE_MAX_LENGTH = 9
+
+_MEMBER_PARAMS = [
+    "--encoder rnn --num-layers 1 --rnn-cell-type lstm --rnn-num-hidden 16 --num-embed 8 --attention-type mlp"
+    " --attention-num-hidden 16 --seed 1",
+    "--encoder transformer --decoder transformer --num-layers 1 --transformer-attention-heads 2"
+    " --transformer-model-size 16 --transformer-feed-forward-num-hidden 32 --seed 2",
+]
+
+
+def _train(work_dir: str, name: str, params: str) -> str:
+    model_path = os.path.join(work_dir, name)
+    argv = [sockeye.train.__file__, "--use-cpu", "--max-seq-len", "10",
+            "--source", os.path.join(work_dir, "train.src"), "--target", os.path.join(work_dir, "train.tgt"),
+            "--validation-source", os.path.join(work_dir, "dev.src"),
+            "--validation-target", os.path.join(work_dir, "dev.tgt"),
+            "--output", model_path, "--batch-size", "8", "--max-updates", "10", "--checkpoint-frequency", "10",
+            "--optimizer", "adam", "--initial-learning-rate", "0.01"] + params.split()
+    with patch.object(sys, "argv", argv):
+        sockeye.train.main()
+    return model_path
+
+
+def _translate(model_paths, inputs, ensemble_mode: str, fuse_ensemble: bool):
+    models, vocab_source, vocab_target = sockeye.inference.load_models(mx.cpu(),
+                                                                       max_input_len=None,
+                                                                       beam_size=2,
+                                                                       model_folders=model_paths,
+                                                                       batch_size=2,
+                                                                       fuse_ensemble=fuse_ensemble,
+                                                                       ensemble_mode=ensemble_mode)
+    translator = sockeye.inference.Translator(mx.cpu(), ensemble_mode, sockeye.inference.LengthPenalty(),
+                                              models, vocab_source, vocab_target)
+    trans_inputs = [translator.make_input(i, line) for i, line in enumerate(inputs)]
+    return [output for start in range(0, len(trans_inputs), translator.batch_size)
+            for output in translator.translate_batch(trans_inputs[start:start + translator.batch_size])]
+
+
+@pytest.fixture(scope="module")
+def member_models():
+    with TemporaryDirectory(prefix="test_fused_ensemble") as work_dir:
+        generate_digits_file(os.path.join(work_dir, "train.src"), os.path.join(work_dir, "train.tgt"),
+                             _TRAIN_LINE_COUNT, _LINE_MAX_LENGTH)
+        generate_digits_file(os.path.join(work_dir, "dev.src"), os.path.join(work_dir, "dev.tgt"),
+                             _DEV_LINE_COUNT, _LINE_MAX_LENGTH)
+        model_paths = [_train(work_dir, "model%d" % i, params) for i, params in enumerate(_MEMBER_PARAMS)]
+        with open(os.path.join(work_dir, "dev.src")) as dev:
+            inputs = [line.strip() for line in dev]
+        yield model_paths, inputs
+
+
+@pytest.mark.parametrize("ensemble_mode", ["linear", "log_linear"])
+def test_fused_ensemble_matches_ensemble(member_models, ensemble_mode):
+    """A fused ensemble of an RNN and a transformer model translates like the unfused ensemble."""
+    model_paths, inputs = member_models
+    outputs = _translate(model_paths, inputs, ensemble_mode, fuse_ensemble=False)
+    fused_outputs = _translate(model_paths, inputs, ensemble_mode, fuse_ensemble=True)
+    assert [output.translation for output in fused_outputs] == [output.translation for output in outputs]
+    assert np.allclose([output.score for output in fused_outputs], [output.score for output in outputs],
+                       rtol=1e-4, atol=1e-5)
+    for fused_output, output in zip(fused_outputs, outputs):
+        assert np.allclose(fused_output.attention_matrix, output.attention_matrix, rtol=1e-4, atol=1e-5)
@@ -156,7 +156,24 @@ def test_training_arg(test_params, expected_params):
                                models=['m1', 'm2', 'm3'],
                                checkpoints=None,
                                beam_size=5,
+                               batch_size=1,
+                               chunk_size=None,
+                               restrict_lexicon=None,
+                               device_topk=False,
+                               shrink_beam=False,
+                               segment_long_inputs=False,
+                               cache=None,
+                               cache_size=C.TRANSLATION_CACHE_SIZE,
+                               translation_memory=None,
+                               translation_memory_threshold=C.TM_FUZZY_MATCH_THRESHOLD,
+                               max_output_length_num_stds=C.DEFAULT_NUM_STD_MAX_OUTPUT_LENGTH,
+                               workers=1,
+                               omp_num_threads=None,
+                               warm_up=None,
+                               max_bound_buckets=None,
+                               mmap_params=False,
                                ensemble_mode='linear',
+                               fuse_ensemble=False,
                                max_input_len=None,
                                softmax_temperature=None,
                                output_type='translation',
@@ -168,6 +185,85 @@ def test_inference_args(test_params, expected_params):
     _test_args(test_params, expected_params, arguments.add_inference_args)
 
 
+@pytest.mark.parametrize("test_params, expected_params", [
+    ('-i lex.txt -m model -o lex.json',
+     dict(input='lex.txt', model='model', output='lex.json', k=200)),
+    ('--input lex.txt --model model --output lex.json -k 50',
+     dict(input='lex.txt', model='model', output='lex.json', k=50)),
+])
+def test_lexicon_args(test_params, expected_params):
+    _test_args(test_params, expected_params, arguments.add_lexicon_args)
+
+
+@pytest.mark.parametrize("test_params, expected_params", [
+    ('--source src.txt --target trg.txt --output tm',
+     dict(source='src.txt', target='trg.txt', output='tm', ngram_order=C.TM_NGRAM_ORDER,
+          threshold=C.TM_FUZZY_MATCH_THRESHOLD, benchmark_sizes=None, benchmark_queries=1000)),
+    ('-s src.txt -t trg.txt --benchmark-sizes 1000 10000 --benchmark-queries 100 --ngram-order 3',
+     dict(source='src.txt', target='trg.txt', output=None, ngram_order=3,
+          threshold=C.TM_FUZZY_MATCH_THRESHOLD, benchmark_sizes=[1000, 10000], benchmark_queries=100)),
+])
+def test_translation_memory_args(test_params, expected_params):
+    _test_args(test_params, expected_params, arguments.add_translation_memory_args)
+
+
+@pytest.mark.parametrize("test_params, expected_params", [
+    ('', dict(host=C.SERVE_HOST, port=C.SERVE_PORT, unix_socket=None, max_wait_ms=C.SERVE_MAX_WAIT_MS)),
+    ('--host 0.0.0.0 --port 0 --unix-socket sockeye.sock --max-wait-ms 2.5',
+     dict(host='0.0.0.0', port=0, unix_socket='sockeye.sock', max_wait_ms=2.5)),
+])
+def test_serve_args(test_params, expected_params):
+    _test_args(test_params, expected_params, arguments.add_serve_args)
+
+
+@pytest.mark.parametrize("test_params, expected_params", [
+    ('-m model -s src.txt -t trg.txt',
+     dict(model='model', checkpoint=None, source='src.txt', target='trg.txt', output=None, batch_size=64,
+          max_seq_len=None, bucket_width=10, normalize=False, length_penalty_alpha=1.0, length_penalty_beta=0.0)),
+    ('-m model -c 3 -s src.txt -t trg.txt -o scores.txt -b 16 --max-seq-len 50:60 --normalize',
+     dict(model='model', checkpoint=3, source='src.txt', target='trg.txt', output='scores.txt', batch_size=16,
+          max_seq_len=(50, 60), bucket_width=10, normalize=True, length_penalty_alpha=1.0,
+          length_penalty_beta=0.0)),
+])
+def test_score_args(test_params, expected_params):
+    _test_args(test_params, expected_params, arguments.add_score_args)
+
+
+@pytest.mark.parametrize("test_params, expected_params", [
+    ('model -o params.int8',
+     dict(input='model', output='params.int8', dtype=C.QUANTIZE_INT8, params=None, min_size=C.QUANTIZE_MIN_SIZE)),
+    ('model/params.best -o params.fp16 --dtype float16 --params decoder_cls_weight --min-size 10',
+     dict(input='model/params.best', output='params.fp16', dtype=C.QUANTIZE_FLOAT16, params=['decoder_cls_weight'],
+          min_size=10)),
+])
+def test_quantize_args(test_params, expected_params):
+    _test_args(test_params, expected_params, arguments.add_quantize_args)
+
+
+@pytest.mark.parametrize("test_params, expected_params", [
+    ('model', dict(model='model', checkpoint=None, benchmark=None)),
+    ('model -c 3 --benchmark 5', dict(model='model', checkpoint=3, benchmark=5)),
+])
+def test_mmap_params_args(test_params, expected_params):
+    _test_args(test_params, expected_params, arguments.add_mmap_params_args)
+
+
+@pytest.mark.parametrize("test_params, expected_params", [
+    ('-o results.json',
+     dict(output='results.json', architectures=['rnn', 'transformer', 'conv'], sizes=['tiny'], beam_sizes=[1, 5],
+          input_lengths=[10, 30], ensemble_sizes=[1], threads=[1], topk=[C.TOPK_HOST], batch_size=1, num_sentences=20,
+          model_dir=None, compare=None, seed=1)),
+    ('-o results.json --architectures rnn --sizes tiny medium --beam-sizes 5 --input-lengths 50 '
+     '--ensemble-sizes 1 2 --threads 1 4 --topk host device --batch-size 8 --num-sentences 100 --model-dir models '
+     '--compare previous.json --seed 3',
+     dict(output='results.json', architectures=['rnn'], sizes=['tiny', 'medium'], beam_sizes=[5],
+          input_lengths=[50], ensemble_sizes=[1, 2], threads=[1, 4], topk=[C.TOPK_HOST, C.TOPK_DEVICE], batch_size=8,
+          num_sentences=100, model_dir='models', compare='previous.json', seed=3)),
+])
+def test_benchmark_args(test_params, expected_params):
+    _test_args(test_params, expected_params, arguments.add_benchmark_args)
+
+
 def _test_args(test_params, expected_params, args_func):
     test_parser = argparse.ArgumentParser()
     args_func(test_parser)
@@ -196,3 +196,64 @@ def test_get_context_and_attention_probs():
 
     expected_probs = (1. / source_length_nd).reshape((batch_size, 1)).asnumpy()
     assert (np.sum(np.isclose(probs.asnumpy(), expected_probs), axis=1) == source_length_np).all()
+
+
+projection_cases = [C.ATT_BILINEAR, C.ATT_DOT, C.ATT_MH_DOT, C.ATT_MLP, C.ATT_COV]
+
+
+@pytest.mark.parametrize("attention_type", projection_cases)
+def test_attention_precomputed_source_projections(attention_type,
+                                                  batch_size=3,
+                                                  source_seq_len=5,
+                                                  encoder_num_hidden=4,
+                                                  decoder_num_hidden=4):
+    source = mx.sym.Variable("source")
+    source_length = mx.sym.Variable("source_length")
+    decoder_state = mx.sym.Variable("decoder_state")
+    config_coverage = sockeye.coverage.CoverageConfig(type="tanh",
+                                                      num_hidden=2,
+                                                      layer_normalization=False)
+    config_attention = sockeye.attention.AttentionConfig(type=attention_type,
+                                                         num_hidden=6,
+                                                         input_previous_word=False,
+                                                         rnn_num_hidden=decoder_num_hidden,
+                                                         layer_normalization=False,
+                                                         config_coverage=config_coverage,
+                                                         num_heads=2)
+    attention = sockeye.attention.get_attention(config_attention, max_seq_len=source_seq_len)
+
+    projections = attention.project_source(source, source_seq_len)
+    assert len(projections) == len(attention.source_projection_num_hidden())
+    projection_variables = [mx.sym.Variable("projection_%d" % i) for i in range(len(projections))]
+
+    def attend(source_projections):
+        attention_state = attention.get_initial_state(source_length, source_seq_len)
+        attention_func = attention.on(source, source_length, source_seq_len, source_projections=source_projections)
+        attention_input = attention.make_input(0, mx.sym.Variable("word_vec_prev"), decoder_state)
+        attention_state = attention_func(attention_input, attention_state)
+        return mx.sym.Group([attention_state.context, attention_state.probs])
+
+    sym = attend(None)
+    inputs = {"source": mx.nd.array(gaussian_vector((batch_size, source_seq_len, encoder_num_hidden))),
+              "source_length": mx.nd.array(integer_vector((batch_size,), source_seq_len)),
+              "decoder_state": mx.nd.array(gaussian_vector((batch_size, decoder_num_hidden)))}
+    arg_shapes, _, _ = sym.infer_shape(**{name: array.shape for name, array in inputs.items()})
+    for name, shape in zip(sym.list_arguments(), arg_shapes):
+        if name not in inputs:
+            inputs[name] = mx.nd.array(gaussian_vector(shape))
+    expected_context, expected_probs = sym.eval(ctx=mx.cpu(), **inputs)
+
+    if projections:
+        projection_sym = mx.sym.Group(projections)
+        projection_values = projection_sym.eval(ctx=mx.cpu(), **{name: inputs[name]
+                                                                 for name in projection_sym.list_arguments()})
+        for variable, value, num_hidden in zip(projection_variables, projection_values,
+                                               attention.source_projection_num_hidden()):
+            assert value.shape == (batch_size, source_seq_len, num_hidden)
+            inputs[variable.name] = value
+
+    sym = attend(projection_variables)
+    context, probs = sym.eval(ctx=mx.cpu(), **{name: inputs[name] for name in sym.list_arguments()})
+
+    assert np.allclose(context.asnumpy(), expected_context.asnumpy(), atol=1e-6)
+    assert np.allclose(probs.asnumpy(), expected_probs.asnumpy(), atol=1e-6)
@@ -0,0 +1,65 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+from unittest.mock import Mock, patch
+
+import mxnet as mx
+
+import sockeye.benchmark
+import sockeye.constants as C
+import sockeye.inference
+
+
+def _get_test_translator(batch_size: int) -> sockeye.inference.Translator:
+    model = Mock(spec=sockeye.inference.InferenceModel)
+    model.decoder_return_attention = True
+    model.batch_size = batch_size
+    model.beam_size = 2
+    model.config = Mock()
+    model.config.max_seq_len_source = 20
+    model.max_output_length_factor = 2.0
+    vocab_source = {C.PAD_SYMBOL: C.PAD_ID, C.UNK_SYMBOL: 1, "a": 2, "b": 3}
+    vocab_target = {C.PAD_SYMBOL: C.PAD_ID, C.UNK_SYMBOL: 1, C.BOS_SYMBOL: 2, C.EOS_SYMBOL: 3, "x": 4}
+    return sockeye.inference.Translator(mx.cpu(), 'linear', sockeye.inference.LengthPenalty(),
+                                        [model], vocab_source, vocab_target)
+
+
+def test_benchmark_input_preparation():
+    translator = _get_test_translator(batch_size=2)
+    trans_inputs = [translator.make_input(i, sentence) for i, sentence in enumerate(["a b", "b a c", "a"])]
+    with patch.object(translator, "_get_inference_input",
+                      wraps=translator._get_inference_input) as mock_get_inference_input:
+        microseconds = sockeye.benchmark.benchmark_input_preparation(translator, trans_inputs, repetitions=3)
+    assert microseconds > 0
+    assert mock_get_inference_input.call_count == 6
+    assert mock_get_inference_input.call_args_list[0][0][0] == [["a", "b"], ["b", "a", "c"]]
+
+
+def test_generate_inputs():
+    sentences = sockeye.benchmark.generate_inputs(vocab_size=5, length=4, num_sentences=3, seed=2)
+    assert len(sentences) == 3
+    assert all(len(sentence.split()) == 4 for sentence in sentences)
+    assert all(token in {"w0", "w1", "w2", "w3", "w4"} for sentence in sentences for token in sentence.split())
+    assert sentences == sockeye.benchmark.generate_inputs(vocab_size=5, length=4, num_sentences=3, seed=2)
+
+
+def _result(beam_size: int, sent_per_sec: float, topk: str = C.TOPK_HOST) -> dict:
+    return dict(model="rnn.tiny", beam_size=beam_size, input_length=10, ensemble_size=1, threads=1, batch_size=1,
+                topk=topk, sent_per_sec=sent_per_sec)
+
+
+def test_compare():
+    previous = [_result(1, 10.0), _result(5, 4.0)]
+    current = [_result(5, 5.0), _result(5, 2.0, C.TOPK_DEVICE), _result(10, 1.0)]
+    comparison = sockeye.benchmark.compare(previous, current)
+    assert comparison == [(("rnn.tiny", 5, 10, 1, 1, 1, C.TOPK_HOST), 4.0, 5.0, 1.25)]
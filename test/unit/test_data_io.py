@@ -107,3 +107,11 @@ def test_get_parallel_bucket(buckets, source_length, target_length, expected_buc
     bucket_index, bucket = sockeye.data_io.get_parallel_bucket(buckets, source_length, target_length)
     assert bucket_index == expected_bucket_index
     assert bucket == expected_bucket
+
+
+def test_length_ratio_statistics():
+    source_sentences = [[1, 2], [1, 2, 3, 4], [1]]
+    target_sentences = [[1, 2], [1, 2], [1, 2, 3]]
+    mean, std = sockeye.data_io.length_ratio_statistics(source_sentences, target_sentences)
+    assert mean == pytest.approx(1.5)
+    assert std == pytest.approx(((0.5 ** 2 + 1.0 ** 2 + 1.5 ** 2) / 3) ** 0.5)
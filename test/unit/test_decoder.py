@@ -12,6 +12,7 @@
 # permissions and limitations under the License.
 
 import mxnet as mx
+import numpy as np
 import pytest
 
 import sockeye.attention
@@ -19,6 +20,7 @@ import sockeye.rnn
 import sockeye.constants as C
 import sockeye.coverage
 import sockeye.decoder
+import sockeye.transformer
 from test.common import gaussian_vector, integer_vector
 
 step_tests = [(C.GRU_TYPE, True), (C.LSTM_TYPE, False)]
@@ -102,3 +104,67 @@ def test_step(cell_type, context_gating,
     assert hidden_result.shape == hidden_prev_shape
     assert attention_probs_result.shape == (batch_size, source_seq_len)
     assert attention_dynamic_source_result.shape == (batch_size, source_seq_len, config_coverage.num_hidden)
+
+
+def test_transformer_decode_step_matches_decode_sequence():
+    vocab_size, batch_size, source_seq_len, target_seq_len, model_size = 10, 3, 4, 5, 8
+    config = sockeye.transformer.TransformerConfig(model_size=model_size,
+                                                   attention_heads=2,
+                                                   feed_forward_num_hidden=16,
+                                                   num_layers=2,
+                                                   vocab_size=vocab_size,
+                                                   dropout_attention=0.,
+                                                   dropout_relu=0.,
+                                                   dropout_residual=0.,
+                                                   layer_normalization=True,
+                                                   weight_tying=False,
+                                                   positional_encodings=True)
+    decoder = sockeye.decoder.TransformerDecoder(config)
+
+    source_np = np.random.uniform(-1, 1, (batch_size, source_seq_len, model_size))
+    source_lengths_np = np.array([4, 2, 3])
+    target_np = np.random.randint(1, vocab_size, (batch_size, target_seq_len))
+
+    # logits of full target sequence: (batch_size * target_seq_len, vocab_size)
+    source = mx.sym.Variable(C.SOURCE_ENCODED_NAME)
+    source_lengths = mx.sym.Variable(C.SOURCE_LENGTH_NAME)
+    target = mx.sym.Variable(C.TARGET_NAME)
+    target_lengths = mx.sym.Variable("target_length")
+    logits_sym = decoder.decode_sequence(mx.sym.swapaxes(source, dim1=0, dim2=1), source_lengths, source_seq_len,
+                                         target, target_lengths, target_seq_len)
+    executor = logits_sym.simple_bind(ctx=mx.cpu(),
+                                      **{C.SOURCE_ENCODED_NAME: source_np.shape,
+                                         C.SOURCE_LENGTH_NAME: (batch_size,),
+                                         C.TARGET_NAME: target_np.shape,
+                                         "target_length": (batch_size,)})
+    params = {}
+    for name, array in executor.arg_dict.items():
+        array[:] = np.random.uniform(-0.5, 0.5, array.shape)
+        params[name] = array
+    params[C.SOURCE_ENCODED_NAME][:] = source_np
+    params[C.SOURCE_LENGTH_NAME][:] = source_lengths_np
+    params[C.TARGET_NAME][:] = target_np
+    params["target_length"][:] = target_seq_len
+    expected_logits = executor.forward()[0].asnumpy().reshape((batch_size, target_seq_len, vocab_size))
+
+    # incremental decoding, one position at a time
+    init_sym = mx.sym.Group(decoder.init_states(source, source_lengths, source_seq_len))
+    states = init_sym.eval(ctx=mx.cpu(), **{name: params[name] for name in init_sym.list_arguments()})
+
+    prev_word_id = mx.sym.Variable(C.TARGET_PREVIOUS_NAME)
+    state_variables = decoder.state_variables()
+    step_hidden, _, new_states = decoder.decode_step(prev_word_id, source_seq_len, *state_variables)
+    step_sym = mx.sym.Group([decoder.output_layer(step_hidden)] + new_states)
+    state_names = [state.name for state in state_variables]
+    static_states = decoder.static_states()
+    assert len(static_states) == len(state_variables)
+    for t in range(target_seq_len):
+        inputs = dict(zip(state_names, states))
+        inputs[C.TARGET_PREVIOUS_NAME] = mx.nd.array(target_np[:, t])
+        inputs.update({name: params[name] for name in step_sym.list_arguments() if name not in inputs})
+        prev_states = states
+        logits, *states = step_sym.eval(ctx=mx.cpu(), **inputs)
+        assert np.allclose(logits.asnumpy(), expected_logits[:, t, :], atol=1e-5)
+        for is_static, prev_state, state in zip(static_states, prev_states, states):
+            if is_static:
+                assert np.array_equal(prev_state.asnumpy(), state.asnumpy())
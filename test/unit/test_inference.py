@@ -11,10 +11,18 @@
 # express or implied. See the License for the specific language governing
 # permissions and limitations under the License.
 
+import io
+import logging
+from unittest.mock import Mock, patch
+
 import mxnet as mx
 import numpy as np
+import pytest
 
+import sockeye.constants as C
 import sockeye.inference
+import sockeye.output_handler
+import sockeye.utils
 
 
 def test_length_penalty_default():
@@ -32,3 +40,408 @@ def test_length_penalty():
 
     assert np.isclose(length_penalty(lengths).asnumpy(), expected_lp).all()
 
+
+def test_length_penalty_table():
+    length_penalty = sockeye.inference.LengthPenalty(.2, 5.0)
+    table = length_penalty.get_table(3, mx.cpu())
+    expected_lp = np.array([5**0.2/6**0.2, 6**0.2/6**0.2, 7**0.2/6**0.2, 8**0.2/6**0.2])
+
+    assert np.isclose(table.asnumpy(), expected_lp).all()
+
+
+def test_model_state_sort_state_skips_static_states():
+    static = mx.nd.array([[1, 1], [2, 2], [3, 3]])
+    dynamic = mx.nd.array([[1, 1], [2, 2], [3, 3]])
+    model_state = sockeye.inference.ModelState(bucket_key=2,
+                                               prev_target_word_id=mx.nd.zeros((3,)),
+                                               decoder_states=[static, dynamic],
+                                               static_states=[True, False])
+    model_state.sort_state(mx.nd.array([2, 2, 0]), mx.nd.array([4, 5, 6]))
+
+    assert model_state.decoder_states[0] is static
+    assert (model_state.decoder_states[1].asnumpy() == np.array([[3, 3], [3, 3], [1, 1]])).all()
+    assert (model_state.prev_target_word_id.asnumpy() == np.array([4, 5, 6])).all()
+
+
+def _get_test_translator(batch_size: int, beam_size: int = 2,
+                         return_attention: bool = True,
+                         segment_long_inputs: bool = False,
+                         collect_timings: bool = False) -> sockeye.inference.Translator:
+    model = Mock(spec=sockeye.inference.InferenceModel)
+    model.decoder_return_attention = return_attention
+    model.batch_size = batch_size
+    model.beam_size = beam_size
+    model.config = Mock()
+    model.config.max_seq_len_source = 20
+    model.max_output_length_factor = 2.0
+    vocab_source = {C.PAD_SYMBOL: C.PAD_ID, C.UNK_SYMBOL: 1, "a": 2, "b": 3}
+    vocab_target = {C.PAD_SYMBOL: C.PAD_ID, C.UNK_SYMBOL: 1, C.BOS_SYMBOL: 2, C.EOS_SYMBOL: 3, "x": 4}
+    return sockeye.inference.Translator(mx.cpu(), 'linear', sockeye.inference.LengthPenalty(),
+                                        [model], vocab_source, vocab_target,
+                                        segment_long_inputs=segment_long_inputs,
+                                        collect_timings=collect_timings)
+
+
+def test_get_inference_input_fills_up_batch():
+    translator = _get_test_translator(batch_size=3)
+    source, bucket_key = translator._get_inference_input([["a", "b"], ["b", "a", "c"]])
+    assert bucket_key == 10
+    expected = np.zeros((3, 10))
+    expected[0, :2] = [2, 3]
+    expected[1, :3] = [3, 2, 1]
+    expected[2, :3] = [3, 2, 1]
+    assert (source.asnumpy() == expected).all()
+
+
+def test_translate_batch_keeps_input_order():
+    translator = _get_test_translator(batch_size=2)
+    trans_inputs = [translator.make_input(i, sentence) for i, sentence in enumerate(["a b", "", "b", "a a b"])]
+
+    def translate_nd(source, bucket_key):
+        # translate each source row into a sequence of 'x' of the same length
+        lengths = (source.asnumpy() != C.PAD_ID).sum(axis=1).astype('int32')
+        return [([4] * length + [3], np.zeros((length + 1, bucket_key)), 0.5) for length in lengths]
+
+    with patch.object(translator, "translate_nd", side_effect=translate_nd) as mock_translate_nd:
+        trans_outputs = translator.translate_batch(trans_inputs)
+
+    assert mock_translate_nd.call_count == 2
+    assert [trans_output.id for trans_output in trans_outputs] == [0, 1, 2, 3]
+    assert [trans_output.translation for trans_output in trans_outputs] == ["x x", "", "x", "x x x"]
+    assert trans_outputs[3].attention_matrix.shape == (4, 3)
+
+
+def test_translate_batch_collects_timings():
+    translator = _get_test_translator(batch_size=2, collect_timings=True)
+    trans_inputs = [translator.make_input(i, sentence) for i, sentence in enumerate(["a b", "", "b"])]
+
+    def translate_nd(source, bucket_key):
+        for _ in range(3):
+            translator._run_decoders([])
+        return [([4, 3], np.zeros((2, bucket_key)), 0.5)] * 2
+
+    with patch.object(translator, "translate_nd", side_effect=translate_nd):
+        translator.translate_batch(trans_inputs)
+
+    assert translator.last_timings[1] is None
+    timings = translator.last_timings[0]
+    assert translator.last_timings[2] is timings
+    assert timings.decode_steps == 3
+    assert all(seconds >= 0 for seconds in timings)
+
+
+@pytest.mark.parametrize("tokens, max_length, expected", [
+    ([], 3, [[]]),
+    (list("abc"), 3, [list("abc")]),
+    (list("abcdefg"), 3, [list("abc"), list("def"), list("g")]),
+    (["a", ",", "b", "c", ".", "d", "e"], 5, [["a", ",", "b", "c", "."], ["d", "e"]]),
+    (["a", ",", "b", "c", "d", "e", "f"], 5, [["a", ","], ["b", "c", "d", "e", "f"]]),
+])
+def test_segment_tokens(tokens, max_length, expected):
+    assert sockeye.inference.segment_tokens(tokens, max_length) == expected
+
+
+def test_translate_batch_segments_long_inputs():
+    translator = _get_test_translator(batch_size=2, segment_long_inputs=True)
+    # 25 tokens: pieces of 16 (up to the comma) and 9 tokens, each translated into length + 1 tokens
+    sentence = " ".join(["a"] * 15 + [","] + ["b"] * 9)
+    trans_inputs = [translator.make_input(0, sentence), translator.make_input(1, "a b")]
+
+    def translate_nd(source, bucket_key):
+        lengths = (source.asnumpy() != C.PAD_ID).sum(axis=1).astype('int32')
+        return [([4] * length + [3], np.ones((length + 1, bucket_key)), 0.5) for length in lengths]
+
+    with patch.object(translator, "translate_nd", side_effect=translate_nd) as mock_translate_nd:
+        trans_outputs = translator.translate_batch(trans_inputs)
+
+    assert mock_translate_nd.call_count == 2
+    assert [trans_output.id for trans_output in trans_outputs] == [0, 1]
+    assert trans_outputs[0].translation == " ".join(["x"] * 25)
+    # the end-of-sentence symbol of the first piece is dropped
+    assert trans_outputs[0].tokens == ["x"] * 25 + [C.EOS_SYMBOL]
+    attention_matrix = trans_outputs[0].attention_matrix
+    assert attention_matrix.shape == (26, 25)
+    assert (attention_matrix[:16, :16] == 1).all() and (attention_matrix[16:, 16:] == 1).all()
+    assert attention_matrix.sum() == 16 * 16 + 10 * 9
+    assert trans_outputs[0].score == 0.5
+    assert trans_outputs[1].translation == "x x"
+
+
+def test_translate_batch_segments_long_inputs_alignments():
+    translator = _get_test_translator(batch_size=1, segment_long_inputs=True)
+    # pieces of 16 and 9 tokens, each word attending to its source word and </s> to the last source word
+    sentence = " ".join(["a"] * 15 + [","] + ["b"] * 9)
+
+    def translate_nd(source, bucket_key):
+        length = int((source.asnumpy()[0] != C.PAD_ID).sum())
+        attention = np.zeros((length + 1, bucket_key))
+        attention[np.arange(length), np.arange(length)] = 1.0
+        attention[length, length - 1] = 1.0
+        return [([4] * length + [3], attention, float(length))]
+
+    with patch.object(translator, "translate_nd", side_effect=translate_nd):
+        trans_output = translator.translate_batch([translator.make_input(0, sentence)])[0]
+
+    stream = io.StringIO()
+    output_handler = sockeye.output_handler.StringWithAlignmentsOutputHandler(stream, threshold=0.9)
+    output_handler.handle(translator.make_input(0, sentence), trans_output)
+    expected_alignments = ["%d-%d" % (i, i) for i in range(25)] + ["24-25"]
+    assert stream.getvalue() == "%s\t%s\n" % (" ".join(["x"] * 25), " ".join(expected_alignments))
+    assert C.EOS_SYMBOL not in trans_output.tokens[:-1]
+    # piece scores weighted by their 16 and 10 kept tokens
+    assert np.isclose(trans_output.score, (16 * 16.0 + 10 * 9.0) / 26)
+
+
+def test_topk_device_matches_smallest_k():
+    batch_size, beam_size, vocab_size = 3, 2, 5
+    translator = _get_test_translator(batch_size=batch_size, beam_size=beam_size)
+    scores_np = np.random.uniform(0, 1, (batch_size * beam_size, vocab_size)).astype('float32')
+    pad_dist = mx.nd.full((batch_size * beam_size, vocab_size), val=np.inf)
+    for t in [0, 1]:
+        hyp_indices, word_indices, values = translator._topk_device(mx.nd.array(scores_np), pad_dist, t)
+        for sentence in range(batch_size):
+            rows = slice(sentence * beam_size, (sentence + 1) * beam_size)
+            (expected_hyps, expected_words), expected_values = sockeye.utils.smallest_k(scores_np[rows], beam_size,
+                                                                                        only_first_row=t == 0)
+            assert (hyp_indices.asnumpy()[rows] == expected_hyps + rows.start).all()
+            assert (word_indices.asnumpy()[rows] == expected_words).all()
+            assert np.allclose(values.asnumpy()[rows, 0], expected_values)
+
+
+def test_get_best_from_beam_follows_back_pointers():
+    translator = _get_test_translator(batch_size=2, beam_size=2)
+    # step 0: rows extend the first hypothesis of each sentence
+    # step 1: row 0 extends row 1, row 1 extends row 0, etc.
+    best_hyp_indices_list = [mx.nd.array([0, 0, 2, 2]), mx.nd.array([1, 0, 2, 3])]
+    best_word_indices_list = [mx.nd.array([4, 3, 3, 4], dtype='int32'), mx.nd.array([3, 4, 0, 3], dtype='int32')]
+    attention_scores_list = [mx.nd.array([[1, 0], [0, 0], [0, 1], [0, 0]]),
+                             mx.nd.array([[0, 1], [1, 0], [0, 0], [1, 0]])]
+    accumulated_scores = mx.nd.array([[0.1], [0.2], [0.3], [0.4]])
+    lengths = mx.nd.array([[2], [2], [1], [2]])
+
+    results = translator._get_best_from_beam(best_hyp_indices_list, best_word_indices_list, attention_scores_list,
+                                             accumulated_scores, lengths)
+
+    assert len(results) == 2
+    sequence, attention_matrix, score = results[0]
+    assert sequence == [3, 3]
+    assert (attention_matrix == np.array([[1, 0], [1, 0]])).all()
+    assert np.isclose(score, 0.1)
+    sequence, attention_matrix, score = results[1]
+    assert sequence == [3]
+    assert (attention_matrix == np.array([[0, 1]])).all()
+    assert np.isclose(score, 0.3)
+
+
+def test_get_best_from_beam_without_attention():
+    translator = _get_test_translator(batch_size=1, beam_size=2, return_attention=False)
+    assert not translator.collect_attention
+    assert translator._combine_predictions([mx.nd.ones((2, 5))], [None])[1] is None
+    results = translator._get_best_from_beam([mx.nd.array([0, 0])], [mx.nd.array([4, 3], dtype='int32')], [],
+                                             mx.nd.array([[0.1], [0.2]]), mx.nd.array([[1], [1]]))
+    sequence, attention_matrix, _ = results[0]
+    assert sequence == [4]
+    assert attention_matrix.shape == (1, 0)
+
+
+def test_beam_search_shrinking_retires_finished_hypotheses():
+    batch_size, beam_size = 2, 3
+    translator = _get_test_translator(batch_size=batch_size, beam_size=beam_size)
+    # decoder state holding the sentence of each row
+    sentence_ids = mx.nd.array(np.repeat(np.arange(batch_size), beam_size))
+    model_state = sockeye.inference.ModelState(bucket_key=2,
+                                               prev_target_word_id=mx.nd.full((batch_size * beam_size,), val=2),
+                                               decoder_states=[sentence_ids],
+                                               static_states=[True])
+    num_rows = []
+
+    def decode_step(states, models_output_layer_params):
+        sentences = states[0].decoder_states[0].asnumpy().astype('int32')
+        prev_word_ids = states[0].prev_target_word_id.asnumpy().astype('int32')
+        num_rows.append(len(prev_word_ids))
+        # negative log-probs over vocabulary: pad, unk, bos, eos, x
+        scores = np.full((len(prev_word_ids), 5), 5.0)
+        for row, (sentence, prev_word_id) in enumerate(zip(sentences, prev_word_ids)):
+            if prev_word_id == 2:
+                # sentence 0 prefers to stop immediately, sentence 1 prefers to generate x first
+                scores[row, [3, 4, 1]] = [0.1, 2.0, 3.0] if sentence == 0 else [1.0, 0.1, 3.0]
+            else:
+                scores[row, 3] = 0.1
+        return mx.nd.array(scores), mx.nd.zeros((len(prev_word_ids), 2)), states
+
+    with patch.object(translator, "_encode", return_value=[model_state]), \
+            patch.object(translator, "_decode_step", side_effect=decode_step):
+        results = translator._beam_search_shrinking(mx.nd.zeros((batch_size, 2)), 2, np.array([4, 4]))
+
+    # two hypotheses finish in the first step: only 4 rows instead of batch_size * beam_size are decoded next
+    assert num_rows == [2, 4]
+    assert [sequence for sequence, _, _ in results] == [[3], [4, 3]]
+    assert [attention_matrix.shape for _, attention_matrix, _ in results] == [(1, 2), (2, 2)]
+    assert np.allclose([score for _, _, score in results], [0.1, 0.1])
+
+
+def test_beam_search_stores_attention_of_each_step():
+    batch_size, beam_size = 1, 2
+    translator = _get_test_translator(batch_size=batch_size, beam_size=beam_size)
+    translator.models[0].get_encoded_seq_len.return_value = 2
+    model_state = sockeye.inference.ModelState(bucket_key=2,
+                                               prev_target_word_id=mx.nd.full((batch_size * beam_size,), val=2),
+                                               decoder_states=[mx.nd.zeros((batch_size * beam_size, 1))])
+    # decoder outputs are overwritten by each forward pass, like the outputs of an executor
+    attention_scores = mx.nd.zeros((batch_size * beam_size, 2))
+    num_steps = []
+
+    def decode_step(states, models_output_layer_params):
+        step = len(num_steps)
+        num_steps.append(step)
+        attention_scores[:] = step
+        # negative log-probs over vocabulary: pad, unk, bos, eos, x. x twice, then eos
+        scores = np.full((batch_size * beam_size, 5), 5.0)
+        scores[:, 4 if step < 2 else 3] = 0.1
+        return mx.nd.array(scores), attention_scores, states
+
+    with patch.object(translator, "_encode", return_value=[model_state]), \
+            patch.object(translator, "_decode_step", side_effect=decode_step):
+        _, _, attention_scores_list, _, _ = translator._beam_search(mx.nd.zeros((batch_size, 2)), 2, np.array([5]))
+
+    assert [attention.asnumpy()[0, 0] for attention in attention_scores_list] == num_steps
+
+
+def test_greedy_search():
+    batch_size = 3
+    translator = _get_test_translator(batch_size=batch_size, beam_size=1)
+    model_state = sockeye.inference.ModelState(bucket_key=2,
+                                               prev_target_word_id=mx.nd.full((batch_size,), val=2),
+                                               decoder_states=[mx.nd.arange(batch_size)])
+    prev_word_ids = []
+    # decoder outputs are overwritten by each forward pass, like the outputs of an executor
+    attention_scores = mx.nd.zeros((batch_size, 2))
+
+    def run_decoders(states, models_output_layer_params):
+        prev_word_ids.append(states[0].prev_target_word_id.asnumpy().tolist())
+        attention_scores[:] = len(prev_word_ids) - 1
+        # probabilities over vocabulary: pad, unk, bos, eos, x
+        # sentence 0 stops immediately, sentence 1 generates x then stops, sentence 2 generates x until the limit
+        probs = np.full((batch_size, 5), 0.1)
+        step = len(prev_word_ids) - 1
+        probs[0, 3] = 0.6
+        probs[1, 4 if step == 0 else 3] = 0.6
+        probs[2, 4] = 0.6
+        return [mx.nd.array(probs)], [attention_scores], states
+
+    with patch.object(translator, "_encode", return_value=[model_state]), \
+            patch.object(translator, "_run_decoders", side_effect=run_decoders):
+        results = translator._greedy_search(mx.nd.zeros((batch_size, 2)), 2, np.array([4, 4, 3]))
+
+    # word ids are fed back without reordering states
+    assert prev_word_ids == [[2, 2, 2], [3, 4, 4], [3, 3, 4]]
+    assert [sequence for sequence, _, _ in results] == [[3], [4, 3], [4, 4, 4]]
+    assert [attention_matrix.shape for _, attention_matrix, _ in results] == [(1, 2), (2, 2), (3, 2)]
+    assert results[2][1][:, 0].tolist() == [0, 1, 2]
+    assert np.allclose([score for _, _, score in results], -np.log(0.6))
+
+
+def test_get_max_output_lengths():
+    translator = _get_test_translator(batch_size=3)
+    translator.max_output_length_factor = 1.5
+    source, _ = translator._get_inference_input([["a"], ["a", "b", "a"], ["b", "b"]])
+    assert (translator._get_max_output_lengths(source) == np.array([2, 5, 3])).all()
+
+
+def test_prefix_graph():
+    data = mx.sym.Variable(C.SOURCE_NAME)
+    hidden = mx.sym.FullyConnected(data=data, num_hidden=2, name="fc")
+    symbol = mx.sym.Group([hidden, mx.sym.relu(hidden, name="relu")])
+    prefixed = sockeye.inference._prefix_graph(symbol, C.ENSEMBLE_MEMBER_PREFIX % 1)
+    assert prefixed.list_arguments() == ["ensemble1_source", "ensemble1_fc_weight", "ensemble1_fc_bias"]
+    assert prefixed.list_outputs() == ["ensemble1_fc_output", "ensemble1_relu_output"]
+    # combined graphs of several members keep their parameters apart
+    combined = mx.sym.Group([prefixed, sockeye.inference._prefix_graph(symbol, C.ENSEMBLE_MEMBER_PREFIX % 2)])
+    assert len(set(combined.list_arguments())) == 6
+
+
+def _bounded_bucketing_module(max_buckets, seq_lens):
+
+    def sym_gen(seq_len):
+        data = mx.sym.Variable(C.SOURCE_NAME)
+        return mx.sym.FullyConnected(data=data, num_hidden=2, name="fc"), [C.SOURCE_NAME], []
+
+    module = sockeye.inference.BoundedBucketingModule(sym_gen, default_bucket_key=4, context=mx.cpu(),
+                                                      max_buckets=max_buckets)
+    module.bind(data_shapes=[mx.io.DataDesc(C.SOURCE_NAME, (4, 3))], for_training=False, grad_req="null")
+    module.init_params()
+    for seq_len in seq_lens:
+        # the bucket key varies the batch dimension only, such that all buckets share the weight shape
+        batch = mx.io.DataBatch(data=[mx.nd.ones((seq_len, 3))], label=None, bucket_key=seq_len,
+                                provide_data=[mx.io.DataDesc(C.SOURCE_NAME, (seq_len, 3))])
+        module.forward(batch, is_train=False)
+        assert module.get_outputs()[0].shape == (seq_len, 2)
+    return module
+
+
+def test_bounded_bucketing_module_releases_least_recently_used_bucket():
+    module = _bounded_bucketing_module(max_buckets=2, seq_lens=[1, 2, 1, 3, 4])
+    # bucket 2 is released when bucket 3 is bound, the default bucket is never released
+    assert sorted(module._bound_modules()) == [1, 3, 4]
+    assert module.num_binds == 4
+    assert module.num_releases == 1
+
+
+def test_bounded_bucketing_module_keeps_buckets_without_bound_modules():
+    with patch.object(sockeye.inference.BoundedBucketingModule, "_bound_modules", return_value=None):
+        module = _bounded_bucketing_module(max_buckets=1, seq_lens=[1, 2, 1, 3])
+    assert module.max_buckets is None
+    assert module.num_binds == 4
+    assert module.num_releases == 0
+
+
+@pytest.mark.parametrize("log_level, num_memory_calls", [(logging.INFO, 0), (logging.DEBUG, 3)])
+def test_bounded_bucketing_module_memory_only_with_debug_logging(log_level, num_memory_calls):
+    logger = logging.getLogger(sockeye.inference.__name__)
+    level = logger.level
+    logger.setLevel(log_level)
+    try:
+        with patch.object(sockeye.inference, "get_executor_memory_mb", return_value=1) as mock_memory:
+            _bounded_bucketing_module(max_buckets=2, seq_lens=[1, 2])
+    finally:
+        logger.setLevel(level)
+    assert mock_memory.call_count == num_memory_calls
+
+
+def test_get_executor_memory_mb():
+    module = _bounded_bucketing_module(max_buckets=None, seq_lens=[])
+    memory = sockeye.inference.get_executor_memory_mb(module._bound_modules()[4])
+    assert memory is None or memory >= 0
+    assert sockeye.inference.get_executor_memory_mb(object()) is None
+
+
+def test_bounded_bucketing_module_requires_one_bound_bucket():
+    with pytest.raises(sockeye.utils.SockeyeError):
+        sockeye.inference.BoundedBucketingModule(lambda seq_len: None, default_bucket_key=4, context=mx.cpu(),
+                                                 max_buckets=0)
+
+
+def test_warm_up():
+    translator = _get_test_translator(batch_size=2)
+    with patch.object(translator, "_encode", return_value=[]) as mock_encode, \
+            patch.object(translator, "_run_decoders") as mock_run_decoders:
+        translator.warm_up([3, 10, 25])
+    assert [call[0][1] for call in mock_encode.call_args_list] == [10, 20]
+    assert mock_encode.call_args_list[1][0][0].shape == (2, 20)
+    assert mock_run_decoders.call_count == 2
+
+
+@pytest.mark.parametrize("num_rows, max_rows, expected", [
+    (1, 10, 1), (2, 10, 2), (3, 10, 4), (5, 10, 8), (9, 10, 10), (10, 10, 10), (4, 4, 4)])
+def test_get_padded_num_rows(num_rows, max_rows, expected):
+    assert sockeye.inference.get_padded_num_rows(num_rows, max_rows) == expected
+
+
+def test_pad_rows():
+    word_ids = mx.nd.array([3, 4, 5], dtype='int32')
+    states = mx.nd.array(np.arange(6).reshape((3, 2)))
+    padded_word_ids, padded_states = sockeye.inference.pad_rows([word_ids, states], 4)
+    assert padded_word_ids.dtype == np.int32
+    assert padded_word_ids.asnumpy().tolist() == [3, 4, 5, 5]
+    assert padded_states.asnumpy().tolist() == [[0, 1], [2, 3], [4, 5], [4, 5]]
+    assert sockeye.inference.pad_rows([word_ids], 3)[0] is word_ids
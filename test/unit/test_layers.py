@@ -45,3 +45,22 @@ def test_layer_normalization():
     expected_norm = (x_np - expected_mean) / np.sqrt(expected_var)
 
     assert np.isclose(norm.asnumpy(), expected_norm, atol=1.e-6).all()
+
+
+def test_output_layer_restricted_vocabulary():
+    batch_size, num_hidden, vocab_size = 4, 8, 20
+    output_layer = sockeye.layers.OutputLayer(vocab_size=vocab_size, prefix="cls_")
+    hidden = mx.sym.Variable('hidden')
+    hidden_nd = mx.nd.uniform(-1, 1, (batch_size, num_hidden))
+    weight_nd = mx.nd.uniform(-1, 1, (vocab_size, num_hidden))
+    bias_nd = mx.nd.uniform(-1, 1, (vocab_size,))
+
+    logits = output_layer(hidden).eval(hidden=hidden_nd, cls_weight=weight_nd, cls_bias=bias_nd)[0]
+    assert logits.shape == (batch_size, vocab_size)
+
+    vocab_slice_ids = mx.nd.array([0, 3, 7, 19])
+    restricted_logits = output_layer(hidden_nd,
+                                     mx.nd.take(weight_nd, vocab_slice_ids),
+                                     mx.nd.take(bias_nd, vocab_slice_ids))
+    assert restricted_logits.shape == (batch_size, 4)
+    assert np.allclose(restricted_logits.asnumpy(), logits.asnumpy()[:, [0, 3, 7, 19]], atol=1e-6)
@@ -0,0 +1,64 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import math
+import os
+import tempfile
+
+import numpy as np
+
+import sockeye.constants as C
+import sockeye.lexicon
+
+
+def _make_vocab(words):
+    return {word: i for i, word in enumerate(C.VOCAB_SYMBOLS + words)}
+
+
+def test_topk_lexicon():
+    vocab_source = _make_vocab(["a", "b", "c"])
+    vocab_target = _make_vocab(["x", "y", "z", "w"])
+    lex_entries = [("a", "x", 0.7), ("a", "y", 0.2), ("a", "z", 0.1),
+                   ("b", "z", 0.6), ("b", "unknown_target", 0.4),
+                   ("unknown_source", "w", 1.0)]
+    with tempfile.TemporaryDirectory() as work_dir:
+        lex_path = os.path.join(work_dir, "lex.tsv")
+        json_path = os.path.join(work_dir, "lex.json")
+        with open(lex_path, "w") as out:
+            for src, trg, prob in lex_entries:
+                print(src, trg, math.log(prob), sep="\t", file=out)
+
+        lexicon = sockeye.lexicon.TopKLexicon(vocab_source, vocab_target, num_frequent=0)
+        lexicon.create(lex_path, k=2)
+        # most probable first, unknown target words dropped, missing entries padded
+        expected = np.zeros((len(vocab_source), 2), dtype='int32')
+        expected[vocab_source["a"]] = [vocab_target["x"], vocab_target["y"]]
+        expected[vocab_source["b"]] = [vocab_target["z"], C.PAD_ID]
+        assert (lexicon.lex == expected).all()
+
+        lexicon.save(json_path)
+        loaded_lexicon = sockeye.lexicon.TopKLexicon(vocab_source, vocab_target, num_frequent=0)
+        loaded_lexicon.load(json_path)
+        assert (loaded_lexicon.lex == expected).all()
+
+    specials = [vocab_target[symbol] for symbol in C.VOCAB_SYMBOLS]
+    trg_ids = lexicon.get_trg_ids(np.array([[vocab_source["a"], vocab_source["c"], C.PAD_ID]]))
+    assert trg_ids.tolist() == sorted(specials + [vocab_target["x"], vocab_target["y"]])
+    trg_ids = lexicon.get_trg_ids(np.array([vocab_source["b"]]))
+    assert trg_ids.tolist() == sorted(specials + [vocab_target["z"]])
+
+    # most frequent target words have the lowest ids after the special symbols
+    lexicon = sockeye.lexicon.TopKLexicon(vocab_source, vocab_target, num_frequent=1)
+    lexicon.lex = expected
+    trg_ids = lexicon.get_trg_ids(np.array([vocab_source["b"]]))
+    assert trg_ids.tolist() == sorted(specials + [vocab_target["x"], vocab_target["z"]])
@@ -12,9 +12,11 @@
 # permissions and limitations under the License.
 
 import io
+import json
 import pytest
 import numpy as np
-from sockeye.inference import TranslatorInput, TranslatorOutput
+from sockeye.inference import TranslatorInput, TranslatorOutput, TranslatorTimings
+import sockeye.constants as C
 import sockeye.output_handler
 
 stream_handler_tests = [(sockeye.output_handler.StringOutputHandler(io.StringIO()),
@@ -62,3 +64,57 @@ stream_handler_tests = [(sockeye.output_handler.StringOutputHandler(io.StringIO(
 def test_stream_output_handler(handler, translation_input, translation_output, translation_walltime, expected_string):
     handler.handle(translation_input, translation_output, translation_walltime)
     assert handler.stream.getvalue() == expected_string
+
+
+@pytest.mark.parametrize("output_type, reports_attention", [
+    (C.OUTPUT_HANDLER_TRANSLATION, False),
+    (C.OUTPUT_HANDLER_BENCHMARK, False),
+    (C.OUTPUT_HANDLER_TRANSLATION_WITH_ALIGNMENTS, True),
+    (C.OUTPUT_HANDLER_ALIGN_PLOT, True),
+    (C.OUTPUT_HANDLER_ALIGN_TEXT, True),
+])
+def test_output_handler_reports_attention(output_type, reports_attention):
+    output_handler = sockeye.output_handler.get_output_handler(output_type, None, 0.9)
+    assert output_handler.reports_attention() == reports_attention
+
+
+@pytest.mark.parametrize("output_type, reports_timings", [
+    (C.OUTPUT_HANDLER_TRANSLATION, False),
+    (C.OUTPUT_HANDLER_BENCHMARK, True),
+    (C.OUTPUT_HANDLER_JSON, True),
+    (C.OUTPUT_HANDLER_TRANSLATION_WITH_ALIGNMENTS, False),
+])
+def test_output_handler_reports_timings(output_type, reports_timings):
+    output_handler = sockeye.output_handler.get_output_handler(output_type, None, 0.9)
+    assert output_handler.reports_timings() == reports_timings
+
+
+def test_benchmark_output_handler_timings():
+    handler = sockeye.output_handler.BenchmarkOutputHandler(io.StringIO())
+    handler.handle(TranslatorInput(id=0, sentence="a test", tokens=["a", "test"]),
+                   TranslatorOutput(id=0, translation="ein Test", tokens=["ein", "Test"], attention_matrix=None,
+                                    score=0.),
+                   0.5,
+                   TranslatorTimings(0.001, 0.1, 3, 0.3, 0.05, 0.002))
+    assert handler.stream.getvalue() == "input=a test\toutput=ein Test\tinput_tokens=2\toutput_tokens=2\t" \
+                                        "translation_time=0.5000\tprepare_time=0.001000\tencode_time=0.100000\t" \
+                                        "decode_steps=3\tdecoder_forward_time=0.300000\tsearch_time=0.050000\t" \
+                                        "result_assembly_time=0.002000\n"
+
+
+def test_json_output_handler():
+    handler = sockeye.output_handler.JSONOutputHandler(io.StringIO())
+    trans_input = TranslatorInput(id=1, sentence="a test", tokens=["a", "test"])
+    handler.handle(trans_input,
+                   TranslatorOutput(id=1, translation="ein Test", tokens=["ein", "Test", "</s>"],
+                                    attention_matrix=None, score=0.25),
+                   0.5,
+                   TranslatorTimings(0.001, 0.1, 3, 0.3, 0.05, 0.002))
+    handler.handle(trans_input._replace(id=2, sentence="", tokens=[]),
+                   TranslatorOutput(id=2, translation="", tokens=[""], attention_matrix=None, score=-np.inf))
+    first, second = [json.loads(line) for line in handler.stream.getvalue().splitlines()]
+    assert first == {"id": 1, "input": "a test", "translation": "ein Test", "input_tokens": 2, "output_tokens": 3,
+                     "translation_time": 0.5, "score": 0.25,
+                     "timings": {"prepare": 0.001, "encode": 0.1, "decode_steps": 3, "decoder_forward": 0.3,
+                                 "search": 0.05, "result_assembly": 0.002}}
+    assert second["score"] is None and "timings" not in second
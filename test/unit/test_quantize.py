@@ -0,0 +1,56 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import mxnet as mx
+import numpy as np
+import pytest
+
+import sockeye.constants as C
+import sockeye.quantize
+from sockeye.utils import SockeyeError
+
+
+def _arg_params():
+    return {"source_embed_weight": mx.nd.uniform(-1, 1, (20, 8)),
+            "target_embed_weight": mx.nd.uniform(-1, 1, (20, 8)),
+            "decoder_cls_weight": mx.nd.uniform(-1, 1, (20, 16)),
+            "decoder_cls_bias": mx.nd.zeros((20,)),
+            "decoder_hidden_weight": mx.nd.uniform(-1, 1, (16, 32))}
+
+
+def test_quantize_selects_embedding_and_output_layer():
+    save_dict = sockeye.quantize.quantize(_arg_params(), {}, min_size=1)
+    quantized = sorted(name.split(":", 1)[1] for name in save_dict
+                       if name.startswith(C.PARAMS_QUANTIZED_VALUES_PREFIX + ":"))
+    assert quantized == ["decoder_cls_weight", "source_embed_weight", "target_embed_weight"]
+    assert "arg:decoder_hidden_weight" in save_dict
+    assert "arg:decoder_cls_bias" in save_dict
+
+
+def test_quantize_explicit_params():
+    save_dict = sockeye.quantize.quantize(_arg_params(), {}, dtype=C.QUANTIZE_FLOAT16,
+                                          names=["decoder_hidden_weight"], min_size=1)
+    assert save_dict["arg:decoder_hidden_weight"].dtype == np.float16
+    assert all(param.dtype != np.float16 for name, param in save_dict.items() if name != "arg:decoder_hidden_weight")
+
+
+def test_quantize_min_size():
+    save_dict = sockeye.quantize.quantize(_arg_params(), {}, min_size=200)
+    assert sorted(name for name in save_dict if name.startswith(C.PARAMS_QUANTIZED_VALUES_PREFIX + ":")) == \
+           ["%s:decoder_cls_weight" % C.PARAMS_QUANTIZED_VALUES_PREFIX]
+
+
+@pytest.mark.parametrize("names", [["missing_weight"], ["decoder_cls_bias"]])
+def test_quantize_invalid_params(names):
+    with pytest.raises(SockeyeError):
+        sockeye.quantize.quantize(_arg_params(), {}, names=names, min_size=1)
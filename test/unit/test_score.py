@@ -0,0 +1,47 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+from unittest.mock import Mock
+
+import numpy as np
+
+import sockeye.constants as C
+import sockeye.inference
+import sockeye.score
+
+VOCAB = {C.PAD_SYMBOL: C.PAD_ID, C.UNK_SYMBOL: 1, C.BOS_SYMBOL: 2, C.EOS_SYMBOL: 3, "a": 4, "b": 5}
+
+
+def _get_test_scorer(length_penalty=None):
+    model = Mock(spec=sockeye.score.ScoringModel)
+    model.batch_size = 2
+    model.buckets = [(2, 3), (4, 6)]
+    # the score of each row is the number of labels, i.e. the target length including EOS
+    model.run.side_effect = lambda source, target, label: (label != C.PAD_ID).sum(axis=1).astype('float32')
+    return sockeye.score.Scorer(model, VOCAB, VOCAB, length_penalty)
+
+
+def test_scorer_keeps_input_order():
+    scorer = _get_test_scorer()
+    scores = scorer.score(["a b", "a", "a b a", "", "a b a b a"], ["a b a", "b", "a", "a", "b"])
+    assert np.array_equal(scores[[0, 1, 2]], [4, 2, 2])
+    # empty source and pairs exceeding the largest bucket are not scored
+    assert np.isnan(scores[[3, 4]]).all()
+    assert scorer.num_skipped == 2
+    # batches of each bucket are filled up to the batch size
+    assert [call[0][0].shape for call in scorer.model.run.call_args_list] == [(2, 2), (2, 4)]
+
+
+def test_scorer_length_normalization():
+    scorer = _get_test_scorer(sockeye.inference.LengthPenalty(1.0, 0.0))
+    assert np.allclose(scorer.score(["a", "a b"], ["b", "a b a b"]), [1.0, 1.0])
@@ -0,0 +1,139 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import asyncio
+import json
+import os
+import sqlite3
+import unittest.mock
+
+import numpy as np
+import pytest
+
+import sockeye.inference
+import sockeye.serve
+import sockeye.translation_cache
+
+
+def _mock_translator(batch_size):
+    translator = unittest.mock.Mock(spec=sockeye.inference.Translator)
+    translator.batch_size = batch_size
+    translator.buckets = [2, 4]
+    translator.translate_batch.side_effect = lambda trans_inputs: [
+        sockeye.inference.TranslatorOutput(trans_input.id, trans_input.sentence.upper(), trans_input.tokens,
+                                           np.zeros((len(trans_input.tokens), 1)), -1.0)
+        for trans_input in trans_inputs]
+    return translator
+
+
+async def _request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    payload = b"" if body is None else json.dumps(body).encode("utf-8")
+    writer.write(("%s %s HTTP/1.1\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" %
+                  (method, path, len(payload))).encode("latin-1") + payload)
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ")[1]), json.loads(body.decode("utf-8"))
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+def test_micro_batching_by_bucket(loop):
+    translator = _mock_translator(batch_size=2)
+    batcher = sockeye.serve.MicroBatcher(translator, max_batch_size=2, max_wait=0.05)
+
+    async def run():
+        task = asyncio.ensure_future(batcher.run())
+        inputs = [sockeye.inference.Translator.make_input(i, sentence)
+                  for i, sentence in enumerate(["a", "a b c", "b", "c"], 1)]
+        futures = [batcher.translate(trans_input) for trans_input in inputs]
+        assert batcher.queue_depth == 4
+        outputs = await asyncio.gather(*futures)
+        task.cancel()
+        return outputs
+
+    outputs = loop.run_until_complete(run())
+    assert [output.translation for output in outputs] == ["A", "A B C", "B", "C"]
+    # the full bucket of short inputs is translated first, the remaining inputs after the maximum wait time
+    assert [[trans_input.id for trans_input in call[0][0]] for call in translator.translate_batch.call_args_list] == [
+        [1, 3], [2], [4]]
+    assert batcher.statistics.batch_sizes == {2: 1, 1: 2}
+
+
+def test_translation_server(loop):
+    translator = _mock_translator(batch_size=4)
+    server = sockeye.serve.TranslationServer(sockeye.serve.MicroBatcher(translator, max_batch_size=4, max_wait=0.01))
+
+    async def run():
+        http_server = await server.start(port=0)
+        port = http_server.sockets[0].getsockname()[1]
+        responses = await asyncio.gather(*[_request(port, "POST", "/translate", {"text": sentence})
+                                           for sentence in ["a b", "c", "d e"]])
+        errors = [await _request(port, "POST", "/translate", {"txt": "a"}),
+                  await _request(port, "GET", "/translate"),
+                  await _request(port, "GET", "/unknown")]
+        stats = await _request(port, "GET", "/stats")
+        await server.stop(http_server)
+        return responses, errors, stats
+
+    responses, errors, stats = loop.run_until_complete(run())
+    assert [status for status, _ in responses] == [200, 200, 200]
+    assert sorted(response["translation"] for _, response in responses) == ["A B", "C", "D E"]
+    assert sorted(response["tokens"] for _, response in responses) == [["a", "b"], ["c"], ["d", "e"]]
+    assert [status for status, _ in errors] == [400, 405, 404]
+    status, stats = stats
+    assert status == 200
+    assert stats["queue_depth"] == 0
+    assert stats["requests"] == 3
+    assert sum(stats["batch_sizes"].values()) == translator.translate_batch.call_count
+    assert set(stats["latency_ms"]) == {"p50", "p90", "p99"}
+
+
+def test_translation_server_stop_before_start(loop):
+    batcher = sockeye.serve.MicroBatcher(_mock_translator(batch_size=1), max_batch_size=1, max_wait=0.01)
+    server = sockeye.serve.TranslationServer(batcher)
+    assert server.batcher_task is None
+    loop.run_until_complete(server.stop())
+    assert server.batcher_task is None
+
+
+def test_micro_batcher_commits_cache_after_batch(loop, tmpdir):
+    translator = _mock_translator(batch_size=2)
+    path = os.path.join(str(tmpdir), "cache.db")
+    cache = sockeye.translation_cache.TranslationCache("fingerprint", path=path)
+    server = sockeye.serve.TranslationServer(sockeye.serve.MicroBatcher(translator, max_batch_size=2,
+                                                                        max_wait=0.01, cache=cache))
+
+    async def run():
+        task = asyncio.ensure_future(server.batcher.run())
+        outputs = await asyncio.gather(server.translate("a"), server.translate("b"))
+        cached_output = await server.translate("a")
+        task.cancel()
+        return outputs, cached_output
+
+    outputs, cached_output = loop.run_until_complete(run())
+    assert [output.translation for output in outputs] == ["A", "B"]
+    assert cached_output.translation == "A"
+    assert translator.translate_batch.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+    # results are visible to other connections without closing the cache
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT COUNT(*) FROM translations").fetchone()[0] == 2
+    cache.close()
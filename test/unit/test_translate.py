@@ -10,12 +10,17 @@
 # an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
 # express or implied. See the License for the specific language governing
 # permissions and limitations under the License.
+import argparse
 import io
+import os
+import time
 import unittest
 import unittest.mock
+from collections import Counter
 
 import pytest
 
+import sockeye.constants as C
 import sockeye.inference
 import sockeye.output_handler
 import sockeye.translate
@@ -26,7 +31,14 @@ TEST_DATA = "Test file line 1\n" \
 
 @pytest.fixture
 def mock_translator():
-    return unittest.mock.Mock(spec=sockeye.inference.Translator)
+    translator = unittest.mock.Mock(spec=sockeye.inference.Translator)
+    translator.batch_size = 1
+    translator.buckets = [10, 20]
+    translator.collect_timings = False
+    translator.make_input.side_effect = sockeye.inference.Translator.make_input
+    translator.translate_batch.side_effect = lambda trans_inputs: [unittest.mock.Mock(tokens=[])
+                                                                   for _ in trans_inputs]
+    return translator
 
 
 @pytest.fixture
@@ -50,8 +62,8 @@ def test_translate_by_file(mock_file, mock_translator, mock_output_handler):
     mock_translator.make_input.assert_any_call(1, "Test file line 1")
     mock_translator.make_input.assert_any_call(2, "Test file line 2")
 
-    # Ensure translate gets called twice.  Input here will be a dummy mocked result, so we'll ignore it.
-    assert mock_translator.translate.call_count == 2
+    # Ensure translate_batch gets called twice.  Input here will be a dummy mocked result, so we'll ignore it.
+    assert mock_translator.translate_batch.call_count == 2
 
 
 @unittest.mock.patch("sys.stdin", io.StringIO(TEST_DATA))
@@ -62,5 +74,107 @@ def test_translate_by_stdin(mock_translator, mock_output_handler):
     mock_translator.make_input.assert_any_call(1, "Test file line 1\n")
     mock_translator.make_input.assert_any_call(2, "Test file line 2\n")
 
-    # Ensure translate gets called twice.  Input here will be a dummy mocked result, so we'll ignore it.
-    assert mock_translator.translate.call_count == 2
+    # Ensure translate_batch gets called twice.  Input here will be a dummy mocked result, so we'll ignore it.
+    assert mock_translator.translate_batch.call_count == 2
+
+
+def test_translate_lines_sorted_chunks(mock_translator, mock_output_handler):
+    mock_translator.batch_size = 2
+    mock_translator.translate_batch.side_effect = lambda trans_inputs: [
+        sockeye.inference.TranslatorOutput(trans_input.id, trans_input.sentence, trans_input.tokens, None, 0.0)
+        for trans_input in trans_inputs]
+    source_data = ["a b c\n", "a\n", "a b c d\n", "a b\n", "\n"]
+    bucket_statistics = sockeye.translate.BucketStatistics()
+
+    num_lines, _ = sockeye.translate.translate_lines(mock_output_handler, source_data, mock_translator,
+                                                     chunk_size=3, bucket_statistics=bucket_statistics)
+
+    assert num_lines == 5
+    # first chunk is translated in length order: ["a", "a b c"], ["a b c d"]
+    assert [call[0][0] for call in mock_translator.translate_batch.call_args_list] == [
+        [sockeye.inference.TranslatorInput(2, "a", ["a"]), sockeye.inference.TranslatorInput(1, "a b c", ["a", "b", "c"])],
+        [sockeye.inference.TranslatorInput(3, "a b c d", ["a", "b", "c", "d"])],
+        [sockeye.inference.TranslatorInput(5, "", []), sockeye.inference.TranslatorInput(4, "a b", ["a", "b"])]]
+    # outputs are handled in the original order
+    assert [call[0][1].translation for call in mock_output_handler.handle.call_args_list] == [line.strip()
+                                                                                              for line in source_data]
+    assert bucket_statistics.num_sentences == {10: 5}
+    assert bucket_statistics.num_output_tokens == {10: 10}
+    assert len(bucket_statistics.latencies[10]) == 5
+    assert bucket_statistics.num_batches == {10: 3}
+    assert bucket_statistics.num_tokens == {10: 10}
+    assert bucket_statistics.num_positions == {10: 60}
+
+
+def _dying_worker(args, worker_id, input_queue, result_conn, return_attention, collect_timings):
+    # worker 0 dies on its first chunk, the others return upper-cased sentences
+    result_conn.send((worker_id, None, None, 0.0, None, None, None))
+    while True:
+        item = input_queue.get()
+        if item is None:
+            break
+        chunk_id, trans_inputs = item
+        if worker_id == 0:
+            os._exit(1)
+        timings = sockeye.inference.TranslatorTimings(0.1, 0.2, 3, 0.3, 0.4, 0.5) if collect_timings else None
+        results = [(trans_input.sentence.upper(), 0.0, timings) for trans_input in trans_inputs]
+        bucket_statistics = sockeye.translate.BucketStatistics()
+        bucket_statistics.add_batch(10, num_sentences=len(trans_inputs), num_tokens=2 * len(trans_inputs),
+                                    num_positions=10 * len(trans_inputs), batch_time=0.5)
+        result_conn.send((worker_id, chunk_id, results, 0.0, None, Counter(cache_hits=1, cache_misses=1),
+                          bucket_statistics))
+
+
+def test_worker_pool_ordered_output_with_dead_worker(mock_output_handler):
+    worker_pool = sockeye.translate.WorkerPool(argparse.Namespace(), num_workers=3, num_threads=1,
+                                               collect_timings=True, worker_main=_dying_worker)
+    source_data = ["line %d\n" % i for i in range(1, 11)]
+    try:
+        num_lines, _ = worker_pool.translate_lines(mock_output_handler, source_data, chunk_size=2)
+    finally:
+        worker_pool.close()
+
+    assert num_lines == 10
+    assert worker_pool.lookup_counts == {"cache_hits": 5, "cache_misses": 5}
+    assert [call[0][0].id for call in mock_output_handler.handle.call_args_list] == list(range(1, 11))
+    assert [call[0][1] for call in mock_output_handler.handle.call_args_list] == [line.strip().upper()
+                                                                                  for line in source_data]
+    # timings and bucket statistics of the workers are passed on
+    assert all(call[0][3].decode_steps == 3 for call in mock_output_handler.handle.call_args_list)
+    assert worker_pool.bucket_statistics.num_sentences == {10: 10}
+    assert worker_pool.bucket_statistics.num_batches == {10: 5}
+    assert worker_pool.bucket_statistics.latencies[10] == [0.5] * 10
+
+
+def _late_failing_worker(args, worker_id, input_queue, result_conn, return_attention, collect_timings):
+    # workers 0 and 1 translate chunks 0 and 1 slowly, worker 2 fails on its copy of chunk 0 after that chunk is written
+    result_conn.send((worker_id, None, None, 0.0, None, None, None))
+    while True:
+        item = input_queue.get()
+        if item is None:
+            break
+        chunk_id, trans_inputs = item
+        if worker_id == 2:
+            if chunk_id == 0:
+                time.sleep(1.0)
+                result_conn.send((worker_id, chunk_id, None, 0.0, "RuntimeError()", None, None))
+                continue
+        else:
+            time.sleep(0.5 if chunk_id == 0 else 2.0)
+        results = [(trans_input.sentence.upper(), 0.0, None) for trans_input in trans_inputs]
+        result_conn.send((worker_id, chunk_id, results, 0.0, None, Counter(), sockeye.translate.BucketStatistics()))
+
+
+def test_worker_pool_ignores_failure_of_written_chunk(mock_output_handler):
+    source_data = ["line 1\n", "line 2\n"]
+    with unittest.mock.patch.object(C, "TRANSLATE_MAX_CHUNK_FAILURES", 1), \
+            unittest.mock.patch.object(C, "TRANSLATE_WORKER_POLL_INTERVAL", 0.1):
+        worker_pool = sockeye.translate.WorkerPool(argparse.Namespace(), num_workers=3, num_threads=1,
+                                                   worker_main=_late_failing_worker)
+        try:
+            num_lines, _ = worker_pool.translate_lines(mock_output_handler, source_data, chunk_size=1)
+        finally:
+            worker_pool.close()
+
+    assert num_lines == 2
+    assert [call[0][1] for call in mock_output_handler.handle.call_args_list] == ["LINE 1", "LINE 2"]
@@ -0,0 +1,109 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import os
+import unittest.mock
+
+import numpy as np
+
+import sockeye.constants as C
+import sockeye.inference
+import sockeye.translate
+import sockeye.translation_cache
+
+
+def _make_output(trans_input: sockeye.inference.TranslatorInput) -> sockeye.inference.TranslatorOutput:
+    return sockeye.inference.TranslatorOutput(id=trans_input.id,
+                                              translation=trans_input.sentence.upper(),
+                                              tokens=[token.upper() for token in trans_input.tokens],
+                                              attention_matrix=np.ones((len(trans_input.tokens), 1)),
+                                              score=1.0)
+
+
+def test_translation_cache_lru_eviction():
+    cache = sockeye.translation_cache.TranslationCache("fingerprint", max_size=2)
+    inputs = [sockeye.inference.Translator.make_input(i, sentence) for i, sentence in enumerate(["a", "b", "c"])]
+    cache.put(inputs[0], _make_output(inputs[0]))
+    cache.put(inputs[1], _make_output(inputs[1]))
+    # access "a" such that "b" is least recently used
+    assert cache.get(sockeye.inference.Translator.make_input(5, "a")).id == 5
+    cache.put(inputs[2], _make_output(inputs[2]))
+
+    assert cache.get(inputs[0]).translation == "A"
+    assert cache.get(inputs[1]) is None
+    assert cache.get(inputs[2]).translation == "C"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_translation_cache_persistence(tmpdir):
+    path = os.path.join(str(tmpdir), "cache.db")
+    trans_input = sockeye.inference.Translator.make_input(1, "a  b")
+    cache = sockeye.translation_cache.TranslationCache("fingerprint", path=path)
+    cache.put(trans_input, _make_output(trans_input))
+    cache.close()
+
+    cache = sockeye.translation_cache.TranslationCache("fingerprint", path=path)
+    trans_output = cache.get(sockeye.inference.Translator.make_input(2, "a b"))
+    assert trans_output.id == 2
+    assert trans_output.tokens == ["A", "B"]
+    assert trans_output.attention_matrix.shape == (2, 1)
+    other_cache = sockeye.translation_cache.TranslationCache("other fingerprint", path=path)
+    assert other_cache.get(trans_input) is None
+
+
+def test_translation_cache_shared_by_processes(tmpdir):
+    path = os.path.join(str(tmpdir), "cache.db")
+    caches = [sockeye.translation_cache.TranslationCache("fingerprint", path=path) for _ in range(2)]
+    assert caches[0].db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    trans_inputs = [sockeye.inference.Translator.make_input(i, sentence) for i, sentence in enumerate(["a", "b"])]
+    for cache, trans_input in zip(caches, trans_inputs):
+        cache.put(trans_input, _make_output(trans_input))
+        cache.flush()
+    assert caches[0].get(trans_inputs[1]).tokens == ["B"]
+    assert caches[1].get(trans_inputs[0]).tokens == ["A"]
+    for cache in caches:
+        cache.close()
+
+
+def test_get_fingerprint(tmpdir):
+    model_folder = str(tmpdir)
+    with open(os.path.join(model_folder, C.PARAMS_BEST_NAME), "w") as out:
+        out.write("params")
+    fingerprint = sockeye.translation_cache.get_fingerprint([model_folder], None, dict(beam_size=5))
+    assert fingerprint == sockeye.translation_cache.get_fingerprint([model_folder], None, dict(beam_size=5))
+    assert fingerprint != sockeye.translation_cache.get_fingerprint([model_folder], None, dict(beam_size=10))
+    with open(os.path.join(model_folder, C.PARAMS_BEST_NAME), "w") as out:
+        out.write("new params")
+    assert fingerprint != sockeye.translation_cache.get_fingerprint([model_folder], None, dict(beam_size=5))
+
+
+def test_translate_lines_with_cache():
+    translator = unittest.mock.Mock(spec=sockeye.inference.Translator)
+    translator.batch_size = 2
+    translator.buckets = [10]
+    translator.collect_timings = False
+    translator.make_input.side_effect = sockeye.inference.Translator.make_input
+    translator.translate_batch.side_effect = lambda trans_inputs: [_make_output(trans_input)
+                                                                   for trans_input in trans_inputs]
+    output_handler = unittest.mock.Mock()
+    cache = sockeye.translation_cache.TranslationCache("fingerprint")
+
+    sockeye.translate.translate_lines(output_handler, ["a b\n", "c\n", "a b\n"], translator, chunk_size=2,
+                                      cache=cache)
+
+    # "a b" is translated once: the third line is served from the cache
+    assert [call[0][0] for call in translator.translate_batch.call_args_list] == [
+        [sockeye.inference.TranslatorInput(2, "c", ["c"]), sockeye.inference.TranslatorInput(1, "a b", ["a", "b"])]]
+    assert [call[0][1].id for call in output_handler.handle.call_args_list] == [1, 2, 3]
+    assert [call[0][1].translation for call in output_handler.handle.call_args_list] == ["A B", "C", "A B"]
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,111 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not
+# use this file except in compliance with the License. A copy of the License
+# is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is distributed on
+# an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import unittest.mock
+
+import numpy as np
+import pytest
+
+import sockeye.inference
+import sockeye.translate
+import sockeye.translation_memory
+
+SOURCES = ["the house is small\n", "the house is very small\n", "a cat sat on the mat\n", "hello\n"]
+TARGETS = ["das haus ist klein\n", "das haus ist sehr klein\n", "eine katze sass auf der matte\n", "hallo\n"]
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    ([], [], 0),
+    (["a"], [], 1),
+    (["a", "b", "c"], ["a", "b", "c"], 0),
+    (["a", "b", "c"], ["a", "x", "c"], 1),
+    (["a", "b", "c"], ["b", "c"], 1),
+    (["a", "b"], ["b", "a"], 2),
+])
+def test_edit_distance(a, b, expected):
+    assert sockeye.translation_memory.edit_distance(a, b) == expected
+    assert sockeye.translation_memory.edit_distance(b, a) == expected
+
+
+def test_translation_memory_lookup(tmpdir):
+    folder = str(tmpdir)
+    sockeye.translation_memory.build(SOURCES, TARGETS, folder)
+    tm = sockeye.translation_memory.TranslationMemory(folder, threshold=0.75)
+    assert len(tm) == 4
+    assert isinstance(tm.postings, np.memmap)
+    assert tm.get_segment(2) == ("a cat sat on the mat", "eine katze sass auf der matte")
+
+    assert tm.lookup("the house is small".split()) == (1.0, "the house is small", "das haus ist klein")
+    score, source, target = tm.lookup("a dog sat on the mat".split())
+    assert score == pytest.approx(5 / 6)
+    assert (source, target) == ("a cat sat on the mat", "eine katze sass auf der matte")
+    assert tm.lookup("hello".split()) == (1.0, "hello", "hallo")
+    assert tm.lookup("the dog is small".split()) == (0.75, "the house is small", "das haus ist klein")
+    assert tm.lookup("the dog is very tiny".split()) is None
+    assert tm.lookup("unknown words".split()) is None
+
+
+def test_translation_memory_deduplicates_sources(tmpdir):
+    folder = str(tmpdir)
+    sockeye.translation_memory.build(SOURCES + ["the house  is small\n"], TARGETS + ["das haus ist winzig\n"], folder)
+    tm = sockeye.translation_memory.TranslationMemory(folder)
+    assert len(tm) == 4
+    assert tm.lookup("the house is small".split()) == (1.0, "the house is small", "das haus ist klein")
+
+
+def test_translation_memory_exact_match_ignores_max_postings(tmpdir):
+    folder = str(tmpdir)
+    sockeye.translation_memory.build(SOURCES, TARGETS, folder)
+    tm = sockeye.translation_memory.TranslationMemory(folder, threshold=0.75, max_postings=0)
+    assert tm.lookup("a cat sat on the mat".split()) == (1.0, "a cat sat on the mat", "eine katze sass auf der matte")
+    assert tm.lookup("a dog sat on the mat".split()) is None
+
+
+def test_translation_memory_get(tmpdir):
+    folder = str(tmpdir)
+    sockeye.translation_memory.build(SOURCES, TARGETS, folder)
+    tm = sockeye.translation_memory.TranslationMemory(folder, threshold=0.8)
+    trans_output = tm.get(sockeye.inference.Translator.make_input(7, "the house is very  small"))
+    assert trans_output.id == 7
+    assert trans_output.translation == "das haus ist sehr klein"
+    assert trans_output.tokens == ["das", "haus", "ist", "sehr", "klein"]
+    assert trans_output.attention_matrix.shape == (5, 5)
+    assert not trans_output.attention_matrix.any()
+    assert trans_output.score == 1.0
+    assert tm.get(sockeye.inference.Translator.make_input(8, "")) is None
+    assert (tm.hits, tm.misses) == (1, 1)
+
+
+def test_translate_lines_with_translation_memory(tmpdir):
+    folder = str(tmpdir)
+    sockeye.translation_memory.build(SOURCES, TARGETS, folder)
+    tm = sockeye.translation_memory.TranslationMemory(folder, threshold=0.8)
+    translator = unittest.mock.Mock(spec=sockeye.inference.Translator)
+    translator.batch_size = 2
+    translator.buckets = [10]
+    translator.collect_timings = False
+    translator.make_input.side_effect = sockeye.inference.Translator.make_input
+    translator.translate_batch.side_effect = lambda trans_inputs: [
+        sockeye.inference.TranslatorOutput(trans_input.id, trans_input.sentence.upper(), trans_input.tokens,
+                                           np.ones((len(trans_input.tokens), 1)), 1.0)
+        for trans_input in trans_inputs]
+    output_handler = unittest.mock.Mock()
+
+    sockeye.translate.translate_lines(output_handler, ["a cat sat on the mat\n", "a b\n", "a b\n"], translator,
+                                      chunk_size=3, translation_memory=tm)
+
+    assert [call[0][0] for call in translator.translate_batch.call_args_list] == [
+        [sockeye.inference.TranslatorInput(2, "a b", ["a", "b"])]]
+    assert [call[0][1].translation for call in output_handler.handle.call_args_list] == [
+        "eine katze sass auf der matte", "A B", "A B"]
+    assert [call[0][1].id for call in output_handler.handle.call_args_list] == [1, 2, 3]
@@ -211,3 +211,53 @@ def test_save_and_load_params():
         assert "array" in loaded_aux_params
         assert np.isclose(loaded_arg_params['array'].asnumpy(), array.asnumpy()).all()
         assert np.isclose(loaded_aux_params['array'].asnumpy(), array.asnumpy()).all()
+
+
+def test_quantize_rows():
+    array = np.array([[-1.0, 0.0, 0.5, 1.0], [0.2, 0.3, 0.4, 0.5], [0.0, 0.0, 0.0, 0.0]], dtype='float32')
+    quantized, scales, zero_points = utils.quantize_rows(array)
+    assert quantized.dtype == np.uint8
+    assert scales.shape == zero_points.shape == (3,)
+    dequantized = utils.dequantize_rows(mx.nd.array(quantized, dtype='uint8'), mx.nd.array(scales),
+                                        mx.nd.array(zero_points)).asnumpy()
+    assert np.abs(dequantized - array).max() <= scales.max()
+    # zero is represented exactly
+    assert dequantized[0, 1] == 0.0
+    assert (dequantized[2] == 0.0).all()
+
+
+def test_load_quantized_params():
+    array = mx.nd.uniform(-1, 1, (10, 12))
+    quantized, scales, zero_points = utils.quantize_rows(array.asnumpy())
+    save_dict = {"arg:bias": mx.nd.ones((12,)),
+                 "arg:half": array.astype('float16'),
+                 "qarg:weight": mx.nd.array(quantized, dtype='uint8'),
+                 "qscale:weight": mx.nd.array(scales),
+                 "qzero:weight": mx.nd.array(zero_points)}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "params")
+        mx.nd.save(path, save_dict)
+        arg_params, aux_params = utils.load_params(path)
+    assert sorted(arg_params) == ["bias", "half", "weight"]
+    assert not aux_params
+    assert all(param.dtype == np.float32 for param in arg_params.values())
+    assert np.allclose(arg_params["half"].asnumpy(), array.asnumpy(), atol=1e-3)
+    assert np.allclose(arg_params["weight"].asnumpy(), array.asnumpy(), atol=scales.max())
+
+
+def test_params_mmap():
+    arg_params = {"weight": mx.nd.uniform(-1, 1, (10, 12)),
+                  "bias": np.arange(5, dtype='float32'),
+                  "half": np.ones((3, 3), dtype='float16')}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "params.mmap")
+        utils.save_params_mmap(arg_params, path)
+        arrays = utils.load_params_mmap(path)
+        assert sorted(arrays) == ["bias", "half", "weight"]
+        assert not any(array.flags.writeable for array in arrays.values())
+        params = utils.MappedParams(arrays)
+        assert "weight" in params and len(params) == 3
+        assert np.array_equal(params["weight"].asnumpy(), arg_params["weight"].asnumpy())
+        assert np.array_equal(params["bias"].asnumpy(), arg_params["bias"])
+        assert params["half"].dtype == np.float16
+        del arrays, params